@@ -49,11 +49,11 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'text', 'is_from_user', 'created_at',
             'token_count', 'processing_time', 'processing_time_display',
-            'model_used'
+            'stage_timings', 'model_used'
         ]
         read_only_fields = [
             'id', 'created_at', 'token_count', 
-            'processing_time', 'model_used'
+            'processing_time', 'stage_timings', 'model_used'
         ]
 
     def get_processing_time_display(self, obj):
@@ -141,18 +141,35 @@ class MessageCreateSerializer(serializers.ModelSerializer):
 
 
 class DocumentChunkSerializer(serializers.ModelSerializer):
-    """Document chunk serializer"""
+    """
+    Document chunk serializer.
+    
+    The embedding vector is only included when the serializer context has
+    include_embeddings=True, to keep document payloads small.
+    """
+    embedding = serializers.SerializerMethodField()
+    
     class Meta:
         model = DocumentChunk
         fields = [
             'id', 'content', 'chunk_index', 'total_chunks',
-            'character_count', 'created_at'
+            'character_count', 'created_at', 'embedding'
         ]
         read_only_fields = [
             'id', 'chunk_index', 'total_chunks', 
             'character_count', 'created_at'
         ]
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get('include_embeddings'):
+            fields.pop('embedding', None)
+        return fields
+
+    def get_embedding(self, obj):
+        """Embedding vector as a list of floats"""
+        return obj.get_embedding()
+
 
 class DocumentSerializer(serializers.ModelSerializer):
     """Document serializer with upload status"""
@@ -168,12 +185,12 @@ class DocumentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'filename', 'file_type', 'file_size',
             'uploaded_at', 'processing_status', 'processing_status_display',
-            'processed_at', 'processing_error', 'chunk_count',
+            'processed_at', 'processing_error', 'chunk_count', 'processing_progress',
             'user', 'chunks'
         ]
         read_only_fields = [
             'id', 'uploaded_at', 'processing_status', 'processed_at',
-            'processing_error', 'chunk_count', 'file_size'
+            'processing_error', 'chunk_count', 'processing_progress', 'file_size'
         ]
 
 
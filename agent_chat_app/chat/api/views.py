@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.db.models import Q, Prefetch
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
@@ -28,6 +29,7 @@ from .serializers import (
     DocumentUploadSerializer,
     UserSettingsSerializer,
 )
+from agent_chat_app.chat.tasks import process_document_task
 from .filters import ConversationFilter, MessageFilter, DocumentFilter
 
 
@@ -212,7 +214,15 @@ class MessageViewSet(viewsets.ReadOnlyModelViewSet):
     ),
     retrieve=extend_schema(
         description="Retrieve document details with chunks",
-        tags=['Documents']
+        tags=['Documents'],
+        parameters=[
+            OpenApiParameter(
+                name='include_embeddings',
+                type=OpenApiTypes.BOOL,
+                location=OpenApiParameter.QUERY,
+                description='Include chunk embedding vectors in the response'
+            ),
+        ]
     ),
     destroy=extend_schema(
         description="Delete a document and its chunks",
@@ -233,9 +243,13 @@ class DocumentViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Filter documents by authenticated user"""
+        chunks = DocumentChunk.objects.all()
+        if not self._include_embeddings():
+            # Embedding vectors are the bulk of each chunk row - skip loading them
+            chunks = chunks.defer('embedding')
         return Document.objects.filter(
             user=self.request.user
-        ).prefetch_related('chunks')
+        ).prefetch_related(Prefetch('chunks', queryset=chunks))
 
     def get_serializer_class(self):
         """Return appropriate serializer based on action"""
@@ -243,13 +257,32 @@ class DocumentViewSet(viewsets.ModelViewSet):
             return DocumentUploadSerializer
         return DocumentSerializer
 
+    def get_serializer_context(self):
+        """Pass the include_embeddings flag down to chunk serializers"""
+        context = super().get_serializer_context()
+        context['include_embeddings'] = self._include_embeddings()
+        return context
+
+    def _include_embeddings(self):
+        """Embeddings are opt-in via ?include_embeddings=true"""
+        if self.request is None:
+            return False
+        value = self.request.query_params.get('include_embeddings', '')
+        return value.lower() in ('1', 'true', 'yes')
+
     def perform_create(self, serializer):
         """Set user when creating document"""
         serializer.save(user=self.request.user)
 
     @extend_schema(
-        description="Reprocess a failed or pending document",
+        description=(
+            "Reprocess a failed or pending document. Completed documents (e.g. after the file "
+            "changed) are reprocessed with ?force=true; only changed chunks are re-embedded."
+        ),
         request=None,
+        parameters=[
+            OpenApiParameter('force', OpenApiTypes.BOOL, description="Reprocess a completed document")
+        ],
         responses={200: DocumentSerializer},
         tags=['Documents']
     )
@@ -257,8 +290,9 @@ class DocumentViewSet(viewsets.ModelViewSet):
     def reprocess(self, request, pk=None):
         """Reprocess a document"""
         document = self.get_object()
+        force = request.query_params.get('force', '').lower() in ('1', 'true', 'yes')
         
-        if document.processing_status == 'completed':
+        if document.processing_status == 'completed' and not force:
             return Response(
                 {'error': 'Document is already processed'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -269,7 +303,8 @@ class DocumentViewSet(viewsets.ModelViewSet):
         document.processing_error = ''
         document.save(update_fields=['processing_status', 'processing_error'])
         
-        # TODO: Trigger document processing task
+        # Queue only once the status change is committed
+        transaction.on_commit(lambda: process_document_task.delay(document.id))
         
         serializer = self.get_serializer(document)
         return Response(serializer.data)
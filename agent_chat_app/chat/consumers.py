@@ -1,12 +1,19 @@
 import json
 import asyncio
 import logging
+import time
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from . import conversation_history
+from .conversation_summary import maybe_schedule_summary
 from .models import Conversation, Message
 from .services import OllamaService
-from .hybrid_rag_service import HybridRAGService
+from .hybrid_rag_service import HybridRAGService, PreparedResponse
+from .generation_scheduler import get_generation_scheduler
+from .timing import timed
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +21,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.hybrid_rag_service = HybridRAGService()
+        # Running response generations, cancelled when the socket goes away
+        self.generation_tasks = set()
     
     async def connect(self):
         # Get conversation ID from URL
@@ -38,9 +47,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        
+        # Seed the rolling history window once; new messages are appended to it
+        await database_sync_to_async(conversation_history.get_history)(self.conversation_id)
         logger.info(f"WebSocket connected for conversation {self.conversation_id}")
 
     async def disconnect(self, close_code):
+        # Stop generating for a client that is gone; this closes the Ollama stream
+        for task in list(self.generation_tasks):
+            task.cancel()
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -86,7 +102,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 )
                 
                 # Generate AI response asynchronously
-                asyncio.create_task(self.generate_ai_response(message_content, selected_model, temp_instruction))
+                task = asyncio.create_task(self.generate_ai_response(message_content, selected_model, temp_instruction))
+                self.generation_tasks.add(task)
+                task.add_done_callback(self.generation_tasks.discard)
                 
         except json.JSONDecodeError:
             logger.error("Invalid JSON received in WebSocket")
@@ -94,47 +112,61 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error processing WebSocket message: {e}")
 
     async def generate_ai_response(self, user_message, selected_model=None, temp_instruction=None):
-        """Generate AI response in background using hybrid RAG"""
+        """Generate AI response in background using hybrid RAG, streaming tokens as they arrive"""
+        stream_id = uuid.uuid4().hex
+        streamed_parts = []
         try:
-            # Get enhanced AI response using hybrid RAG (this runs in a thread pool)
-            response_data = await asyncio.to_thread(
-                self.hybrid_rag_service.get_enhanced_response,
-                prompt=user_message,
-                model=selected_model if selected_model else None,
-                user_id=self.scope["user"].id,
-                custom_instruction=temp_instruction if temp_instruction else None,
-                conversation_id=self.conversation_id
+            # Retrieval, scoring and prompt building are blocking - run them in a thread
+            prepared, payload = await asyncio.to_thread(
+                self.prepare_generation,
+                user_message,
+                selected_model if selected_model else None,
+                temp_instruction if temp_instruction else None
             )
             
-            ai_response, response_metadata = response_data
+            timings = prepared.metadata.timings
+            if prepared.direct_response:
+                ai_response = prepared.direct_response
+            else:
+                # Wait for a free slot on the model; queued turns are served round-robin per user
+                queued_at = time.perf_counter()
+                async with get_generation_scheduler().slot(
+                    payload['model'], self.scope["user"].id, on_position=self.send_queue_position
+                ):
+                    timings['queue'] = round((time.perf_counter() - queued_at) * 1000, 3)
+                    with timed(timings, 'generate'):
+                        ai_response = await self.stream_tokens(payload, stream_id, streamed_parts)
             
-            # Format response with transparency information
-            formatted_response = self.hybrid_rag_service.format_response_with_transparency(
-                ai_response, response_metadata
+            await self.send_final_response(
+                ai_response, prepared.metadata, stream_id, model_used=payload['model'] if payload else ''
             )
             
-            # Save AI message to database
-            ai_message = await self.save_message(
-                conversation_id=self.conversation_id,
-                text=formatted_response,
-                is_from_user=False
-            )
+            if not prepared.direct_response:
+                await asyncio.to_thread(
+                    self.hybrid_rag_service.cache_response,
+                    user_message,
+                    ai_response,
+                    prepared.metadata,
+                    user_id=self.scope["user"].id,
+                    model=selected_model if selected_model else None,
+                    custom_instruction=temp_instruction if temp_instruction else None
+                )
             
-            # Send metadata as additional information
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'response_metadata',
-                    'metadata': {
-                        'knowledge_source': response_metadata.knowledge_source.value,
-                        'confidence_level': response_metadata.confidence.overall,
-                        'sources_used': len(response_metadata.rag_chunks_used),
-                        'fallback_used': response_metadata.fallback_used
-                    }
-                }
-            )
+        except asyncio.CancelledError:
+            # Client disconnected mid-generation: keep what was generated so far
+            if streamed_parts:
+                await self.save_message(
+                    conversation_id=self.conversation_id,
+                    text=''.join(streamed_parts),
+                    is_from_user=False
+                )
+            logger.info(f"Response generation cancelled for conversation {self.conversation_id}")
+            raise
             
-            # Stop typing indicator
+        except Exception as e:
+            logger.error(f"Error generating AI response: {e}")
+            
+            # Stop typing indicator even on error
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
@@ -143,22 +175,95 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 }
             )
             
-            # Send AI response to room group
+            # Send error message
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
-                    'type': 'chat_message',
-                    'message': formatted_response,
-                    'is_from_user': False,
-                    'timestamp': ai_message.created_at.isoformat(),
-                    'message_id': ai_message.id
+                    'type': 'error_message',
+                    'message': 'Sorry, I encountered an error generating a response.',
+                    'stream_id': stream_id
                 }
             )
-            
+    
+    def prepare_generation(self, user_message, model=None, custom_instruction=None):
+        """Blocking part of a turn: response cache lookup, hybrid RAG preparation and the Ollama payload"""
+        user_id = self.scope["user"].id
+        lookup_timings = {}
+        cached = self.hybrid_rag_service.get_cached_response(
+            user_message, user_id=user_id, model=model, custom_instruction=custom_instruction,
+            timings=lookup_timings
+        )
+        if cached:
+            response, metadata = cached
+            return PreparedResponse(prompt=user_message, metadata=metadata, direct_response=response), None
+        
+        try:
+            prepared = self.hybrid_rag_service.prepare_response(user_message, user_id=user_id)
         except Exception as e:
-            logger.error(f"Error generating AI response: {e}")
-            
-            # Stop typing indicator even on error
+            logger.error(f"Error in hybrid RAG preparation, answering without RAG: {e}")
+            prepared = PreparedResponse(
+                prompt=user_message,
+                metadata=self.hybrid_rag_service.fallback_metadata(str(e))
+            )
+        # A cache miss still took its lookup time
+        prepared.metadata.timings.update(lookup_timings)
+        
+        if prepared.direct_response:
+            return prepared, None
+        
+        payload = OllamaService.build_generate_payload(
+            prepared.prompt,
+            model=model,
+            user_id=user_id,
+            use_rag=False,  # Hybrid RAG already retrieved the chunks
+            custom_instruction=custom_instruction,
+            conversation_id=self.conversation_id,
+            stream=True,
+            rag_chunks=prepared.context_chunks
+        )
+        return prepared, payload
+    
+    async def stream_tokens(self, payload, stream_id, streamed_parts):
+        """
+        Forward Ollama's token stream to the group as chat_token events.
+        
+        Fragments are coalesced per flush interval, and the next fragment is
+        only read after the previous send completed, so a slow channel layer
+        slows down reading instead of piling up messages.
+        """
+        flush_interval = getattr(settings, 'CHAT_STREAM_FLUSH_INTERVAL', 0.05)
+        loop = asyncio.get_running_loop()
+        pending = []
+        last_flush = loop.time()
+        first_token = True
+        
+        async for fragment in OllamaService.stream_response(payload):
+            streamed_parts.append(fragment)
+            pending.append(fragment)
+            if first_token or loop.time() - last_flush >= flush_interval:
+                await self.send_token(stream_id, ''.join(pending), first_token)
+                pending.clear()
+                last_flush = loop.time()
+                first_token = False
+        
+        if pending:
+            await self.send_token(stream_id, ''.join(pending), first_token)
+        
+        return ''.join(streamed_parts)
+    
+    async def send_queue_position(self, position):
+        """Tell the client where its request waits in the model queue (0 = started)"""
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'queue_position',
+                'position': position
+            }
+        )
+    
+    async def send_token(self, stream_id, text, first_token=False):
+        if first_token:
+            # The streamed bubble replaces the typing indicator
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
@@ -166,15 +271,72 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'is_typing': False
                 }
             )
-            
-            # Send error message
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'error_message',
-                    'message': 'Sorry, I encountered an error generating a response.'
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'chat_token',
+                'stream_id': stream_id,
+                'token': text
+            }
+        )
+    
+    async def send_final_response(self, ai_response, response_metadata, stream_id, model_used=''):
+        """Persist the finished response once and publish it with its metadata"""
+        # Format response with transparency information
+        formatted_response = self.hybrid_rag_service.format_response_with_transparency(
+            ai_response, response_metadata
+        )
+        
+        # Save AI message to database, with what the turn cost per stage
+        ai_message = await self.save_message(
+            conversation_id=self.conversation_id,
+            text=formatted_response,
+            is_from_user=False,
+            processing_time=response_metadata.processing_time,
+            stage_timings=response_metadata.timings,
+            model_used=model_used
+        )
+        logger.info(f"Response for conversation {self.conversation_id} stage timings (ms): {response_metadata.timings}")
+        
+        # Send metadata as additional information
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'response_metadata',
+                'metadata': {
+                    'knowledge_source': response_metadata.knowledge_source.value,
+                    'confidence_level': response_metadata.confidence.overall,
+                    'sources_used': len(response_metadata.rag_chunks_used),
+                    'fallback_used': response_metadata.fallback_used,
+                    'timings': response_metadata.timings
                 }
-            )
+            }
+        )
+        
+        # Stop typing indicator
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'typing_indicator',
+                'is_typing': False
+            }
+        )
+        
+        # Send AI response to room group; replaces the streamed draft
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'chat_message',
+                'message': formatted_response,
+                'is_from_user': False,
+                'timestamp': ai_message.created_at.isoformat(),
+                'message_id': ai_message.id,
+                'stream_id': stream_id
+            }
+        )
+        
+        # Fold older turns into the rolling summary in the background
+        await self.schedule_summary()
 
     # Receive message from room group
     async def chat_message(self, event):
@@ -183,7 +345,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message': event['message'],
             'is_from_user': event['is_from_user'],
             'timestamp': event['timestamp'],
-            'message_id': event['message_id']
+            'message_id': event['message_id'],
+            'stream_id': event.get('stream_id')
+        }))
+
+    async def chat_token(self, event):
+        """Send an incremental piece of a streamed AI response"""
+        await self.send(text_data=json.dumps({
+            'type': 'chat_token',
+            'stream_id': event['stream_id'],
+            'token': event['token']
+        }))
+
+    async def queue_position(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'queue_position',
+            'position': event['position']
         }))
 
     async def typing_indicator(self, event):
@@ -195,7 +372,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def error_message(self, event):
         await self.send(text_data=json.dumps({
             'type': 'error_message',
-            'message': event['message']
+            'message': event['message'],
+            'stream_id': event.get('stream_id')
         }))
 
     async def response_metadata(self, event):
@@ -218,11 +396,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return False
 
     @database_sync_to_async
-    def save_message(self, conversation_id, text, is_from_user):
-        """Save message to database"""
+    def schedule_summary(self):
+        """Queue conversation summarization once enough new messages piled up"""
+        try:
+            maybe_schedule_summary(self.conversation_id)
+        except Exception as e:
+            logger.warning(f"Could not schedule summary for conversation {self.conversation_id}: {e}")
+
+    @database_sync_to_async
+    def save_message(self, conversation_id, text, is_from_user, **fields):
+        """Save message to database (the post_save receiver appends it to the cached history)"""
         conversation = Conversation.objects.get(id=conversation_id)
         return Message.objects.create(
             conversation=conversation,
             text=text,
-            is_from_user=is_from_user
+            is_from_user=is_from_user,
+            **fields
         )
\ No newline at end of file
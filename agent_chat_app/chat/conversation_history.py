@@ -0,0 +1,130 @@
+"""
+Rolling per-conversation history window kept in the Django cache.
+
+The window holds the most recent LLM_MAX_HISTORY_MESSAGES messages of a
+conversation so building a prompt does not query the messages table every
+turn. It is seeded from the database on first read (the chat consumer
+reads it on connect), new messages are appended by a Message post_save
+receiver and deleting a message drops the window. Any cache failure falls
+back to the database.
+"""
+
+import logging
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Sequence
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Message, conversation_history_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HistoryEntry:
+    """The fields of a Message that prompt building needs"""
+    pk: int
+    text: str
+    is_from_user: bool
+    token_count: Optional[int] = None
+    token_counter: str = ''
+
+    @classmethod
+    def from_message(cls, message) -> 'HistoryEntry':
+        return cls(
+            pk=message.pk,
+            text=message.text,
+            is_from_user=message.is_from_user,
+            token_count=message.token_count,
+            token_counter=message.token_counter
+        )
+
+
+def _max_messages() -> int:
+    return getattr(settings, 'LLM_MAX_HISTORY_MESSAGES', 20)
+
+
+def _ttl() -> int:
+    return getattr(settings, 'CONVERSATION_CACHE_TTL', 60 * 15)
+
+
+def _store(conversation_id: int, entries: Sequence[HistoryEntry]) -> None:
+    try:
+        cache.set(
+            conversation_history_cache_key(conversation_id),
+            [asdict(entry) for entry in entries[-_max_messages():]],
+            _ttl()
+        )
+    except Exception as e:
+        logger.warning(f"Could not cache history of conversation {conversation_id}: {e}")
+
+
+def load_history(conversation_id: int) -> List[HistoryEntry]:
+    """Read the window from the database"""
+    recent_messages = Message.objects.filter(
+        conversation_id=conversation_id
+    ).only('id', 'text', 'is_from_user', 'token_count', 'token_counter').order_by('-created_at')[:_max_messages()]
+    return [HistoryEntry.from_message(message) for message in reversed(recent_messages)]
+
+
+def get_history(conversation_id: int) -> List[HistoryEntry]:
+    """
+    Recent messages of a conversation in chronological order, read from the
+    cached window; a missing window is loaded from the database and cached.
+    """
+    try:
+        cached = cache.get(conversation_history_cache_key(conversation_id))
+        if cached is not None:
+            return [HistoryEntry(**entry) for entry in cached]
+    except Exception as e:
+        logger.warning(f"Could not read history of conversation {conversation_id} from cache: {e}")
+
+    entries = load_history(conversation_id)
+    _store(conversation_id, entries)
+    return entries
+
+
+def append_message(message) -> None:
+    """
+    Add a new message to a cached window.
+
+    A conversation without a cached window is left alone; the next read
+    seeds it from the database, which already holds the message.
+    """
+    key = conversation_history_cache_key(message.conversation_id)
+    try:
+        cached = cache.get(key)
+        if cached is None:
+            return
+        if any(entry['pk'] == message.pk for entry in cached):
+            return
+        cached.append(asdict(HistoryEntry.from_message(message)))
+        cache.set(key, cached[-_max_messages():], _ttl())
+    except Exception as e:
+        logger.warning(f"Could not append message to history of conversation {message.conversation_id}: {e}")
+        try:
+            cache.delete(key)
+        except Exception:
+            pass
+
+
+def update_token_counts(conversation_id: int, entries: Sequence[HistoryEntry]) -> None:
+    """Write token counts computed during prompt assembly back to the cached window"""
+    counts = {
+        entry.pk: (entry.token_count, entry.token_counter)
+        for entry in entries if entry.token_count is not None
+    }
+    if not counts:
+        return
+    key = conversation_history_cache_key(conversation_id)
+    try:
+        cached = cache.get(key)
+        if cached is None:
+            return
+        for entry in cached:
+            if entry['pk'] in counts:
+                entry['token_count'], entry['token_counter'] = counts[entry['pk']]
+        cache.set(key, cached, _ttl())
+    except Exception as e:
+        logger.warning(f"Could not update token counts of conversation {conversation_id}: {e}")
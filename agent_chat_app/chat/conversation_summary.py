@@ -0,0 +1,165 @@
+"""
+Rolling summaries of long conversations.
+
+Turns older than the most recent CONVERSATION_SUMMARY_KEEP_RECENT messages
+are folded into Conversation.summary by a Celery task, a batch at a time.
+Each run merges the previous summary with the next unsummarized turns, so
+the work per run stays bounded. Prompt building sends the summary plus only
+the messages after summary_through_message_id, which keeps prompt size flat
+however long the conversation gets.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from agent_chat_app.core.ollama_client import get_ollama_client
+from .models import Conversation, Message, conversation_summary_cache_key
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an AI assistant.\n"
+    "Update the summary with the new messages. Keep facts, names, numbers, decisions and open "
+    "questions; drop small talk. Write at most {max_words} words in the language of the conversation. "
+    "Reply with the summary only.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New messages:\n{messages}\n\n"
+    "Updated summary:"
+)
+
+
+@dataclass
+class ConversationSummary:
+    """The stored summary and the last message it covers"""
+    text: str = ""
+    through_message_id: Optional[int] = None
+
+
+def _keep_recent() -> int:
+    return getattr(settings, 'CONVERSATION_SUMMARY_KEEP_RECENT', 10)
+
+
+def _summarize_every() -> int:
+    return getattr(settings, 'CONVERSATION_SUMMARY_EVERY', 10)
+
+
+def get_summary(conversation_id: int) -> ConversationSummary:
+    """The conversation's summary, cached until the summarization task replaces it"""
+    key = conversation_summary_cache_key(conversation_id)
+    try:
+        cached = cache.get(key)
+        if cached is not None:
+            return ConversationSummary(**cached)
+    except Exception as e:
+        logger.warning(f"Could not read summary of conversation {conversation_id} from cache: {e}")
+
+    row = Conversation.objects.filter(pk=conversation_id).values('summary', 'summary_through_message_id').first()
+    summary = ConversationSummary(
+        text=row['summary'] if row else "",
+        through_message_id=row['summary_through_message_id'] if row else None
+    )
+    _cache_summary(conversation_id, summary)
+    return summary
+
+
+def _cache_summary(conversation_id: int, summary: ConversationSummary) -> None:
+    try:
+        cache.set(
+            conversation_summary_cache_key(conversation_id),
+            {'text': summary.text, 'through_message_id': summary.through_message_id},
+            getattr(settings, 'CONVERSATION_CACHE_TTL', 60 * 15)
+        )
+    except Exception as e:
+        logger.warning(f"Could not cache summary of conversation {conversation_id}: {e}")
+
+
+def unsummarized_messages(conversation_id: int, through_message_id: Optional[int]):
+    """Messages after the summary, oldest first"""
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    if through_message_id:
+        messages = messages.filter(id__gt=through_message_id)
+    return messages.order_by('created_at', 'id')
+
+
+def summary_schedule_lock_key(conversation_id: int) -> str:
+    return f"conversation_summary_scheduled_{conversation_id}"
+
+
+def maybe_schedule_summary(conversation_id: int) -> bool:
+    """
+    Queue the summarization task once CONVERSATION_SUMMARY_EVERY messages
+    have piled up beyond the recent ones that are sent verbatim.
+    """
+    summary = get_summary(conversation_id)
+    pending = unsummarized_messages(conversation_id, summary.through_message_id).count()
+    if pending < _keep_recent() + _summarize_every():
+        return False
+
+    # One queued run per conversation at a time
+    try:
+        if not cache.add(summary_schedule_lock_key(conversation_id), True, 60 * 10):
+            return False
+    except Exception as e:
+        logger.warning(f"Could not take summary schedule lock: {e}")
+
+    from .tasks import summarize_conversation_task
+    summarize_conversation_task.delay(conversation_id)
+    return True
+
+
+def format_messages(messages) -> str:
+    return "\n".join(
+        f"{'User' if message.is_from_user else 'Assistant'}: {message.text}" for message in messages
+    )
+
+
+def summarize_conversation(conversation_id: int, max_messages: int = None) -> Optional[ConversationSummary]:
+    """
+    Fold the next batch of older turns into the stored summary.
+
+    Returns the new summary, or None when there was nothing to summarize.
+    Raises httpx.HTTPError if the model call fails.
+    """
+    if max_messages is None:
+        max_messages = getattr(settings, 'CONVERSATION_SUMMARY_BATCH_SIZE', 40)
+
+    conversation = Conversation.objects.only('id', 'summary', 'summary_through_message_id').get(pk=conversation_id)
+    pending = unsummarized_messages(conversation_id, conversation.summary_through_message_id)
+    # The most recent messages stay verbatim in the prompt
+    batch_size = min(max_messages, pending.count() - _keep_recent())
+    if batch_size <= 0:
+        return None
+    older = list(pending.only('id', 'text', 'is_from_user')[:batch_size])
+
+    max_words = getattr(settings, 'CONVERSATION_SUMMARY_MAX_WORDS', 250)
+    prompt = SUMMARY_PROMPT.format(
+        max_words=max_words,
+        summary=conversation.summary or "(none yet)",
+        messages=format_messages(older)
+    )
+    payload = {
+        "model": getattr(settings, 'CONVERSATION_SUMMARY_MODEL', 'gemma3:4b'),
+        "prompt": prompt,
+        "stream": False,
+        "options": {"temperature": 0.2, "num_predict": max_words * 2}
+    }
+    response = get_ollama_client().post("/api/generate", json=payload)
+    text = response.json().get("response", "").strip()
+    if not text:
+        raise ValueError("Empty summary returned by the model")
+
+    summary = ConversationSummary(text=text, through_message_id=older[-1].id)
+    # update() leaves Conversation.updated_at (the conversation list order) alone
+    Conversation.objects.filter(pk=conversation_id).update(
+        summary=summary.text,
+        summary_through_message_id=summary.through_message_id,
+        summary_updated_at=timezone.now()
+    )
+    _cache_summary(conversation_id, summary)
+    logger.info(f"Summarized {len(older)} messages of conversation {conversation_id}")
+    return summary
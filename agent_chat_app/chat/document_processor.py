@@ -1,6 +1,11 @@
+import codecs
 import os
 import logging
-from typing import List, Dict, Any
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, Tuple
 from pathlib import Path
 
 try:
@@ -13,27 +18,145 @@ except ImportError as e:
 
 logger = logging.getLogger(__name__)
 
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract the texts of pages [start, end) - runs in a pool process"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        texts = []
+        for page_number in range(start, end):
+            try:
+                texts.append(pdf_reader.pages[page_number].extract_text() or "")
+            except Exception as e:
+                logger.warning(f"Could not extract page {page_number + 1} of {file_path}: {e}")
+                texts.append("")
+        return texts
+
+
+_pdf_pool = None
+_pdf_pool_workers = 0
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool for PDF page extraction, shared by all documents in a process"""
+    global _pdf_pool, _pdf_pool_workers
+    with _pdf_pool_lock:
+        if _pdf_pool is None or _pdf_pool_workers != max_workers:
+            if _pdf_pool is not None:
+                _pdf_pool.shutdown(wait=False)
+            # spawn: workers never inherit sockets or locks from a threaded parent
+            _pdf_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+            _pdf_pool_workers = max_workers
+        return _pdf_pool
+
+
+def _discard_pdf_pool() -> None:
+    global _pdf_pool, _pdf_pool_lock
+    # A fork may have copied the lock in a held state; the parent's pool is not ours
+    _pdf_pool_lock = threading.Lock()
+    _pdf_pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_discard_pdf_pool)
+
+
 class DocumentProcessor:
     """Process various document types for RAG"""
     
+    # Bytes read per block from text files
+    TEXT_BLOCK_SIZE = 64 * 1024
+    # Chunks' worth of text buffered before splitting
+    SPLIT_BUFFER_CHUNKS = 20
+    
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+        from django.conf import settings
+        
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.pdf_parallel_min_pages = getattr(settings, 'PDF_PARALLEL_MIN_PAGES', 50)
+        self.pdf_page_range_size = getattr(settings, 'PDF_PAGE_RANGE_SIZE', 20)
+        self.pdf_workers = getattr(settings, 'PDF_EXTRACTION_WORKERS', min(4, os.cpu_count() or 1))
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             length_function=len,
         )
     
+    @staticmethod
+    def count_pdf_pages(file_path: str) -> int:
+        with open(file_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+    
+    def iter_pdf_pages(self, file_path: str, page_count: int = None) -> Iterator[str]:
+        """
+        Yield the text of each PDF page in order.
+        
+        Large PDFs are split into page ranges extracted in parallel on a
+        process pool; ranges are yielded as soon as they and all earlier
+        ones are done, so consumers can start before extraction finishes.
+        Daemonic processes (Celery prefork children) may not start a pool
+        and extract serially, as does any range the pool cannot take.
+        Pass page_count when the caller already has it to skip a parse.
+        """
+        if page_count is None:
+            page_count = self.count_pdf_pages(file_path)
+        
+        if (self.pdf_workers <= 1 or page_count < self.pdf_parallel_min_pages
+                or multiprocessing.current_process().daemon):
+            yield from _extract_pdf_page_range(file_path, 0, page_count)
+            return
+        
+        ranges = [
+            (start, min(start + self.pdf_page_range_size, page_count))
+            for start in range(0, page_count, self.pdf_page_range_size)
+        ]
+        try:
+            pool = _get_pdf_pool(self.pdf_workers)
+        except Exception as e:
+            logger.warning(f"PDF process pool unavailable, extracting serially: {e}")
+            yield from _extract_pdf_page_range(file_path, 0, page_count)
+            return
+        
+        # Keep a bounded number of ranges in flight so memory does not grow with the page count
+        pending = deque()
+        next_range = 0
+        try:
+            while next_range < len(ranges) or pending:
+                while next_range < len(ranges) and len(pending) < self.pdf_workers * 2:
+                    start, end = ranges[next_range]
+                    future = None
+                    if pool is not None:
+                        try:
+                            # The pool starts its processes on the first submit, which can fail
+                            future = pool.submit(_extract_pdf_page_range, file_path, start, end)
+                        except Exception as e:
+                            logger.warning(f"PDF process pool unavailable, extracting serially: {e}")
+                            pool = None
+                    pending.append((start, end, future))
+                    next_range += 1
+                
+                start, end, future = pending.popleft()
+                if future is None:
+                    yield from _extract_pdf_page_range(file_path, start, end)
+                    continue
+                try:
+                    texts = future.result()
+                except Exception as e:
+                    logger.warning(f"Parallel extraction of pages {start + 1}-{end} failed, retrying serially: {e}")
+                    texts = _extract_pdf_page_range(file_path, start, end)
+                yield from texts
+        finally:
+            # Consumer stopped early (or failed): drop ranges nobody will read
+            for _, _, future in pending:
+                if future is not None:
+                    future.cancel()
+    
     def extract_text_from_pdf(self, file_path: str) -> str:
         """Extract text from PDF file"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+            return "".join(f"{page_text}\n" for page_text in self.iter_pdf_pages(file_path))
         except Exception as e:
             logger.error(f"Error extracting text from PDF {file_path}: {e}")
             return ""
@@ -42,10 +165,7 @@ class DocumentProcessor:
         """Extract text from DOCX file"""
         try:
             doc = DocxDocument(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            return "".join(f"{paragraph.text}\n" for paragraph in doc.paragraphs)
         except Exception as e:
             logger.error(f"Error extracting text from DOCX {file_path}: {e}")
             return ""
@@ -53,16 +173,7 @@ class DocumentProcessor:
     def extract_text_from_xlsx(self, file_path: str) -> str:
         """Extract text from Excel file"""
         try:
-            workbook = openpyxl.load_workbook(file_path)
-            text = ""
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                text += f"Sheet: {sheet_name}\n"
-                for row in sheet.iter_rows(values_only=True):
-                    row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
-                    if row_text.strip():
-                        text += row_text + "\n"
-            return text
+            return "".join(text for text, _ in self.iter_xlsx_segments(file_path))
         except Exception as e:
             logger.error(f"Error extracting text from Excel {file_path}: {e}")
             return ""
@@ -76,44 +187,137 @@ class DocumentProcessor:
             logger.error(f"Error reading text file {file_path}: {e}")
             return ""
     
-    def process_document(self, file_path: str, filename: str = None) -> List[Dict[str, Any]]:
-        """Process a document and return chunks with metadata"""
-        if not filename:
-            filename = os.path.basename(file_path)
+    def iter_pdf_segments(self, file_path: str) -> Iterator[Tuple[str, float]]:
+        page_count = self.count_pdf_pages(file_path)
+        for page_number, page_text in enumerate(self.iter_pdf_pages(file_path, page_count), 1):
+            yield f"{page_text}\n", page_number / page_count
+    
+    def iter_docx_segments(self, file_path: str) -> Iterator[Tuple[str, float]]:
+        paragraphs = DocxDocument(file_path).paragraphs
+        for number, paragraph in enumerate(paragraphs, 1):
+            yield f"{paragraph.text}\n", number / len(paragraphs)
+    
+    def iter_xlsx_segments(self, file_path: str) -> Iterator[Tuple[str, float]]:
+        # read_only streams rows from the archive instead of loading every cell
+        workbook = openpyxl.load_workbook(file_path, read_only=True)
+        try:
+            sheet_names = workbook.sheetnames
+            for sheet_number, sheet_name in enumerate(sheet_names):
+                sheet = workbook[sheet_name]
+                # max_row comes from the sheet's stored dimensions and may be missing
+                row_count = sheet.max_row or 0
+                yield f"Sheet: {sheet_name}\n", sheet_number / len(sheet_names)
+                for row_number, row in enumerate(sheet.iter_rows(values_only=True), 1):
+                    row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
+                    if row_text.strip():
+                        sheet_progress = min(row_number / row_count, 1.0) if row_count else 0.0
+                        yield f"{row_text}\n", (sheet_number + sheet_progress) / len(sheet_names)
+        finally:
+            workbook.close()
+    
+    def iter_txt_segments(self, file_path: str) -> Iterator[Tuple[str, float]]:
+        size = os.path.getsize(file_path) or 1
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        with open(file_path, 'rb') as file:
+            while True:
+                block = file.read(self.TEXT_BLOCK_SIZE)
+                text = decoder.decode(block, final=not block)
+                if text:
+                    yield text, file.tell() / size
+                if not block:
+                    return
+    
+    def iter_text_segments(self, file_path: str) -> Iterator[Tuple[str, float]]:
+        """
+        Yield (text, progress) pieces of a document in reading order.
         
+        progress is the fraction of the source consumed so far (0-1).
+        Unsupported file types yield nothing.
+        """
         file_extension = Path(file_path).suffix.lower()
-        
-        # Extract text based on file type
-        if file_extension == '.pdf':
-            text = self.extract_text_from_pdf(file_path)
-        elif file_extension == '.docx':
-            text = self.extract_text_from_docx(file_path)
-        elif file_extension == '.xlsx':
-            text = self.extract_text_from_xlsx(file_path)
-        elif file_extension == '.txt':
-            text = self.extract_text_from_txt(file_path)
-        else:
+        extractors = {
+            '.pdf': self.iter_pdf_segments,
+            '.docx': self.iter_docx_segments,
+            '.xlsx': self.iter_xlsx_segments,
+            '.txt': self.iter_txt_segments,
+        }
+        if file_extension not in extractors:
             logger.warning(f"Unsupported file type: {file_extension}")
-            return []
+            return iter(())
+        return extractors[file_extension](file_path)
+    
+    def iter_chunks(self, file_path: str, filename: str = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield chunks with metadata while the document is still being read.
         
-        if not text.strip():
-            logger.warning(f"No text extracted from {filename}")
-            return []
+        Text is buffered until it holds about SPLIT_BUFFER_CHUNKS chunks,
+        then split; all chunks but the last are emitted and the last one is
+        split again together with the text that follows, so chunk
+        boundaries match splitting the whole text at once closely while
+        memory stays bounded. Each chunk carries the source 'progress' at
+        the time it was emitted. The total chunk count is unknown until the
+        generator is exhausted, so metadata has no 'total_chunks'.
+        """
+        if not filename:
+            filename = os.path.basename(file_path)
+        file_extension = Path(file_path).suffix.lower()
+        buffer_size = self.chunk_size * self.SPLIT_BUFFER_CHUNKS
         
-        # Split text into chunks
-        chunks = self.text_splitter.split_text(text)
+        buffer = []
+        buffered = 0
+        chunk_index = 0
+        progress = 0.0
         
-        # Create documents with metadata
-        documents = []
-        for i, chunk in enumerate(chunks):
-            documents.append({
-                'content': chunk,
+        def make_chunk(content):
+            return {
+                'content': content,
                 'metadata': {
                     'filename': filename,
                     'file_type': file_extension,
-                    'chunk_index': i,
-                    'total_chunks': len(chunks)
-                }
-            })
+                    'chunk_index': chunk_index,
+                },
+                'progress': progress
+            }
+        
+        for text, progress in self.iter_text_segments(file_path):
+            buffer.append(text)
+            buffered += len(text)
+            if buffered < buffer_size:
+                continue
+            
+            text = "".join(buffer)
+            chunks = self.text_splitter.split_text(text)
+            buffer, buffered = [], 0
+            if not chunks:
+                continue
+            
+            for chunk in chunks[:-1]:
+                yield make_chunk(chunk)
+                chunk_index += 1
+            # The last chunk may continue in the next segment; carry its raw text, whitespace included
+            tail_start = text.rfind(chunks[-1])
+            tail = text[tail_start:] if tail_start >= 0 else chunks[-1]
+            buffer, buffered = [tail], len(tail)
+        
+        text = "".join(buffer)
+        if text.strip():
+            for chunk in self.text_splitter.split_text(text):
+                yield make_chunk(chunk)
+                chunk_index += 1
+        
+        if not chunk_index:
+            logger.warning(f"No text extracted from {filename}")
+    
+    def process_document(self, file_path: str, filename: str = None) -> List[Dict[str, Any]]:
+        """Process a document and return chunks with metadata"""
+        try:
+            documents = list(self.iter_chunks(file_path, filename))
+        except Exception as e:
+            logger.error(f"Error processing document {file_path}: {e}")
+            return []
+        
+        for document in documents:
+            document.pop('progress', None)
+            document['metadata']['total_chunks'] = len(documents)
         
-        return documents
\ No newline at end of file
+        return documents
@@ -1,44 +1,331 @@
-import requests
 import json
-from typing import List
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 import logging
 
+import httpx
+import numpy as np
+from django.conf import settings
+
+from agent_chat_app.core.ollama_client import OllamaClient, get_ollama_client
+
 logger = logging.getLogger(__name__)
 
+
+def normalize_embedding(embedding: List[float]) -> List[float]:
+    """
+    L2-normalize an embedding; empty (failed) embeddings stay empty.
+
+    /api/embed returns unit vectors and /api/embeddings does not. Chroma
+    ranks by squared L2, so query and chunk vectors are only comparable
+    when every vector is normalized the same way.
+    """
+    if not embedding:
+        return []
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm).tolist() if norm > 0 else vector.tolist()
+
+
+@dataclass
+class EmbeddingBatchResult:
+    """Result of a batch embedding call, in the same order as the input texts"""
+    embeddings: List[List[float]]
+    failed_indices: List[int] = field(default_factory=list)
+
+    @property
+    def success_count(self) -> int:
+        return len(self.embeddings) - len(self.failed_indices)
+
+    @property
+    def all_succeeded(self) -> bool:
+        return not self.failed_indices
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by (model, sha256(text)).
+
+    Two tiers: a per-process LRU and a shared Redis tier holding vectors as
+    raw float32 bytes. The Redis tier is skipped when the default cache
+    backend is not django-redis. Only L2-normalized vectors are stored, so
+    a vector cached from the query path is valid for documents and back;
+    NORMALIZATION in the key keeps entries written before that out.
+    """
+
+    KEY_PREFIX = "embedding_cache"
+    NORMALIZATION = "l2"
+
+    def __init__(self, max_entries: int = None, ttl: int = None, use_shared: bool = True):
+        self.max_entries = max_entries or getattr(settings, 'EMBEDDING_CACHE_MAX_ENTRIES', 4096)
+        self.ttl = ttl or getattr(settings, 'EMBEDDING_CACHE_TTL', 60 * 60 * 24 * 7)
+        self.use_shared = use_shared
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'stores': 0}
+
+    @classmethod
+    def make_key(cls, model: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"{cls.KEY_PREFIX}:{cls.NORMALIZATION}:{model}:{digest}"
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, List[float]]:
+        """Return cached embeddings for the given texts, keyed by text"""
+        found: Dict[str, List[float]] = {}
+        missing_keys: Dict[str, str] = {}
+
+        with self._lock:
+            for text in dict.fromkeys(texts):
+                key = self.make_key(model, text)
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self._stats['local_hits'] += 1
+                    found[text] = vector.tolist()
+                else:
+                    missing_keys[key] = text
+
+        if missing_keys:
+            for key, vector in self._shared_get(list(missing_keys)).items():
+                self._remember(key, vector)
+                with self._lock:
+                    self._stats['shared_hits'] += 1
+                found[missing_keys.pop(key)] = vector.tolist()
+
+        with self._lock:
+            self._stats['misses'] += len(missing_keys)
+
+        return found
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text]).get(text)
+
+    def set_many(self, model: str, embeddings: Dict[str, List[float]]) -> None:
+        """Store normalized embeddings in both tiers; empty (failed) embeddings are skipped"""
+        vectors = {
+            self.make_key(model, text): np.asarray(normalize_embedding(embedding), dtype=np.float32)
+            for text, embedding in embeddings.items() if embedding
+        }
+        if not vectors:
+            return
+
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+        with self._lock:
+            self._stats['stores'] += len(vectors)
+
+        self._shared_set(vectors)
+
+    def clear(self) -> None:
+        """Clear the in-process tier and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self._stats = {key: 0 for key in self._stats}
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_entries'] = len(self._entries)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_redis(self):
+        if not self.use_shared:
+            return None
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            # Cache backend without raw Redis access - keep local tier only
+            self.use_shared = False
+            return None
+
+    def _shared_get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        redis_client = self._get_redis()
+        if redis_client is None:
+            return {}
+        try:
+            values = redis_client.mget(keys)
+        except Exception as e:
+            logger.warning(f"Embedding cache read failed: {e}")
+            return {}
+        return {
+            key: np.frombuffer(value, dtype=np.float32)
+            for key, value in zip(keys, values) if value
+        }
+
+    def _shared_set(self, vectors: Dict[str, np.ndarray]) -> None:
+        redis_client = self._get_redis()
+        if redis_client is None:
+            return
+        try:
+            pipeline = redis_client.pipeline(transaction=False)
+            for key, vector in vectors.items():
+                pipeline.set(key, vector.tobytes(), ex=self.ttl)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Get the process-wide embedding cache"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
 class EmbeddingService:
     """Service for generating embeddings using Ollama mxbai-embed-large model"""
-    
-    def __init__(self, base_url: str = "http://localhost:11434"):
-        self.base_url = base_url
+
+    def __init__(self, base_url: str = None, batch_size: int = None, max_workers: int = None,
+                 cache: EmbeddingCache = None, client: OllamaClient = None):
+        # Shared pooled Ollama client unless a specific server or client is requested
+        if client is None:
+            client = OllamaClient(base_url=base_url) if base_url else get_ollama_client()
+        self.client = client
+        self.base_url = client.base_url
         self.model = "mxbai-embed-large"
-    
+        self.batch_size = batch_size or getattr(settings, 'EMBEDDING_BATCH_SIZE', 64)
+        self.max_workers = max_workers or getattr(settings, 'EMBEDDING_MAX_WORKERS', 4)
+        if cache is None and getattr(settings, 'EMBEDDING_CACHE_ENABLED', True):
+            cache = get_embedding_cache()
+        self.cache = cache
+        # None = not probed yet, True/False once we know whether /api/embed exists
+        self._batch_endpoint_available: Optional[bool] = None
+
     def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for a single text"""
+        """Generate the (L2-normalized) embedding for a single text"""
+        if self.cache is not None:
+            cached = self.cache.get(self.model, text)
+            if cached is not None:
+                return cached
+
+        embedding = self._request_embedding(text)
+        if embedding and self.cache is not None:
+            self.cache.set_many(self.model, {text: embedding})
+        return embedding
+
+    def generate_embeddings_batch(self, texts: List[str]) -> EmbeddingBatchResult:
+        """
+        Generate embeddings for multiple texts.
+
+        Cached texts are served without a model call. The rest go to Ollama's
+        multi-input /api/embed endpoint when the server supports it, otherwise
+        to bounded concurrent /api/embeddings requests.
+        Either way the vectors are L2-normalized. Failed texts get an empty
+        embedding and their index in failed_indices.
+        """
+        if not texts:
+            return EmbeddingBatchResult(embeddings=[])
+
+        known = self.cache.get_many(self.model, texts) if self.cache is not None else {}
+        # Identical texts (e.g. repeated boilerplate chunks) are embedded once
+        pending = [text for text in dict.fromkeys(texts) if text not in known]
+
+        computed: Dict[str, List[float]] = {}
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            batch_embeddings = None
+
+            if self._batch_endpoint_available is not False:
+                batch_embeddings = self._embed_with_batch_endpoint(batch)
+
+            if batch_embeddings is None:
+                batch_embeddings = self._embed_concurrently(batch)
+
+            computed.update(zip(batch, batch_embeddings))
+
+        if computed and self.cache is not None:
+            self.cache.set_many(self.model, computed)
+
+        known.update(computed)
+        embeddings = [known.get(text, []) for text in texts]
+        failed_indices = [i for i, embedding in enumerate(embeddings) if not embedding]
+        if failed_indices:
+            logger.warning(f"Failed to generate {len(failed_indices)} of {len(texts)} embeddings")
+
+        return EmbeddingBatchResult(embeddings=embeddings, failed_indices=failed_indices)
+
+    def _request_embedding(self, text: str) -> List[float]:
+        """Request a single embedding from /api/embeddings"""
         try:
-            response = requests.post(
-                f"{self.base_url}/api/embeddings",
+            response = self.client.post(
+                "/api/embeddings",
                 json={
                     "model": self.model,
                     "prompt": text
-                },
-                timeout=30
+                }
             )
-            response.raise_for_status()
-            
+
             data = response.json()
-            return data.get("embedding", [])
-        
-        except requests.exceptions.RequestException as e:
+            return normalize_embedding(data.get("embedding", []))
+
+        except httpx.HTTPError as e:
             logger.error(f"Error generating embedding: {e}")
             return []
         except json.JSONDecodeError as e:
             logger.error(f"Error decoding JSON response: {e}")
             return []
-    
-    def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts"""
-        embeddings = []
-        for text in texts:
-            embedding = self.generate_embedding(text)
-            embeddings.append(embedding)
-        return embeddings
\ No newline at end of file
+
+    def _embed_with_batch_endpoint(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """Embed texts in one call to /api/embed, or return None if the batch call failed"""
+        try:
+            response = self.client.post(
+                "/api/embed",
+                json={
+                    "model": self.model,
+                    "input": texts
+                },
+                timeout=30 + 2 * len(texts)
+            )
+
+            embeddings = response.json().get("embeddings", [])
+            if len(embeddings) != len(texts):
+                logger.warning(f"/api/embed returned {len(embeddings)} embeddings for {len(texts)} texts")
+                return None
+
+            self._batch_endpoint_available = True
+            return [normalize_embedding(embedding) for embedding in embeddings]
+
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                # Older Ollama without multi-input support - don't probe again
+                logger.info("Ollama /api/embed not available, using concurrent /api/embeddings")
+                self._batch_endpoint_available = False
+            else:
+                logger.warning(f"Batch embedding request failed, falling back to per-text requests: {e}")
+            return None
+        except httpx.HTTPError as e:
+            logger.warning(f"Batch embedding request failed, falling back to per-text requests: {e}")
+            return None
+        except json.JSONDecodeError as e:
+            logger.warning(f"Error decoding batch embedding response: {e}")
+            return None
+
+    def _embed_concurrently(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts with bounded concurrent single-text requests, preserving order"""
+        if len(texts) == 1:
+            return [self._request_embedding(texts[0])]
+
+        workers = min(self.max_workers, len(texts))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='embedding') as executor:
+            return list(executor.map(self._request_embedding, texts))
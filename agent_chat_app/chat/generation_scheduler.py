@@ -0,0 +1,201 @@
+"""
+Per-model scheduler for LLM generations.
+
+Each model gets a cap on generations in flight. Requests over the cap wait
+in per-user queues that are served round-robin, so one user sending a burst
+of messages cannot push everyone else to the back. Waiters are told their
+queue position as it changes, and a cancelled waiter (e.g. the WebSocket
+closed) leaves the queue immediately.
+
+The scheduler lives on the event loop of the process serving WebSockets, so
+limits apply per ASGI worker process.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'granted', 'wakeup')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.granted = False
+        self.wakeup: Optional[asyncio.Future] = None
+
+    def wake(self) -> None:
+        if self.wakeup is not None and not self.wakeup.done():
+            self.wakeup.set_result(None)
+
+
+class _ModelQueue:
+    """In-flight count and per-user FIFO queues for one model"""
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        # Insertion order is the round-robin order; served users move to the end
+        self.users: "OrderedDict[object, Deque[_Waiter]]" = OrderedDict()
+
+    def has_waiters(self) -> bool:
+        return bool(self.users)
+
+    def add(self, waiter: _Waiter) -> None:
+        self.users.setdefault(waiter.user_id, deque()).append(waiter)
+
+    def remove(self, waiter: _Waiter) -> None:
+        user_queue = self.users.get(waiter.user_id)
+        if user_queue is None:
+            return
+        try:
+            user_queue.remove(waiter)
+        except ValueError:
+            return
+        if not user_queue:
+            del self.users[waiter.user_id]
+
+    def pop_next(self) -> Optional[_Waiter]:
+        """Take the oldest waiter of the next user in round-robin order"""
+        if not self.users:
+            return None
+        user_id, user_queue = next(iter(self.users.items()))
+        waiter = user_queue.popleft()
+        del self.users[user_id]
+        if user_queue:
+            self.users[user_id] = user_queue
+        return waiter
+
+    def service_order(self) -> List[_Waiter]:
+        """All waiters in the order they would be granted"""
+        order = []
+        queues = [list(user_queue) for user_queue in self.users.values()]
+        depth = 0
+        while True:
+            round_waiters = [user_queue[depth] for user_queue in queues if depth < len(user_queue)]
+            if not round_waiters:
+                return order
+            order.extend(round_waiters)
+            depth += 1
+
+    def wake_all(self) -> None:
+        for user_queue in self.users.values():
+            for waiter in user_queue:
+                waiter.wake()
+
+
+class GenerationScheduler:
+    """Caps concurrent generations per model and queues the rest fairly across users"""
+
+    def __init__(self, max_in_flight: int = None, model_limits: Dict[str, int] = None):
+        self.max_in_flight = max_in_flight or getattr(settings, 'LLM_MAX_IN_FLIGHT_PER_MODEL', 2)
+        self.model_limits = model_limits if model_limits is not None else getattr(settings, 'LLM_MODEL_MAX_IN_FLIGHT', {})
+        self._queues: Dict[str, _ModelQueue] = {}
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = _ModelQueue(self.model_limits.get(model, self.max_in_flight))
+            self._queues[model] = queue
+        return queue
+
+    def _grant_waiting(self, queue: _ModelQueue) -> None:
+        granted_any = False
+        while queue.in_flight < queue.max_in_flight:
+            waiter = queue.pop_next()
+            if waiter is None:
+                break
+            queue.in_flight += 1
+            waiter.granted = True
+            waiter.wake()
+            granted_any = True
+        if granted_any:
+            # Everyone still waiting moved up
+            queue.wake_all()
+
+    async def acquire(self, model: str, user_id, on_position: PositionCallback = None) -> None:
+        """
+        Wait for a generation slot for the model.
+
+        on_position is awaited with the 1-based queue position whenever it
+        changes, and with 0 once a queued request gets its slot.
+        """
+        queue = self._queue(model)
+        if queue.in_flight < queue.max_in_flight and not queue.has_waiters():
+            queue.in_flight += 1
+            return
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(user_id)
+        queue.add(waiter)
+        logger.debug(f"Generation for user {user_id} queued on {model} ({queue.in_flight} in flight)")
+        last_position = None
+        try:
+            while not waiter.granted:
+                position = queue.service_order().index(waiter) + 1
+                if on_position is not None and position != last_position:
+                    last_position = position
+                    await on_position(position)
+                    if waiter.granted:
+                        break
+                waiter.wakeup = loop.create_future()
+                await waiter.wakeup
+
+            if on_position is not None:
+                await on_position(0)
+        except BaseException:
+            if waiter.granted:
+                # Slot was handed over just as we were cancelled - pass it on
+                self.release(model)
+            else:
+                queue.remove(waiter)
+                queue.wake_all()
+            raise
+
+    def release(self, model: str) -> None:
+        queue = self._queue(model)
+        queue.in_flight = max(0, queue.in_flight - 1)
+        self._grant_waiting(queue)
+
+    @asynccontextmanager
+    async def slot(self, model: str, user_id, on_position: PositionCallback = None):
+        """Hold a generation slot for the duration of the block"""
+        await self.acquire(model, user_id, on_position=on_position)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            model: {
+                'in_flight': queue.in_flight,
+                'max_in_flight': queue.max_in_flight,
+                'queued': sum(len(user_queue) for user_queue in queue.users.values()),
+                'queued_users': len(queue.users),
+            }
+            for model, queue in self._queues.items()
+        }
+
+
+_scheduler: Optional[GenerationScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_generation_scheduler() -> GenerationScheduler:
+    """Get the process-wide generation scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = GenerationScheduler()
+    return _scheduler
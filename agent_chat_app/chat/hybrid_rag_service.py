@@ -1,10 +1,14 @@
 import logging
 from typing import Dict, List, Optional, Tuple, Any
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, field
 from enum import Enum
 import numpy as np
-from .rag_service import RAGService
+from django.conf import settings
+from .rag_service import distance_to_similarity, get_rag_service, RetrievalResult
+from .response_cache import SemanticResponseCache
+from .services import OllamaService
 from .models import UserSettings
+from .timing import timed
 import requests
 import json
 
@@ -43,6 +47,29 @@ class ResponseMetadata:
     rag_chunks_used: List[Dict[str, Any]]
     fallback_used: bool
     transparency_info: Dict[str, Any]
+    # Milliseconds per stage of this turn (embed, search, rerank, generate, ...);
+    # not cached with the response, a cache hit has its own
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def processing_time(self) -> Optional[float]:
+        """Seconds spent on the turn's top-level stages, for Message.processing_time"""
+        total = sum(self.timings.get(stage, 0.0) for stage in TOP_LEVEL_STAGES)
+        return round(total / 1000, 3) if total else None
+
+
+# Stages that do not overlap; rerank sub-stages (dedupe, mmr, ...) are inside 'rerank'
+TOP_LEVEL_STAGES = ('cache_lookup', 'embed', 'search', 'rerank', 'queue', 'generate')
+
+
+@dataclass
+class PreparedResponse:
+    """Outcome of the pre-generation step: the prompt and chunks to send, or a direct answer"""
+    prompt: str
+    metadata: ResponseMetadata
+    direct_response: Optional[str] = None
+    # Retrieved chunks for the prompt assembler to pack into the token budget
+    context_chunks: List[Dict[str, Any]] = field(default_factory=list)
 
 
 class HybridRAGService:
@@ -52,7 +79,8 @@ class HybridRAGService:
     """
     
     def __init__(self, confidence_threshold: float = 0.7, max_rag_chunks: int = 3):
-        self.rag_service = RAGService()
+        self.rag_service = get_rag_service()
+        self.response_cache = SemanticResponseCache()
         self.confidence_threshold = confidence_threshold
         self.max_rag_chunks = max_rag_chunks
         
@@ -79,9 +107,8 @@ class HybridRAGService:
         # Check for specialized domain keywords
         has_specialized_terms = any(domain in query_lower for domain in self.specialized_domains)
         
-        # Check if user has documents
-        stats = self.rag_service.get_document_stats(user_id=user_id)
-        has_documents = stats.get('documents', 0) > 0
+        # Check if user has documents (cached flag, no COUNT queries per turn)
+        has_documents = self.rag_service.user_has_documents(user_id)
         
         # Decision logic
         if has_doc_reference and has_documents:
@@ -93,27 +120,60 @@ class HybridRAGService:
         else:
             return False, 0.8
     
+    def similarity_stats(self, rag_results: List[Dict]) -> Dict[str, float]:
+        """
+        Shape of the similarity distribution of the retrieved chunks.
+        
+        Uses the cosine similarity retrieval computed for each chunk, else
+        the one its distance implies for unit vectors, clipped to 0-1.
+        Returns top1, mean, margin (top1 minus the runner-up) and spread
+        (standard deviation); empty without results.
+        """
+        if not rag_results:
+            return {}
+        similarities = np.fromiter(
+            (chunk['similarity'] if chunk.get('similarity') is not None
+             else distance_to_similarity(chunk.get('distance', 2.0)) for chunk in rag_results),
+            dtype=np.float64
+        )
+        similarities = np.sort(np.clip(similarities, 0.0, 1.0))[::-1]
+        return {
+            'top1': float(similarities[0]),
+            'mean': float(similarities.mean()),
+            'margin': float(similarities[0] - similarities[1]) if similarities.size > 1 else 0.0,
+            'spread': float(similarities.std()),
+        }
+    
     def calculate_confidence_score(self, query: str, rag_results: List[Dict], 
                                  has_rag_context: bool) -> ConfidenceScore:
-        """Calculate confidence score based on various factors"""
+        """
+        Calculate confidence score based on various factors.
+        
+        With retrieved chunks, relevance follows the best hit, the hits as a
+        whole and how clearly the best hit stands out (margin), and coverage
+        is the best hit discounted by the spread of the rest. Without them
+        coverage falls back to a query length heuristic.
+        """
+        stats = self.similarity_stats(rag_results)
         
         # RAG relevance score
         rag_relevance = 0.0
-        if rag_results:
-            # Use average distance/similarity score
-            distances = [chunk.get('distance', 1.0) for chunk in rag_results]
-            avg_distance = sum(distances) / len(distances) if distances else 1.0
-            # Convert distance to similarity (lower distance = higher relevance)
-            rag_relevance = max(0.0, 1.0 - avg_distance)
-        
-        # Knowledge coverage - simple heuristic based on query complexity
-        query_words = len(query.split())
-        if query_words <= 5:
-            knowledge_coverage = 0.8  # Simple queries usually well covered
-        elif query_words <= 15:
-            knowledge_coverage = 0.6  # Medium complexity
+        if stats:
+            margin_share = min(1.0, stats['margin'] / getattr(settings, 'RAG_CONFIDENCE_MARGIN', 0.15))
+            rag_relevance = 0.6 * stats['top1'] + 0.3 * stats['mean'] + 0.1 * margin_share
+        
+        if stats:
+            # Several chunks about as close as the best one back it up
+            knowledge_coverage = stats['top1'] - stats['spread']
         else:
-            knowledge_coverage = 0.4  # Complex queries harder to cover
+            # Simple heuristic based on query complexity
+            query_words = len(query.split())
+            if query_words <= 5:
+                knowledge_coverage = 0.8  # Simple queries usually well covered
+            elif query_words <= 15:
+                knowledge_coverage = 0.6  # Medium complexity
+            else:
+                knowledge_coverage = 0.4  # Complex queries harder to cover
         
         # Source reliability
         source_reliability = 0.9 if has_rag_context else 0.7
@@ -149,6 +209,11 @@ class HybridRAGService:
                     'chunk_index': metadata.get('chunk_index', 0)
                 })
         
+        if rag_chunks:
+            info['retrieval_diagnostics'] = {
+                key: round(value, 4) for key, value in self.similarity_stats(rag_chunks).items()
+            }
+        
         return info
     
     def format_response_with_transparency(self, response: str, metadata: ResponseMetadata) -> str:
@@ -181,6 +246,10 @@ class HybridRAGService:
             if source_files:
                 transparency_parts.append(f"📄 *Źródła: {', '.join(source_files)}*")
         
+        # Add cache indicator
+        if metadata.transparency_info.get('cache', {}).get('hit'):
+            transparency_parts.append("⚡ *Odpowiedź z pamięci podręcznej dla podobnego pytania*")
+        
         # Add fallback indicator
         if metadata.fallback_used:
             transparency_parts.append("🔄 *Użyto strategii fallback*")
@@ -215,103 +284,208 @@ class HybridRAGService:
         
         return None
     
+    def prepare_response(self, prompt: str, user_id: int = None, force_rag: bool = False) -> PreparedResponse:
+        """
+        Run everything that happens before generation: RAG decision, a single
+        retrieval, confidence scoring and the uncertainty check.
+        """
+        # Determine if RAG should be used
+        should_use_rag, decision_confidence = self.should_use_rag(prompt, user_id)
+        use_rag = should_use_rag or force_rag
+        
+        # Initialize response metadata
+        rag_chunks = []
+        fallback_used = False
+        knowledge_source = KnowledgeSource.BUILT_IN
+        
+        # Try RAG approach if determined necessary
+        context_chunks = []
+        timings = {}
+        if use_rag and user_id:
+            try:
+                # Single embedding + vector search; hits and context come from the same result
+                retrieval: RetrievalResult = self.rag_service.retrieve(
+                    prompt, n_results=self.max_rag_chunks, user_id=user_id
+                )
+                rag_chunks = retrieval.chunks
+                timings.update(retrieval.timings)
+                logger.info(f"Retrieval for user {user_id} took {timings} ms")
+                
+                if retrieval.has_context:
+                    context_chunks = retrieval.chunks
+                    knowledge_source = KnowledgeSource.HYBRID if not force_rag else KnowledgeSource.RAG
+                    logger.info(f"Enhanced prompt with RAG context for user {user_id}")
+                
+            except Exception as e:
+                logger.warning(f"RAG enhancement failed, using fallback: {e}")
+                fallback_used = True
+        
+        # Calculate confidence score
+        confidence = self.calculate_confidence_score(prompt, rag_chunks, use_rag and bool(rag_chunks))
+        
+        # Check for knowledge uncertainty
+        uncertainty_response = self.handle_knowledge_uncertainty(prompt, confidence, rag_chunks)
+        if uncertainty_response:
+            metadata = ResponseMetadata(
+                knowledge_source=KnowledgeSource.UNKNOWN,
+                confidence=confidence,
+                rag_chunks_used=rag_chunks,
+                fallback_used=fallback_used,
+                transparency_info=self.generate_transparency_info(KnowledgeSource.UNKNOWN, rag_chunks, confidence),
+                timings=timings
+            )
+            return PreparedResponse(prompt=prompt, metadata=metadata, direct_response=uncertainty_response)
+        
+        metadata = ResponseMetadata(
+            knowledge_source=knowledge_source,
+            confidence=confidence,
+            rag_chunks_used=rag_chunks,
+            fallback_used=fallback_used,
+            transparency_info=self.generate_transparency_info(knowledge_source, rag_chunks, confidence),
+            timings=timings
+        )
+        return PreparedResponse(prompt=prompt, metadata=metadata, context_chunks=context_chunks)
+    
+    @staticmethod
+    def metadata_to_dict(metadata: ResponseMetadata) -> Dict[str, Any]:
+        return {
+            'knowledge_source': metadata.knowledge_source.value,
+            'confidence': asdict(metadata.confidence),
+            'rag_chunks_used': metadata.rag_chunks_used,
+            'fallback_used': metadata.fallback_used,
+            'transparency_info': metadata.transparency_info,
+        }
+    
+    @staticmethod
+    def metadata_from_dict(data: Dict[str, Any]) -> ResponseMetadata:
+        return ResponseMetadata(
+            knowledge_source=KnowledgeSource(data['knowledge_source']),
+            confidence=ConfidenceScore(**data['confidence']),
+            rag_chunks_used=data['rag_chunks_used'],
+            fallback_used=data['fallback_used'],
+            transparency_info=dict(data['transparency_info'])
+        )
+    
+    def get_cached_response(self, prompt: str, user_id: int = None, model: str = None,
+                            custom_instruction: str = None,
+                            timings: Dict[str, float] = None) -> Optional[Tuple[str, ResponseMetadata]]:
+        """
+        Answer from the semantic response cache when the user asked a close
+        enough question before, with the same model, instruction and documents.
+        
+        The lookup time goes into timings, so a miss can carry it into the turn.
+        """
+        if not user_id or not self.response_cache.is_cacheable(prompt):
+            return None
+        if timings is None:
+            timings = {}
+        try:
+            with timed(timings, 'cache_lookup'):
+                _, final_model, system_instruction = OllamaService.resolve_generation_settings(
+                    user_id, model=model, custom_instruction=custom_instruction
+                )
+                # Served from the embedding cache when retrieval runs for the same query
+                query_embedding = self.rag_service.embedding_service.generate_embedding(prompt)
+                hit = self.response_cache.lookup(user_id, final_model, system_instruction, prompt, query_embedding)
+        except Exception as e:
+            logger.warning(f"Response cache lookup skipped: {e}")
+            return None
+        if hit is None:
+            return None
+        
+        metadata = self.metadata_from_dict(hit.metadata)
+        metadata.timings = timings
+        metadata.transparency_info['cache'] = {
+            'hit': True,
+            'similarity': round(hit.similarity, 4),
+            'cached_query': hit.query,
+            'cached_at': hit.created_at,
+        }
+        logger.info(f"Response cache hit for user {user_id} (similarity {hit.similarity:.3f})")
+        return hit.response, metadata
+    
+    def cache_response(self, prompt: str, response: str, metadata: ResponseMetadata, user_id: int = None,
+                       model: str = None, custom_instruction: str = None) -> None:
+        """Remember a generated answer; fallbacks, uncertain answers and errors are not cached"""
+        if not user_id or not self.response_cache.is_cacheable(prompt):
+            return
+        if metadata.fallback_used or metadata.knowledge_source == KnowledgeSource.UNKNOWN:
+            return
+        if not response or OllamaService.is_error_response(response):
+            return
+        try:
+            _, final_model, system_instruction = OllamaService.resolve_generation_settings(
+                user_id, model=model, custom_instruction=custom_instruction
+            )
+            query_embedding = self.rag_service.embedding_service.generate_embedding(prompt)
+            self.response_cache.store(
+                user_id, final_model, system_instruction, prompt, query_embedding,
+                response, self.metadata_to_dict(metadata)
+            )
+        except Exception as e:
+            logger.warning(f"Could not cache response: {e}")
+    
+    @staticmethod
+    def fallback_metadata(reason: str) -> ResponseMetadata:
+        """Metadata for a plain built-in response after the hybrid pipeline failed"""
+        return ResponseMetadata(
+            knowledge_source=KnowledgeSource.BUILT_IN,
+            confidence=ConfidenceScore(
+                overall=0.5, rag_relevance=0.0, knowledge_coverage=0.5, source_reliability=0.7
+            ),
+            rag_chunks_used=[],
+            fallback_used=True,
+            transparency_info={'knowledge_source': 'built_in', 'fallback_reason': reason}
+        )
+    
     def get_enhanced_response(self, prompt: str, model: str = None, user_id: int = None, 
                             custom_instruction: str = None, force_rag: bool = False, conversation_id: int = None) -> Tuple[str, ResponseMetadata]:
         """
         Get enhanced response using hybrid RAG approach with confidence scoring
         """
         try:
-            # Determine if RAG should be used
-            should_use_rag, decision_confidence = self.should_use_rag(prompt, user_id)
-            use_rag = should_use_rag or force_rag
-            
-            # Initialize response metadata
-            rag_chunks = []
-            fallback_used = False
-            knowledge_source = KnowledgeSource.BUILT_IN
-            
-            # Try RAG approach if determined necessary
-            enhanced_prompt = prompt
-            if use_rag and user_id:
-                try:
-                    rag_chunks = self.rag_service.search_similar_chunks(
-                        prompt, n_results=self.max_rag_chunks, user_id=user_id
-                    )
-                    
-                    if rag_chunks:
-                        rag_context = self.rag_service.generate_rag_context(
-                            prompt, user_id=user_id, max_chunks=self.max_rag_chunks
-                        )
-                        if rag_context:
-                            enhanced_prompt = f"{rag_context}\n\nUser question: {prompt}"
-                            knowledge_source = KnowledgeSource.HYBRID if not force_rag else KnowledgeSource.RAG
-                            logger.info(f"Enhanced prompt with RAG context for user {user_id}")
-                    
-                except Exception as e:
-                    logger.warning(f"RAG enhancement failed, using fallback: {e}")
-                    fallback_used = True
-            
-            # Calculate confidence score
-            confidence = self.calculate_confidence_score(prompt, rag_chunks, use_rag and bool(rag_chunks))
+            lookup_timings = {}
+            cached = self.get_cached_response(
+                prompt, user_id=user_id, model=model, custom_instruction=custom_instruction, timings=lookup_timings
+            )
+            if cached:
+                return cached
             
-            # Check for knowledge uncertainty
-            uncertainty_response = self.handle_knowledge_uncertainty(prompt, confidence, rag_chunks)
-            if uncertainty_response:
-                metadata = ResponseMetadata(
-                    knowledge_source=KnowledgeSource.UNKNOWN,
-                    confidence=confidence,
-                    rag_chunks_used=rag_chunks,
-                    fallback_used=fallback_used,
-                    transparency_info=self.generate_transparency_info(KnowledgeSource.UNKNOWN, rag_chunks, confidence)
-                )
-                return uncertainty_response, metadata
+            prepared = self.prepare_response(prompt, user_id=user_id, force_rag=force_rag)
+            prepared.metadata.timings.update(lookup_timings)
+            if prepared.direct_response:
+                return prepared.direct_response, prepared.metadata
             
             # Get response from language model
-            from .services import OllamaService
-            response = OllamaService.get_response(
-                prompt=enhanced_prompt,
-                model=model,
-                user_id=user_id,
-                use_rag=False,  # We've already handled RAG
-                custom_instruction=custom_instruction,
-                conversation_id=conversation_id
-            )
+            with timed(prepared.metadata.timings, 'generate'):
+                response = OllamaService.get_response(
+                    prompt=prepared.prompt,
+                    model=model,
+                    user_id=user_id,
+                    use_rag=False,  # We've already handled RAG
+                    custom_instruction=custom_instruction,
+                    conversation_id=conversation_id,
+                    rag_chunks=prepared.context_chunks
+                )
             
-            # Create response metadata
-            transparency_info = self.generate_transparency_info(knowledge_source, rag_chunks, confidence)
-            metadata = ResponseMetadata(
-                knowledge_source=knowledge_source,
-                confidence=confidence,
-                rag_chunks_used=rag_chunks,
-                fallback_used=fallback_used,
-                transparency_info=transparency_info
+            self.cache_response(
+                prompt, response, prepared.metadata,
+                user_id=user_id, model=model, custom_instruction=custom_instruction
             )
-            
-            return response, metadata
+            return response, prepared.metadata
             
         except Exception as e:
             logger.error(f"Error in hybrid RAG response generation: {e}")
             # Fallback to basic response
-            from .services import OllamaService
-            response = OllamaService.get_response(
-                prompt=prompt,
-                model=model,
-                user_id=user_id,
-                use_rag=False,
-                custom_instruction=custom_instruction,
-                conversation_id=conversation_id
-            )
-            
-            fallback_confidence = ConfidenceScore(
-                overall=0.5, rag_relevance=0.0, knowledge_coverage=0.5, source_reliability=0.7
-            )
-            
-            metadata = ResponseMetadata(
-                knowledge_source=KnowledgeSource.BUILT_IN,
-                confidence=fallback_confidence,
-                rag_chunks_used=[],
-                fallback_used=True,
-                transparency_info={'knowledge_source': 'built_in', 'fallback_reason': str(e)}
-            )
+            metadata = self.fallback_metadata(str(e))
+            with timed(metadata.timings, 'generate'):
+                response = OllamaService.get_response(
+                    prompt=prompt,
+                    model=model,
+                    user_id=user_id,
+                    use_rag=False,
+                    custom_instruction=custom_instruction,
+                    conversation_id=conversation_id
+                )
             
-            return response, metadata
\ No newline at end of file
+            return response, metadata
@@ -0,0 +1,163 @@
+"""
+Per-user BM25 keyword index of document chunks.
+
+Dense retrieval misses exact identifiers, error codes and product names, so
+every chunk is also indexed by its terms in an SQLite FTS5 table, one
+database file per user under LEXICAL_INDEX_PATH, and ranked with FTS5's
+built-in bm25(). Text goes through tokenize(), which keeps identifiers such
+as "ERR-1042" or "v2.3.1" whole (and indexes their parts), strips common
+Polish inflection suffixes and folds Polish diacritics, so "faktura",
+"faktury" and "fakturą" match each other and queries typed without Polish
+letters still hit.
+
+Entries are keyed by ChromaDB vector id; RAGService.retrieve joins the hits
+back to the vectors and fuses both rankings with reciprocal_rank_fusion().
+"""
+
+import logging
+import os
+import re
+import sqlite3
+from collections import defaultdict
+from contextlib import closing
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+
+POLISH_FOLD = str.maketrans("ąćęłńóśźż", "acelnoszz")
+
+# Longest first; stripped once, only when at least MIN_STEM_LENGTH characters remain
+POLISH_SUFFIXES = sorted([
+    "owania", "owanie", "ościach", "ościami", "ością", "ości", "ami", "ach", "ego", "emu",
+    "ych", "ich", "ymi", "imi", "owi", "ów", "om", "ej", "ie", "ia", "iu",
+    "ą", "ę", "a", "e", "i", "o", "u", "y",
+], key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+STOPWORDS = frozenset("""
+    a aby ale albo bo by być czy dla do gdy i ich jak jaka jaki jakie jest już
+    ma mi mnie na nie o od oraz po pod przez przy się są ta tak te ten to tu
+    w we z za że co czego kiedy gdzie który która które
+    an and are as at be by for from how in is it of on or the this to what when where which who why with
+""".split())
+
+SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+    "terms, vector_id UNINDEXED, document_id UNINDEXED, "
+    "tokenize = \"unicode61 remove_diacritics 2 tokenchars '-./:_'\")"
+)
+
+
+def stem(word: str) -> str:
+    """Light Polish stemmer: drop one inflection suffix"""
+    for suffix in POLISH_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[:-len(suffix)]
+    return word
+
+
+def _normalize(word: str) -> Optional[str]:
+    if word in STOPWORDS:
+        return None
+    if word.isalpha():
+        word = stem(word)
+    return word.translate(POLISH_FOLD)
+
+
+def tokenize(text: str) -> List[str]:
+    """Index terms of a text, in order; used for both chunks and queries"""
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        parts = re.split(r"[-./:_]", token)
+        if len(parts) > 1:
+            # Identifiers match whole ("err-1042") and by their parts ("1042")
+            terms.append(token.translate(POLISH_FOLD))
+        for part in parts:
+            if len(parts) > 1 and len(part) < 2:
+                continue
+            term = _normalize(part)
+            if term:
+                terms.append(term)
+    return terms
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse rankings of ids: score(id) = sum of 1 / (k + rank) over the rankings
+    that contain it. Returns (id, score), best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, 1):
+            scores[item_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """BM25 index of chunk terms, one SQLite FTS5 database per user"""
+
+    def __init__(self, path: str = None):
+        self.path = path or getattr(settings, 'LEXICAL_INDEX_PATH', os.path.join(settings.BASE_DIR, "lexical_index"))
+
+    @staticmethod
+    def enabled() -> bool:
+        return getattr(settings, 'RAG_LEXICAL_SEARCH', True)
+
+    def db_path(self, user_id: int) -> str:
+        return os.path.join(self.path, f"user_{user_id}.sqlite3")
+
+    def has_index(self, user_id: int) -> bool:
+        return os.path.exists(self.db_path(user_id))
+
+    def _connect(self, user_id: int) -> sqlite3.Connection:
+        os.makedirs(self.path, exist_ok=True)
+        connection = sqlite3.connect(self.db_path(user_id), timeout=10)
+        # Readers (chat turns) do not wait for an ingest in progress
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(SCHEMA)
+        return connection
+
+    def add_chunks(self, user_id: int, document_id: int, chunks: Iterable[Tuple[str, str]]) -> None:
+        """Index (vector_id, content) pairs of a document"""
+        rows = [(" ".join(tokenize(content)), vector_id, document_id) for vector_id, content in chunks]
+        if not rows:
+            return
+        try:
+            with closing(self._connect(user_id)) as connection, connection:
+                connection.executemany(
+                    "INSERT INTO chunks (terms, vector_id, document_id) VALUES (?, ?, ?)", rows
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not add {len(rows)} chunks of document {document_id} to the keyword index: {e}")
+
+    def remove_document(self, user_id: int, document_id: int) -> None:
+        if not self.has_index(user_id):
+            return
+        try:
+            with closing(self._connect(user_id)) as connection, connection:
+                connection.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not remove document {document_id} from the keyword index: {e}")
+
+    def search(self, user_id: int, query: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """(vector_id, bm25 score) of the best matching chunks, best first"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.has_index(user_id):
+            return []
+        match = " OR ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        try:
+            with closing(self._connect(user_id)) as connection:
+                rows = connection.execute(
+                    "SELECT vector_id, bm25(chunks) AS rank FROM chunks WHERE chunks MATCH ? ORDER BY rank LIMIT ?",
+                    (match, limit)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Keyword search failed: {e}")
+            return []
+        # bm25() is lower-is-better; flip it so scores read naturally
+        return [(vector_id, -rank) for vector_id, rank in rows]
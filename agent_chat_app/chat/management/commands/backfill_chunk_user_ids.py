@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+
+from agent_chat_app.chat.models import Document
+from agent_chat_app.chat.rag_service import get_rag_service
+from agent_chat_app.chat.vector_store import get_collection
+
+
+class Command(BaseCommand):
+    help = (
+        'Tag existing ChromaDB chunks with user_id metadata so queries can filter '
+        'by equality; with --shard, move them into per-user collections'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--shard',
+            action='store_true',
+            help='Move chunks from the shared collection into per-user collections'
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            default=None,
+            help='Only process documents of this user id'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without writing to ChromaDB'
+        )
+
+    def handle(self, *args, **options):
+        rag_service = get_rag_service()
+        shared_collection = rag_service.collection
+
+        documents = Document.objects.only('id', 'user_id').order_by('id')
+        if options['user']:
+            documents = documents.filter(user_id=options['user'])
+
+        updated_documents = 0
+        updated_chunks = 0
+        error_count = 0
+
+        for document in documents.iterator(chunk_size=500):
+            try:
+                include = ['metadatas', 'embeddings', 'documents'] if options['shard'] else ['metadatas']
+                stored = shared_collection.get(where={'document_id': document.id}, include=include)
+                ids = stored['ids']
+                if not ids:
+                    continue
+
+                metadatas = [dict(metadata or {}, user_id=document.user_id) for metadata in stored['metadatas']]
+
+                if not options['dry_run']:
+                    if options['shard']:
+                        user_collection = get_collection(rag_service.user_collection_name(document.user_id))
+                        user_collection.upsert(
+                            ids=ids,
+                            embeddings=stored['embeddings'],
+                            metadatas=metadatas,
+                            documents=stored['documents']
+                        )
+                        shared_collection.delete(ids=ids)
+                    else:
+                        shared_collection.update(ids=ids, metadatas=metadatas)
+
+                updated_documents += 1
+                updated_chunks += len(ids)
+                if updated_documents % 100 == 0:
+                    self.stdout.write(f'Processed {updated_documents} documents...')
+
+            except Exception as e:
+                error_count += 1
+                if error_count <= 5:  # Only show first 5 errors
+                    self.stdout.write(
+                        self.style.WARNING(f'Error processing document {document.id}: {e}')
+                    )
+
+        action = 'Would update' if options['dry_run'] else 'Updated'
+        target = 'per-user collections' if options['shard'] else 'user_id metadata'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{action} {updated_chunks} chunks of {updated_documents} documents ({target})'
+            )
+        )
+
+        if options['shard'] and not rag_service.per_user_collections_enabled():
+            self.stdout.write(
+                self.style.WARNING('Set RAG_PER_USER_COLLECTIONS = True so queries read the per-user collections')
+            )
+
+        if error_count > 0:
+            self.stdout.write(
+                self.style.WARNING(f'Encountered {error_count} errors')
+            )
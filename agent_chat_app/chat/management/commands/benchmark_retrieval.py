@@ -0,0 +1,102 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from agent_chat_app.chat.rag_service import get_rag_service
+
+
+class Command(BaseCommand):
+    help = (
+        'Offline retrieval benchmark: hit rate, MRR and latency of vector, keyword '
+        'and fused retrieval over a file of labelled queries'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'queries',
+            help=(
+                'JSON file with a list of {"query": ..., "user_id": ..., "relevant": [...]}; '
+                'relevant entries are chunk ids or filenames'
+            )
+        )
+        parser.add_argument('-k', type=int, default=5, help='Results per query')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per query and mode')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['queries'], encoding='utf-8') as file:
+                cases = json.load(file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read queries: {e}')
+
+        rag_service = get_rag_service()
+        k = options['k']
+        candidates = max(k, 20)
+        modes = {
+            'vector': lambda case, embedding: rag_service._query_collection(
+                embedding, n_results=k, user_id=case['user_id']
+            ),
+            'keyword': lambda case, embedding: self._keyword_chunks(rag_service, case, candidates)[:k],
+            'hybrid': lambda case, embedding: rag_service._fuse_results(
+                embedding,
+                rag_service._query_collection(embedding, n_results=candidates, user_id=case['user_id']),
+                rag_service.lexical_index.search(case['user_id'], case['query'], limit=candidates),
+                n_results=k,
+                user_id=case['user_id']
+            ),
+        }
+        ranks = {mode: [] for mode in modes}
+        timings = {mode: [] for mode in modes}
+        embed_timings = []
+
+        for case in cases:
+            started = time.perf_counter()
+            embedding = rag_service.embedding_service.generate_embedding(case['query'])
+            embed_timings.append(time.perf_counter() - started)
+            if not embedding:
+                raise CommandError(f'Could not embed query: {case["query"]}')
+
+            relevant = set(case.get('relevant', []))
+            for mode, run in modes.items():
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    chunks = run(case, embedding)
+                    timings[mode].append(time.perf_counter() - started)
+                ranks[mode].append(self._first_relevant_rank(chunks, relevant))
+
+        self.stdout.write(f'{len(cases)} queries, k={k}, embedding p50 {self._ms(embed_timings, 50)}')
+        self.stdout.write(f'{"mode":<8} {"hit@k":>6} {"MRR":>6} {"p50":>9} {"p95":>9}')
+        for mode in modes:
+            found = [rank for rank in ranks[mode] if rank]
+            hit_rate = len(found) / len(cases) if cases else 0.0
+            mrr = sum(1.0 / rank for rank in found) / len(cases) if cases else 0.0
+            self.stdout.write(
+                f'{mode:<8} {hit_rate:>6.2f} {mrr:>6.3f} '
+                f'{self._ms(timings[mode], 50):>9} {self._ms(timings[mode], 95):>9}'
+            )
+
+    @staticmethod
+    def _keyword_chunks(rag_service, case, limit):
+        hits = rag_service.lexical_index.search(case['user_id'], case['query'], limit=limit)
+        if not hits:
+            return []
+        stored = rag_service.collection_for_user(case['user_id']).get(
+            ids=[vector_id for vector_id, _ in hits], include=['metadatas']
+        )
+        metadata = dict(zip(stored['ids'], stored['metadatas']))
+        return [{'id': vector_id, 'metadata': metadata.get(vector_id) or {}} for vector_id, _ in hits]
+
+    @staticmethod
+    def _first_relevant_rank(chunks, relevant):
+        for rank, chunk in enumerate(chunks, 1):
+            if chunk['id'] in relevant or chunk['metadata'].get('filename') in relevant:
+                return rank
+        return None
+
+    @staticmethod
+    def _ms(values, percentile):
+        if not values:
+            return '-'
+        return f'{np.percentile(values, percentile) * 1000:.1f}ms'
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+
+from agent_chat_app.chat.models import Document
+from agent_chat_app.chat.rag_service import get_rag_service
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the per-user BM25 keyword index from the chunks stored in ChromaDB '
+        '(for documents indexed before keyword search was enabled)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            default=None,
+            help='Only process documents of this user id'
+        )
+
+    def handle(self, *args, **options):
+        rag_service = get_rag_service()
+        lexical_index = rag_service.lexical_index
+
+        documents = Document.objects.filter(processing_status='completed').only('id', 'user_id').order_by('id')
+        if options['user']:
+            documents = documents.filter(user_id=options['user'])
+
+        indexed_documents = 0
+        indexed_chunks = 0
+        error_count = 0
+
+        for document in documents.iterator(chunk_size=500):
+            try:
+                stored = rag_service.collection_for_user(document.user_id).get(
+                    where={'document_id': document.id}, include=['documents']
+                )
+                lexical_index.remove_document(document.user_id, document.id)
+                lexical_index.add_chunks(document.user_id, document.id, zip(stored['ids'], stored['documents']))
+
+                indexed_documents += 1
+                indexed_chunks += len(stored['ids'])
+                if indexed_documents % 100 == 0:
+                    self.stdout.write(f'Processed {indexed_documents} documents...')
+
+            except Exception as e:
+                error_count += 1
+                if error_count <= 5:  # Only show first 5 errors
+                    self.stdout.write(
+                        self.style.WARNING(f'Error processing document {document.id}: {e}')
+                    )
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {indexed_chunks} chunks of {indexed_documents} documents')
+        )
+
+        if error_count > 0:
+            self.stdout.write(
+                self.style.WARNING(f'Encountered {error_count} errors')
+            )
@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def embeddings_json_to_binary(apps, schema_editor):
+    """Pack existing JSON embeddings into float32 bytes, in batches."""
+    DocumentChunk = apps.get_model("chat", "DocumentChunk")
+    chunks = DocumentChunk.objects.exclude(embedding_json__isnull=True).exclude(embedding_json="")
+
+    batch = []
+    for chunk in chunks.only("id", "embedding_json").iterator(chunk_size=BATCH_SIZE):
+        chunk.embedding = np.asarray(json.loads(chunk.embedding_json), dtype=np.float32).tobytes()
+        chunk.embedding_dtype = "float32"
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ["embedding", "embedding_dtype"])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ["embedding", "embedding_dtype"])
+
+
+def embeddings_binary_to_json(apps, schema_editor):
+    """Unpack binary embeddings back into JSON text, in batches."""
+    DocumentChunk = apps.get_model("chat", "DocumentChunk")
+    chunks = DocumentChunk.objects.exclude(embedding__isnull=True)
+
+    batch = []
+    for chunk in chunks.only("id", "embedding", "embedding_dtype").iterator(chunk_size=BATCH_SIZE):
+        vector = np.frombuffer(chunk.embedding, dtype=np.dtype(chunk.embedding_dtype))
+        chunk.embedding_json = json.dumps(vector.tolist())
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ["embedding_json"])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ["embedding_json"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_alter_conversation_options_alter_document_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='documentchunk',
+            old_name='embedding',
+            new_name='embedding_json',
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_dtype',
+            field=models.CharField(default='float32', max_length=8),
+        ),
+        migrations.RunPython(embeddings_json_to_binary, embeddings_binary_to_json),
+        migrations.RemoveField(
+            model_name='documentchunk',
+            name='embedding_json',
+        ),
+    ]
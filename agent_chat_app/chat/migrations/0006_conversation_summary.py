@@ -0,0 +1,28 @@
+# Generated by Django 5.1.11 on 2026-10-16 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_documentchunk_binary_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='summary',
+            field=models.TextField(blank=True, help_text='Rolling summary of the older turns'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary_through_message_id',
+            field=models.PositiveIntegerField(blank=True, help_text='Last message covered by the summary', null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
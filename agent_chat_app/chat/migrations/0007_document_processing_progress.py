@@ -0,0 +1,18 @@
+# Generated by Django 5.1.11 on 2026-10-16 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='processing_progress',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
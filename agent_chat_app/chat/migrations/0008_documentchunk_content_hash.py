@@ -0,0 +1,38 @@
+# Generated by Django 5.1.11 on 2026-10-16 20:14
+
+import hashlib
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def hash_existing_chunks(apps, schema_editor):
+    """Fill content_hash for chunks indexed before it existed, in batches."""
+    DocumentChunk = apps.get_model("chat", "DocumentChunk")
+
+    batch = []
+    for chunk in DocumentChunk.objects.only("id", "content").iterator(chunk_size=BATCH_SIZE):
+        chunk.content_hash = hashlib.sha256(chunk.content.encode("utf-8")).hexdigest()
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_document_processing_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(hash_existing_chunks, migrations.RunPython.noop),
+    ]
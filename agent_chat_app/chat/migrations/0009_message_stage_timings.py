@@ -0,0 +1,18 @@
+# Generated by Django 5.1.11 on 2026-10-16 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_documentchunk_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict, help_text='Milliseconds per stage of the response (embed, search, rerank, queue, generate)'),
+        ),
+    ]
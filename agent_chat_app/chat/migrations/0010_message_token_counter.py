@@ -0,0 +1,18 @@
+# Generated by Django 5.1.11 on 2026-10-16 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='token_counter',
+            field=models.CharField(blank=True, default='', help_text='Tokenizer that produced token_count; counts from another tokenizer are recomputed', max_length=255),
+        ),
+    ]
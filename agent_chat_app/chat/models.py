@@ -1,11 +1,14 @@
+import hashlib
+
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-import json
+import numpy as np
 
 
 class UserSettings(models.Model):
@@ -59,6 +62,13 @@ class Conversation(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_archived = models.BooleanField(default=False, db_index=True)
     message_count = models.PositiveIntegerField(default=0)
+    summary = models.TextField(blank=True, help_text="Rolling summary of the older turns")
+    summary_through_message_id = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Last message covered by the summary"
+    )
+    summary_updated_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-updated_at']
@@ -99,7 +109,15 @@ class Message(models.Model):
     is_from_user = models.BooleanField(default=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     token_count = models.PositiveIntegerField(null=True, blank=True)
+    token_counter = models.CharField(
+        max_length=255, blank=True, default="",
+        help_text="Tokenizer that produced token_count; counts from another tokenizer are recomputed"
+    )
     processing_time = models.FloatField(null=True, blank=True, help_text="Time in seconds to generate response")
+    stage_timings = models.JSONField(
+        default=dict, blank=True,
+        help_text="Milliseconds per stage of the response (embed, search, rerank, queue, generate)"
+    )
     model_used = models.CharField(max_length=100, blank=True)
     
     class Meta:
@@ -154,6 +172,7 @@ class Document(models.Model):
     processed_at = models.DateTimeField(null=True, blank=True)
     processing_error = models.TextField(blank=True)
     chunk_count = models.PositiveIntegerField(default=0)
+    processing_progress = models.PositiveSmallIntegerField(default=0)  # Percent of the file processed
     
     class Meta:
         ordering = ['-uploaded_at']
@@ -172,14 +191,23 @@ class Document(models.Model):
     def mark_as_processing(self):
         """Mark document as being processed"""
         self.processing_status = 'processing'
-        self.save(update_fields=['processing_status'])
+        self.processing_progress = 0
+        self.save(update_fields=['processing_status', 'processing_progress'])
+    
+    def update_progress(self, fraction):
+        """Record how much of the file has been processed (0-1) while processing"""
+        # Completion is reported by mark_as_completed only
+        self.processing_progress = max(0, min(99, int(fraction * 100)))
+        # update() skips the post_save receivers that invalidate document caches
+        Document.objects.filter(pk=self.pk).update(processing_progress=self.processing_progress)
     
     def mark_as_completed(self, chunk_count=0):
         """Mark document as successfully processed"""
         self.processing_status = 'completed'
         self.processed_at = timezone.now()
         self.chunk_count = chunk_count
-        self.save(update_fields=['processing_status', 'processed_at', 'chunk_count'])
+        self.processing_progress = 100
+        self.save(update_fields=['processing_status', 'processed_at', 'chunk_count', 'processing_progress'])
     
     def mark_as_failed(self, error_message=''):
         """Mark document as failed to process"""
@@ -199,8 +227,15 @@ class DocumentChunk(models.Model):
     content = models.TextField()
     chunk_index = models.PositiveIntegerField(db_index=True)
     total_chunks = models.PositiveIntegerField()
-    embedding = models.TextField(blank=True, null=True)  # JSON serialized embedding vector
+    EMBEDDING_DTYPES = {
+        'float32': np.float32,
+        'float16': np.float16,
+    }
+
+    embedding = models.BinaryField(blank=True, null=True)  # Packed embedding vector, see embedding_dtype
+    embedding_dtype = models.CharField(max_length=8, default='float32')
     character_count = models.PositiveIntegerField(default=0)
+    content_hash = models.CharField(max_length=64, blank=True)  # sha256 of content, see hash_content
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -213,28 +248,107 @@ class DocumentChunk(models.Model):
             models.Index(fields=['-created_at']),
         ]
     
-    def set_embedding(self, embedding_vector):
-        """Store embedding vector as JSON"""
-        self.embedding = json.dumps(embedding_vector)
+    def set_embedding(self, embedding_vector, dtype=None):
+        """Store embedding vector as packed float32 (or float16) bytes"""
+        dtype = dtype or getattr(settings, 'EMBEDDING_STORAGE_DTYPE', 'float32')
+        self.embedding_dtype = dtype
+        self.embedding = np.asarray(embedding_vector, dtype=self.EMBEDDING_DTYPES[dtype]).tobytes()
+    
+    def get_embedding_array(self):
+        """Zero-copy read-only NumPy view of the stored embedding vector"""
+        if not self.embedding:
+            return None
+        return np.frombuffer(self.embedding, dtype=self.EMBEDDING_DTYPES[self.embedding_dtype])
     
     def get_embedding(self):
-        """Retrieve embedding vector from JSON"""
-        if self.embedding:
-            return json.loads(self.embedding)
-        return None
+        """Retrieve embedding vector as a list of floats"""
+        vector = self.get_embedding_array()
+        if vector is None:
+            return None
+        return vector.tolist()
+    
+    @staticmethod
+    def hash_content(content):
+        """Hex sha256 of chunk text, used to spot unchanged chunks when re-indexing"""
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
     
     def save(self, *args, **kwargs):
-        """Override save to calculate character count"""
+        """Override save to calculate character count and content hash"""
         if self.content:
             self.character_count = len(self.content)
+            self.content_hash = self.hash_content(self.content)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Chunk {self.chunk_index+1}/{self.total_chunks} of {self.document.filename}"
 
 
+def user_has_documents_cache_key(user_id: int) -> str:
+    return f"user_has_documents_{user_id}"
+
+
+def document_set_version_cache_key(user_id: int) -> str:
+    return f"document_set_version_{user_id}"
+
+
+def user_settings_cache_key(user_id: int) -> str:
+    return f"user_settings_{user_id}"
+
+
+def conversation_history_cache_key(conversation_id: int) -> str:
+    return f"conversation_history_{conversation_id}"
+
+
+def conversation_summary_cache_key(conversation_id: int) -> str:
+    return f"conversation_summary_{conversation_id}"
+
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_settings(sender, instance, created, **kwargs):
     """Automatically create UserSettings when a new user is created"""
     if created:
-        UserSettings.objects.create(user=instance)
\ No newline at end of file
+        UserSettings.objects.create(user=instance)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def invalidate_user_has_documents(sender, instance, **kwargs):
+    """
+    Drop the cached "user has documents" flag used to decide on RAG and
+    start a new document-set version, which retires cached responses
+    """
+    try:
+        cache.delete_many([
+            user_has_documents_cache_key(instance.user_id),
+            document_set_version_cache_key(instance.user_id),
+        ])
+    except Exception:
+        # Flag expires on its own; a cache outage must not block document writes
+        pass
+
+
+@receiver(post_save, sender=UserSettings)
+@receiver(post_delete, sender=UserSettings)
+def invalidate_user_settings(sender, instance, **kwargs):
+    """Drop the cached settings used when building prompts"""
+    try:
+        cache.delete(user_settings_cache_key(instance.user_id))
+    except Exception:
+        # Settings expire on their own; a cache outage must not block settings writes
+        pass
+
+
+@receiver(post_save, sender=Message)
+def append_message_to_history(sender, instance, created, **kwargs):
+    """Keep the cached history window of the conversation in step with new messages"""
+    if created:
+        from .conversation_history import append_message
+        append_message(instance)
+
+
+@receiver(post_delete, sender=Message)
+def invalidate_conversation_history(sender, instance, **kwargs):
+    try:
+        cache.delete(conversation_history_cache_key(instance.conversation_id))
+    except Exception:
+        pass
@@ -0,0 +1,283 @@
+"""
+Token-budgeted prompt assembly for chat generation.
+
+The prompt is packed into the model's context window using token counts:
+the system instruction and the current question always go in, then the
+conversation summary, retrieved document chunks in rank order and finally
+conversation history newest first. Room for the response (num_predict) is reserved up front.
+
+Token counts come from a local HuggingFace tokenizer.json configured per
+model (LLM_TOKENIZER_FILES); loaded tokenizers are cached per process.
+Without one, a conservative characters-per-token estimate is used.
+Per-message counts are memoized in Message.token_count together with the
+tokenizer that produced them, and recounted after a switch to a model with
+another tokenizer.
+"""
+
+import logging
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Sequence
+
+from django.conf import settings
+
+from .models import Message
+from .rag_service import RAGService
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+HISTORY_HEADER = "Conversation context:"
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+# Tokens added by the "User: " / "Assistant: " prefix and newline of a history line
+HISTORY_LINE_OVERHEAD = 4
+
+
+class HeuristicTokenCounter:
+    """Fallback counter: rounds up at ~3 characters per token, so it overestimates"""
+
+    name = 'heuristic'
+
+    def __init__(self, chars_per_token: float = 3.0):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        return [self.count(text) for text in texts]
+
+
+class TokenizerTokenCounter:
+    """Exact counts from a HuggingFace tokenizers.Tokenizer"""
+
+    def __init__(self, tokenizer, name: str):
+        self.tokenizer = tokenizer
+        self.name = name
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(list(texts), add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+
+def lookup_model_setting(mapping: Dict[str, Any], model: str, default=None):
+    """Look a model up by exact name, then by family (the part before ':')"""
+    if not model:
+        return default
+    if model in mapping:
+        return mapping[model]
+    return mapping.get(model.split(':', 1)[0], default)
+
+
+_counters: Dict[str, Any] = {}
+_counters_lock = threading.Lock()
+
+
+def _load_counter(path: str):
+    if not path or Tokenizer is None:
+        return HeuristicTokenCounter()
+    try:
+        return TokenizerTokenCounter(Tokenizer.from_file(path), name=path)
+    except Exception as e:
+        logger.warning(f"Could not load tokenizer from {path}, estimating token counts: {e}")
+        return HeuristicTokenCounter()
+
+
+def get_token_counter(model: str = None):
+    """Get the (cached) token counter for a model"""
+    path = lookup_model_setting(
+        getattr(settings, 'LLM_TOKENIZER_FILES', {}),
+        model,
+        getattr(settings, 'LLM_DEFAULT_TOKENIZER_FILE', '')
+    )
+    counter = _counters.get(path)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.get(path)
+            if counter is None:
+                counter = _load_counter(path)
+                _counters[path] = counter
+    return counter
+
+
+def get_context_window(model: str = None) -> int:
+    return lookup_model_setting(
+        getattr(settings, 'LLM_CONTEXT_WINDOWS', {}),
+        model,
+        getattr(settings, 'LLM_DEFAULT_CONTEXT_WINDOW', 4096)
+    )
+
+
+@dataclass
+class AssembledPrompt:
+    """A packed prompt and what went into it"""
+    prompt: str
+    prompt_tokens: int
+    budget: int
+    chunks_used: List[Dict[str, Any]] = field(default_factory=list)
+    history_used: int = 0
+    history_dropped: int = 0
+    chunks_dropped: int = 0
+    # History messages whose token count was computed (not memoized) this time
+    messages_counted: int = 0
+    summary_used: bool = False
+
+
+class PromptAssembler:
+    """Packs system instruction, RAG chunks and history into a model's token budget"""
+
+    def __init__(self, model: str = None, response_tokens: int = None, counter=None):
+        self.model = model
+        self.counter = counter or get_token_counter(model)
+        # Identifies memoized counts this counter can reuse
+        self.counter_name = str(getattr(self.counter, 'name', type(self.counter).__name__))[:255]
+        self.context_window = get_context_window(model)
+        # Never let the response reservation take more than half the window
+        reserve = response_tokens or getattr(settings, 'LLM_DEFAULT_RESPONSE_TOKENS', 1024)
+        self.response_tokens = min(reserve, self.context_window // 2)
+        self.budget = self.context_window - self.response_tokens
+        self.rag_share = getattr(settings, 'LLM_RAG_BUDGET_SHARE', 0.6)
+
+    @staticmethod
+    def format_question(question: str, rag_context: str = "") -> str:
+        if rag_context:
+            return f"{rag_context}\n\nUser question: {question}"
+        return question
+
+    @staticmethod
+    def format_history_line(message) -> str:
+        role = "User" if message.is_from_user else "Assistant"
+        return f"{role}: {message.text}"
+
+    def count_missing_tokens(self, messages: Sequence) -> int:
+        """
+        Fill in token_count for messages without one, or with one from another
+        tokenizer, and persist the counts to Message.token_count. Returns how
+        many messages were counted.
+        """
+        missing = [
+            message for message in messages
+            if message.token_count is None or getattr(message, 'token_counter', '') != self.counter_name
+        ]
+        if missing:
+            for message, count in zip(missing, self.counter.count_batch([m.text for m in missing])):
+                message.token_count = count
+                message.token_counter = self.counter_name
+            self._store_token_counts(missing)
+        return len(missing)
+
+    @staticmethod
+    def _store_token_counts(messages: Sequence) -> None:
+        # Works for Message instances and lightweight history entries alike
+        saved = [Message(pk=message.pk, token_count=message.token_count, token_counter=message.token_counter)
+                 for message in messages if getattr(message, 'pk', None)]
+        if not saved:
+            return
+        try:
+            Message.objects.bulk_update(saved, ['token_count', 'token_counter'])
+        except Exception as e:
+            logger.warning(f"Could not store message token counts: {e}")
+
+    def _pack_chunks(self, chunks: Sequence[Dict[str, Any]], available: int) -> List[Dict[str, Any]]:
+        if not chunks:
+            return []
+        # Header, footer and the "User question:" wrapper are paid once
+        used = self.counter.count(RAGService.build_context(chunks[:1])) - self._chunk_tokens(chunks[0], 1)
+        used += self.counter.count("User question: ")
+        packed = []
+        for chunk in chunks:
+            cost = self._chunk_tokens(chunk, len(packed) + 1)
+            # Keep going after a miss - a smaller, lower-ranked chunk may still fit
+            if used + cost <= available:
+                packed.append(chunk)
+                used += cost
+        return packed
+
+    def _chunk_tokens(self, chunk: Dict[str, Any], position: int) -> int:
+        filename = chunk.get('metadata', {}).get('filename', 'Unknown')
+        return self.counter.count(f"\n[Document {position}: {filename}]\n{chunk.get('content', '')}")
+
+    def assemble(self, system_instruction: str, question: str, rag_chunks: Sequence[Dict[str, Any]] = None,
+                 history: Sequence = None, summary: str = "") -> AssembledPrompt:
+        """
+        Build the prompt. history is a chronological sequence of Message-like
+        objects (pk, text, is_from_user, token_count); a trailing user message
+        equal to the question is the stored copy of this turn and is skipped.
+        summary covers the turns before history and goes in right after the
+        system instruction when it fits.
+        """
+        rag_chunks = list(rag_chunks or [])
+        history = list(history or [])
+        if history and history[-1].is_from_user and history[-1].text == question:
+            history = history[:-1]
+
+        base_tokens = self.counter.count(f"{system_instruction}\n\nUser: {question}\nAssistant:")
+        available = self.budget - base_tokens
+
+        # The summary stands in for everything older than history, so it goes first
+        summary_used = False
+        if summary:
+            summary_block = f"\n\n{SUMMARY_HEADER}\n{summary}"
+            summary_tokens = self.counter.count(summary_block)
+            if summary_tokens <= available:
+                system_instruction = f"{system_instruction}{summary_block}"
+                available -= summary_tokens
+                summary_used = True
+        if available < 0:
+            logger.warning(
+                f"System instruction and question need {base_tokens} tokens, "
+                f"over the {self.budget} token prompt budget of {self.model}"
+            )
+
+        # Retrieved chunks come first, capped so history keeps some room
+        chunks_used = self._pack_chunks(rag_chunks, int(max(available, 0) * self.rag_share))
+        rag_context = RAGService.build_context(chunks_used)
+        final_question = self.format_question(question, rag_context)
+        if chunks_used:
+            available -= self.counter.count(final_question) - self.counter.count(question)
+
+        # Then as much recent history as fits, newest first
+        history_lines = []
+        messages_counted = 0
+        if history and available > 0:
+            messages_counted = self.count_missing_tokens(history)
+            available -= self.counter.count(f"\n\n{HISTORY_HEADER}\n")
+            for message in reversed(history):
+                cost = message.token_count + HISTORY_LINE_OVERHEAD
+                if cost > available:
+                    break
+                history_lines.append(self.format_history_line(message))
+                available -= cost
+            history_lines.reverse()
+
+        if history_lines:
+            context_str = "\n".join(history_lines)
+            prompt = f"{system_instruction}\n\n{HISTORY_HEADER}\n{context_str}\n\nUser: {final_question}\nAssistant:"
+        else:
+            prompt = f"{system_instruction}\n\nUser: {final_question}\nAssistant:"
+
+        return AssembledPrompt(
+            prompt=prompt,
+            prompt_tokens=self.budget - available,
+            budget=self.budget,
+            chunks_used=chunks_used,
+            history_used=len(history_lines),
+            history_dropped=len(history) - len(history_lines),
+            chunks_dropped=len(rag_chunks) - len(chunks_used),
+            messages_counted=messages_counted,
+            summary_used=summary_used
+        )
@@ -1,22 +1,72 @@
-import chromadb
-from chromadb.config import Settings
 import os
 import logging
-from typing import List, Dict, Any, Tuple
+import threading
+from dataclasses import dataclass, field
+from collections import Counter
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 from django.conf import settings
+from django.core.cache import cache
 from .embeddings import EmbeddingService
-from .models import DocumentChunk, Document
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .models import DocumentChunk, Document, user_has_documents_cache_key
+from .reranker import ChunkReranker
+from .timing import timed
+from .vector_store import get_chroma_client, get_collection
 import numpy as np
 
-# Disable ChromaDB telemetry completely
-os.environ["ANONYMIZED_TELEMETRY"] = "False"
-os.environ["CHROMA_CLIENT_AUTH_PROVIDER"] = ""
-os.environ["CHROMA_SERVER_AUTHN_PROVIDER"] = ""
+logger = logging.getLogger(__name__)
 
-# Import telemetry fix
-from . import chromadb_fix
 
-logger = logging.getLogger(__name__)
+def distance_to_similarity(distance: float) -> float:
+    """
+    Cosine similarity for a ChromaDB squared L2 distance between unit vectors.
+
+    Embeddings are L2-normalized (see embeddings), so |a - b|^2 = 2 - 2cos.
+    """
+    return 1.0 - distance / 2.0
+
+
+def annotate_similarity(query_embedding: List[float], chunks: List[Dict[str, Any]]) -> None:
+    """
+    Set each chunk's 'similarity' to its cosine similarity to the query.
+
+    Computed from the chunk's vector when it has one, so vectors stored
+    before normalization still score correctly; otherwise from its distance.
+    """
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+    for chunk in chunks:
+        embedding = chunk.get('embedding')
+        if embedding is not None and len(embedding) == query_vector.shape[0]:
+            vector = np.asarray(embedding, dtype=np.float32)
+            chunk['similarity'] = float(vector @ query_vector) / max(float(np.linalg.norm(vector)), 1e-12)
+        else:
+            chunk['similarity'] = distance_to_similarity(chunk.get('distance', 2.0))
+
+
+class ChunkIngestError(Exception):
+    """Ingest stopped part-way; stored_count chunks of the document are already stored"""
+
+    def __init__(self, message: str, stored_count: int = 0):
+        super().__init__(message)
+        self.stored_count = stored_count
+
+
+@dataclass
+class RetrievalResult:
+    """One retrieval for a query: the query vector, the hits and the prompt context built from them"""
+    query: str
+    query_embedding: List[float] = field(default_factory=list)
+    chunks: List[Dict[str, Any]] = field(default_factory=list)
+    context: str = ""
+    # Milliseconds per stage: embed, search, rerank (dedupe, cross_encoder, mmr)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def has_context(self) -> bool:
+        return bool(self.chunks and self.context)
+
 
 class RAGService:
     """RAG service using ChromaDB for vector storage and retrieval"""
@@ -24,152 +74,388 @@ class RAGService:
     def __init__(self, collection_name: str = "documents"):
         self.collection_name = collection_name
         self.embedding_service = EmbeddingService()
+        self.lexical_index = LexicalIndex()
+        self.reranker = ChunkReranker()
+    
+    @property
+    def client(self):
+        return get_chroma_client()
+    
+    @property
+    def collection(self):
+        # Resolved per use from the process-wide registry, so constructing
+        # the service never opens the vector store
+        return get_collection(self.collection_name)
+    
+    @staticmethod
+    def per_user_collections_enabled() -> bool:
+        return getattr(settings, 'RAG_PER_USER_COLLECTIONS', False)
+    
+    def user_collection_name(self, user_id: int) -> str:
+        return f"{self.collection_name}_user_{user_id}"
+    
+    def collection_for_user(self, user_id: int = None):
+        """
+        Collection holding the given user's chunks.
         
-        # Initialize ChromaDB with persistent storage
-        db_path = os.path.join(settings.BASE_DIR, "chromadb")
-        os.makedirs(db_path, exist_ok=True)
+        With RAG_PER_USER_COLLECTIONS every user gets their own collection;
+        otherwise all users share one collection filtered by user_id metadata.
+        """
+        if user_id and self.per_user_collections_enabled():
+            return get_collection(self.user_collection_name(user_id))
+        return self.collection
+    
+    @staticmethod
+    def chunk_vector_id(document_id: int, content_hash: str, occurrence: int = 0) -> str:
+        """
+        ChromaDB id of a chunk.
         
+        Derived from the chunk's content rather than its position, so an
+        unchanged chunk keeps its id (and vector) when text before it is
+        edited. occurrence tells apart identical chunks within a document.
+        """
+        suffix = f"_{occurrence}" if occurrence else ""
+        return f"doc_{document_id}_{content_hash}{suffix}"
+    
+    @staticmethod
+    def _existing_vector_ids(collection, document_id: int) -> Set[str]:
         try:
-            self.client = chromadb.PersistentClient(
-                path=db_path,
-                settings=Settings(
-                    anonymized_telemetry=False,
-                    allow_reset=True,
-                    is_persistent=True
-                )
-            )
-        except Exception as telemetry_error:
-            # Fallback: ignore telemetry errors
-            logger.warning(f"ChromaDB telemetry initialization warning: {telemetry_error}")
-            self.client = chromadb.PersistentClient(
-                path=db_path,
-                settings=Settings(
-                    anonymized_telemetry=False,
-                    allow_reset=True,
-                    is_persistent=True
-                )
-            )
-        
-        # Get or create collection
+            return set(collection.get(where={'document_id': document_id}, include=[])['ids'])
+        except Exception as e:
+            logger.warning(f"Could not list stored vectors of document {document_id}, re-embedding all chunks: {e}")
+            return set()
+    
+    @staticmethod
+    def _stored_embeddings(collection, vector_ids: List[str]) -> Dict[str, List[float]]:
+        """Embeddings already in ChromaDB for the given ids"""
+        if not vector_ids:
+            return {}
         try:
-            self.collection = self.client.get_collection(name=collection_name)
-        except Exception:  # Handle both ValueError and InvalidCollectionException
-            self.collection = self.client.create_collection(
-                name=collection_name,
-                metadata={"description": "Document chunks for RAG"}
-            )
+            result = collection.get(ids=vector_ids, include=['embeddings'])
+            embeddings = result.get('embeddings')
+            if embeddings is None:
+                return {}
+            return {
+                vector_id: np.asarray(embedding, dtype=float).tolist()
+                for vector_id, embedding in zip(result['ids'], embeddings)
+                if embedding is not None and len(embedding)
+            }
+        except Exception as e:
+            logger.warning(f"Could not read stored embeddings, re-embedding {len(vector_ids)} chunks: {e}")
+            return {}
+    
+    @staticmethod
+    def _chunk_metadata(document: Document, chunk: DocumentChunk, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'document_id': document.id,
+            'user_id': document.user_id,
+            'filename': metadata.get('filename', ''),
+            'file_type': metadata.get('file_type', ''),
+            'chunk_index': chunk.chunk_index,
+            'django_chunk_id': chunk.id
+        }
     
-    def add_document_chunks(self, document_id: int, chunks: List[Dict[str, Any]]) -> bool:
-        """Add document chunks to ChromaDB and update Django models"""
+    def add_document_chunks(self, document_id: int, chunks: Iterable[Dict[str, Any]], batch_size: int = None,
+                            progress_callback: Callable[[int, Optional[float]], None] = None) -> int:
+        """
+        Embed and store document chunks in Django and ChromaDB.
+        
+        chunks may be any iterable, including a generator that is still
+        reading the document: it is consumed one batch at a time, with one
+        batch embedding call, one bulk_create and one ChromaDB write per
+        batch, so memory does not grow with the document. After each batch
+        progress_callback(stored_count, progress) is called with the
+        'progress' of the batch's last chunk, if any.
+        
+        Re-indexing is incremental: chunks whose content already has a
+        vector from an earlier run (a retry, or a reprocess of an edited
+        file) reuse it instead of being embedded again, and only vectors
+        that no longer match any chunk are deleted at the end. Django rows
+        are always rebuilt. Returns the number of chunks stored; the caller
+        owns the document status transition.
+        
+        Returns 0 for a missing document. When ingest fails part-way,
+        ChunkIngestError carries the number of chunks already stored; a
+        retry rebuilds the rows and reuses the stored vectors.
+        """
+        batch_size = batch_size or getattr(settings, 'RAG_CHUNK_BATCH_SIZE', 100)
         try:
             document = Document.objects.get(id=document_id)
+        except Document.DoesNotExist:
+            logger.error(f"Error adding document chunks: document {document_id} does not exist")
+            return 0
+        
+        stored_count = 0
+        try:
+            collection = self.collection_for_user(document.user_id)
             
-            # Prepare data for ChromaDB
-            chunk_ids = []
-            chunk_embeddings = []
-            chunk_metadatas = []
-            chunk_documents = []
+            existing_ids = self._existing_vector_ids(collection, document_id)
+            # Rows and keyword entries are cheap to rebuild; the vectors are what is worth keeping
+            DocumentChunk.objects.filter(document=document).delete()
+            index_terms = self.lexical_index.enabled()
+            if index_terms:
+                self.lexical_index.remove_document(document.user_id, document_id)
             
-            # Process each chunk
-            for i, chunk_data in enumerate(chunks):
-                content = chunk_data['content']
-                metadata = chunk_data['metadata']
+            chunk_iterator = iter(chunks)
+            occurrences = Counter()
+            kept_ids = set()
+            total_chunks = 0
+            reused_count = 0
+            
+            while True:
+                batch = list(islice(chunk_iterator, batch_size))
+                if not batch:
+                    break
+                start = total_chunks
+                total_chunks += len(batch)
                 
-                # Generate embedding
-                embedding = self.embedding_service.generate_embedding(content)
-                if not embedding:
-                    logger.warning(f"Failed to generate embedding for chunk {i}")
-                    continue
+                hashes = []
+                vector_ids = []
+                for chunk_data in batch:
+                    content_hash = DocumentChunk.hash_content(chunk_data['content'])
+                    hashes.append(content_hash)
+                    vector_ids.append(self.chunk_vector_id(document_id, content_hash, occurrences[content_hash]))
+                    occurrences[content_hash] += 1
                 
-                # Create Django DocumentChunk
-                chunk_obj = DocumentChunk.objects.create(
-                    document=document,
-                    content=content,
-                    chunk_index=i,
-                    total_chunks=len(chunks)
+                embeddings = self._stored_embeddings(
+                    collection, [vector_id for vector_id in vector_ids if vector_id in existing_ids]
                 )
-                chunk_obj.set_embedding(embedding)
-                chunk_obj.save()
+                reused_ids = set(embeddings)
+                to_embed = [offset for offset, vector_id in enumerate(vector_ids) if vector_id not in embeddings]
+                if to_embed:
+                    batch_result = self.embedding_service.generate_embeddings_batch(
+                        [batch[offset]['content'] for offset in to_embed]
+                    )
+                    for offset, embedding in zip(to_embed, batch_result.embeddings):
+                        if embedding:
+                            embeddings[vector_ids[offset]] = embedding
                 
-                # Prepare for ChromaDB
-                chunk_id = f"doc_{document_id}_chunk_{i}"
-                chunk_ids.append(chunk_id)
-                chunk_embeddings.append(embedding)
-                chunk_metadatas.append({
-                    'document_id': document_id,
-                    'filename': metadata.get('filename', ''),
-                    'file_type': metadata.get('file_type', ''),
-                    'chunk_index': i,
-                    'django_chunk_id': chunk_obj.id
-                })
-                chunk_documents.append(content)
-            
-            if chunk_ids:
-                # Add to ChromaDB
-                self.collection.add(
-                    ids=chunk_ids,
-                    embeddings=chunk_embeddings,
-                    metadatas=chunk_metadatas,
-                    documents=chunk_documents
-                )
+                chunk_objs = []
+                chunk_vector_ids = []
+                batch_metadata = []
+                for offset, chunk_data in enumerate(batch):
+                    chunk_index = start + offset
+                    embedding = embeddings.get(vector_ids[offset])
+                    if not embedding:
+                        logger.warning(f"Failed to generate embedding for chunk {chunk_index}")
+                        continue
+                    
+                    chunk_obj = DocumentChunk(
+                        document=document,
+                        content=chunk_data['content'],
+                        chunk_index=chunk_index,
+                        # Final count is only known at the end, see below
+                        total_chunks=0,
+                        # bulk_create bypasses save(), so set these explicitly
+                        character_count=len(chunk_data['content']),
+                        content_hash=hashes[offset]
+                    )
+                    chunk_obj.set_embedding(embedding)
+                    chunk_objs.append(chunk_obj)
+                    chunk_vector_ids.append(vector_ids[offset])
+                    batch_metadata.append(chunk_data['metadata'])
                 
-                # Mark document as processed
-                document.mark_as_completed(chunk_count=len(chunk_ids))
+                if chunk_objs:
+                    created_chunks = DocumentChunk.objects.bulk_create(chunk_objs)
+                    
+                    new_rows = []
+                    reused_rows = []
+                    for vector_id, chunk, metadata in zip(chunk_vector_ids, created_chunks, batch_metadata):
+                        (reused_rows if vector_id in reused_ids else new_rows).append((vector_id, chunk, metadata))
+                    
+                    if new_rows:
+                        collection.upsert(
+                            ids=[vector_id for vector_id, _, _ in new_rows],
+                            embeddings=[embeddings[vector_id] for vector_id, _, _ in new_rows],
+                            metadatas=[self._chunk_metadata(document, chunk, metadata) for _, chunk, metadata in new_rows],
+                            documents=[chunk.content for _, chunk, _ in new_rows]
+                        )
+                    if reused_rows:
+                        # The vector stays; only position and row id may have moved
+                        collection.update(
+                            ids=[vector_id for vector_id, _, _ in reused_rows],
+                            metadatas=[self._chunk_metadata(document, chunk, metadata) for _, chunk, metadata in reused_rows]
+                        )
+                    if index_terms:
+                        self.lexical_index.add_chunks(
+                            document.user_id, document_id,
+                            [(vector_id, chunk.content) for vector_id, chunk in zip(chunk_vector_ids, created_chunks)]
+                        )
+                    kept_ids.update(chunk_vector_ids)
+                    stored_count += len(created_chunks)
+                    reused_count += len(reused_rows)
                 
-                logger.info(f"Added {len(chunk_ids)} chunks for document {document.filename}")
-                return True
+                if progress_callback:
+                    progress_callback(stored_count, batch[-1].get('progress'))
+            
+            stale_ids = list(existing_ids - kept_ids)
+            for start in range(0, len(stale_ids), batch_size):
+                collection.delete(ids=stale_ids[start:start + batch_size])
+            
+            DocumentChunk.objects.filter(document=document).update(total_chunks=total_chunks)
+            logger.info(
+                f"Added {stored_count}/{total_chunks} chunks for document {document.filename} "
+                f"({reused_count} reused, {len(stale_ids)} stale vectors removed)"
+            )
+            return stored_count
                 
         except Exception as e:
-            logger.error(f"Error adding document chunks: {e}")
-            return False
-        
-        return False
+            logger.error(f"Error adding document chunks after storing {stored_count}: {e}")
+            raise ChunkIngestError(
+                f"Storing chunks of document {document_id} failed after {stored_count} chunks: {e}",
+                stored_count=stored_count
+            ) from e
     
-    def search_similar_chunks(self, query: str, n_results: int = 5, user_id: int = None) -> List[Dict[str, Any]]:
-        """Search for similar document chunks"""
+    def retrieve(self, query: str, n_results: int = 5, user_id: int = None) -> RetrievalResult:
+        """
+        Embed the query once, search once and build the RAG context.
+        
+        For a user's search the vector hits are fused with BM25 keyword
+        hits by reciprocal rank fusion (see lexical_index), so exact
+        identifiers and names are found even when their embedding is not
+        close. With RAG_RERANK the search over-fetches and the reranker
+        dedupes and diversifies the hits down to n_results (see reranker).
+        Callers that need both the hits and the context should use this
+        instead of search_similar_chunks + generate_rag_context.
+        """
+        result = RetrievalResult(query=query)
+        timings = result.timings
         try:
             # Generate query embedding
-            query_embedding = self.embedding_service.generate_embedding(query)
-            if not query_embedding:
+            with timed(timings, 'embed'):
+                result.query_embedding = self.embedding_service.generate_embedding(query)
+            if not result.query_embedding:
                 logger.warning("Failed to generate embedding for query")
-                return []
-            
-            # Search in ChromaDB
-            where_filter = {}
-            if user_id:
-                # Filter by user's documents
-                user_doc_ids = list(Document.objects.filter(user_id=user_id).values_list('id', flat=True))
-                if not user_doc_ids:
-                    return []
-                where_filter = {"document_id": {"$in": user_doc_ids}}
+                return result
             
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                where=where_filter if where_filter else None
-            )
-            
-            # Format results
-            similar_chunks = []
-            if results['ids'] and results['ids'][0]:
-                for i, chunk_id in enumerate(results['ids'][0]):
-                    similar_chunks.append({
-                        'id': chunk_id,
-                        'content': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i],
-                        'distance': results['distances'][0][i] if results.get('distances') else 0.0
-                    })
+            rerank = self.reranker.enabled()
+            fetch = n_results * self.reranker.overfetch() if rerank else n_results
+            with timed(timings, 'search'):
+                # Hit vectors give the cosine similarity (and feed MMR when reranking)
+                if user_id and self.lexical_index.enabled() and self.lexical_index.has_index(user_id):
+                    candidates = max(fetch, getattr(settings, 'RAG_FUSION_CANDIDATES', 20))
+                    dense_chunks = self._query_collection(
+                        result.query_embedding, n_results=candidates, user_id=user_id, include_embeddings=True
+                    )
+                    lexical_hits = self.lexical_index.search(user_id, query, limit=candidates)
+                    result.chunks = self._fuse_results(
+                        result.query_embedding, dense_chunks, lexical_hits, n_results=fetch, user_id=user_id
+                    )
+                else:
+                    result.chunks = self._query_collection(
+                        result.query_embedding, n_results=fetch, user_id=user_id, include_embeddings=True
+                    )
+                annotate_similarity(result.query_embedding, result.chunks)
             
-            return similar_chunks
+            if rerank:
+                with timed(timings, 'rerank'):
+                    result.chunks = self.reranker.rerank(
+                        query, result.query_embedding, result.chunks, n_results, timings
+                    )
+            # Vectors are not needed past this point; keep them out of metadata and caches
+            for chunk in result.chunks:
+                chunk.pop('embedding', None)
+            result.context = self.build_context(result.chunks)
+            logger.debug(f"Retrieval timings (ms): {timings}")
             
         except Exception as e:
             logger.error(f"Error searching similar chunks: {e}")
-            return []
+        
+        return result
     
-    def generate_rag_context(self, query: str, user_id: int = None, max_chunks: int = 3) -> str:
-        """Generate context from relevant document chunks for RAG"""
-        similar_chunks = self.search_similar_chunks(query, n_results=max_chunks, user_id=user_id)
+    def _fuse_results(self, query_embedding: List[float], dense_chunks: List[Dict[str, Any]],
+                      lexical_hits: List[Tuple[str, float]], n_results: int = 5,
+                      user_id: int = None) -> List[Dict[str, Any]]:
+        """
+        Top n_results of the reciprocal rank fusion of vector and keyword hits.
+        
+        Keyword-only hits are read back from ChromaDB, with their distance
+        to the query computed the way the collection does (squared L2), so
+        every returned chunk has the same shape as a vector hit.
+        """
+        if not lexical_hits:
+            return dense_chunks[:n_results]
         
+        fused = reciprocal_rank_fusion(
+            [[chunk['id'] for chunk in dense_chunks], [vector_id for vector_id, _ in lexical_hits]],
+            k=getattr(settings, 'RAG_RRF_K', 60)
+        )[:n_results]
+        
+        chunks_by_id = {chunk['id']: dict(chunk, retrieval='dense') for chunk in dense_chunks}
+        lexical_ids = {vector_id for vector_id, _ in lexical_hits}
+        missing_ids = [vector_id for vector_id, _ in fused if vector_id not in chunks_by_id]
+        if missing_ids:
+            stored = self.collection_for_user(user_id).get(
+                ids=missing_ids, include=['documents', 'metadatas', 'embeddings']
+            )
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            for i, vector_id in enumerate(stored['ids']):
+                vector = np.asarray(stored['embeddings'][i], dtype=np.float32)
+                chunks_by_id[vector_id] = {
+                    'id': vector_id,
+                    'content': stored['documents'][i],
+                    'metadata': stored['metadatas'][i],
+                    'distance': float(np.sum((vector - query_vector) ** 2)),
+                    'embedding': stored['embeddings'][i],
+                    'retrieval': 'lexical'
+                }
+        
+        chunks = []
+        for vector_id, score in fused:
+            chunk = chunks_by_id.get(vector_id)
+            if chunk is None:
+                # Keyword entry of a vector that is gone
+                continue
+            if vector_id in lexical_ids and chunk['retrieval'] == 'dense':
+                chunk['retrieval'] = 'hybrid'
+            chunk['fusion_score'] = score
+            chunks.append(chunk)
+        return chunks
+    
+    def _query_collection(self, query_embedding: List[float], n_results: int = 5,
+                          user_id: int = None, include_embeddings: bool = False) -> List[Dict[str, Any]]:
+        """Run a similarity query for an already computed embedding, optionally returning hit vectors"""
+        # Search in ChromaDB
+        collection = self.collection_for_user(user_id)
+        where_filter = None
+        if user_id and not self.per_user_collections_enabled():
+            # Chunks carry user_id metadata, so this is a plain equality filter
+            # (run backfill_chunk_user_ids for chunks indexed before that)
+            where_filter = {"user_id": user_id}
+        
+        query_kwargs = {}
+        if include_embeddings:
+            query_kwargs['include'] = ['documents', 'metadatas', 'distances', 'embeddings']
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=where_filter,
+            **query_kwargs
+        )
+        embeddings = results.get('embeddings') if include_embeddings else None
+        
+        # Format results
+        similar_chunks = []
+        if results['ids'] and results['ids'][0]:
+            for i, chunk_id in enumerate(results['ids'][0]):
+                similar_chunks.append({
+                    'id': chunk_id,
+                    'content': results['documents'][0][i],
+                    'metadata': results['metadatas'][0][i],
+                    'distance': results['distances'][0][i] if results.get('distances') else 0.0
+                })
+                if embeddings is not None:
+                    similar_chunks[-1]['embedding'] = embeddings[0][i]
+        
+        return similar_chunks
+    
+    def search_similar_chunks(self, query: str, n_results: int = 5, user_id: int = None) -> List[Dict[str, Any]]:
+        """Search for similar document chunks"""
+        return self.retrieve(query, n_results=n_results, user_id=user_id).chunks
+    
+    @staticmethod
+    def build_context(similar_chunks: List[Dict[str, Any]]) -> str:
+        """Build the RAG prompt context from retrieved chunks"""
         if not similar_chunks:
             return ""
         
@@ -186,6 +472,31 @@ class RAGService:
         
         return "\n".join(context_parts)
     
+    def generate_rag_context(self, query: str, user_id: int = None, max_chunks: int = 3) -> str:
+        """Generate context from relevant document chunks for RAG"""
+        return self.retrieve(query, n_results=max_chunks, user_id=user_id).context
+    
+    def user_has_documents(self, user_id: int) -> bool:
+        """
+        Whether the user has any processed documents.
+        
+        Cached per user; Document save/delete signals drop the cached flag.
+        """
+        key = user_has_documents_cache_key(user_id)
+        try:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            logger.warning(f"Could not read document flag from cache: {e}")
+        
+        has_documents = Document.objects.filter(user_id=user_id, processing_status='completed').exists()
+        try:
+            cache.set(key, has_documents, getattr(settings, 'RAG_HAS_DOCUMENTS_CACHE_TTL', 60 * 10))
+        except Exception as e:
+            logger.warning(f"Could not cache document flag: {e}")
+        return has_documents
+    
     def get_document_stats(self, user_id: int = None) -> Dict[str, int]:
         """Get statistics about stored documents"""
         try:
@@ -197,7 +508,7 @@ class RAGService:
                 chunks_count = DocumentChunk.objects.count()
             
             # Get ChromaDB collection count
-            collection_count = self.collection.count()
+            collection_count = self.collection_for_user(user_id).count()
             
             return {
                 'documents': docs_count,
@@ -213,13 +524,9 @@ class RAGService:
         try:
             document = Document.objects.get(id=document_id)
             
-            # Get chunk IDs for ChromaDB deletion
-            chunk_ids = [f"doc_{document_id}_chunk_{chunk.chunk_index}" 
-                        for chunk in document.chunks.all()]
-            
-            # Delete from ChromaDB
-            if chunk_ids:
-                self.collection.delete(ids=chunk_ids)
+            # Delete from ChromaDB, whichever id scheme the vectors were stored under
+            self.collection_for_user(document.user_id).delete(where={'document_id': document_id})
+            self.lexical_index.remove_document(document.user_id, document_id)
             
             # Delete from Django
             document.delete()  # This will cascade delete chunks
@@ -238,11 +545,7 @@ class RAGService:
     def get_collection_info(self) -> dict:
         """Get information about the ChromaDB collection"""
         try:
-            if not hasattr(self, 'chroma_client') or self.chroma_client is None:
-                self._init_chroma()
-            
-            collection = self.chroma_client.get_collection(name=self.collection_name)
-            count = collection.count()
+            count = self.collection.count()
             return {
                 'count': count,
                 'collection_name': self.collection_name,
@@ -255,4 +558,29 @@ class RAGService:
                 'collection_name': self.collection_name,
                 'status': 'error',
                 'error': str(e)
-            }
\ No newline at end of file
+            }
+
+
+_rag_services: Dict[str, RAGService] = {}
+_rag_services_lock = threading.Lock()
+
+
+def get_rag_service(collection_name: str = "documents") -> RAGService:
+    """Get the process-wide RAGService for a collection"""
+    with _rag_services_lock:
+        service = _rag_services.get(collection_name)
+        if service is None:
+            service = RAGService(collection_name)
+            _rag_services[collection_name] = service
+        return service
+
+
+def _reset_rag_services() -> None:
+    """Forget services inherited from a parent process, with their HTTP sessions"""
+    global _rag_services_lock
+    _rag_services_lock = threading.Lock()
+    _rag_services.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_rag_services)
@@ -0,0 +1,194 @@
+"""
+Reranking of retrieved chunks before they go into the prompt.
+
+Retrieval over-fetches RAG_RERANK_OVERFETCH times the chunks a prompt needs;
+the reranker then
+
+1. drops exact duplicates and stitches neighbouring chunks of the same
+   document back together, since the splitter repeats up to chunk_overlap
+   characters at every boundary,
+2. optionally scores (query, chunk) pairs with a local CPU cross-encoder
+   (RAG_RERANKER_MODEL, needs sentence-transformers),
+3. picks the final chunks by Maximal Marginal Relevance over the chunk
+   vectors ChromaDB already returned, trading relevance against similarity
+   to chunks already picked (RAG_MMR_LAMBDA).
+
+Each stage adds its cost to the retrieval timings.
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+_cross_encoders: Dict[str, Any] = {}
+_cross_encoder_lock = threading.Lock()
+
+
+def get_cross_encoder(model_name: str):
+    """Load a CPU cross-encoder once per process; None when unavailable"""
+    with _cross_encoder_lock:
+        if model_name not in _cross_encoders:
+            try:
+                from sentence_transformers import CrossEncoder
+                _cross_encoders[model_name] = CrossEncoder(model_name, device='cpu')
+                logger.info(f"Loaded reranker model {model_name}")
+            except Exception as e:
+                logger.warning(f"Reranker model {model_name} unavailable, skipping cross-encoder stage: {e}")
+                _cross_encoders[model_name] = None
+        return _cross_encoders[model_name]
+
+
+def _reset_cross_encoders() -> None:
+    global _cross_encoder_lock
+    # A fork may have copied the lock in a held state
+    _cross_encoder_lock = threading.Lock()
+    _cross_encoders.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_cross_encoders)
+
+
+# DocumentProcessor repeats chunk_overlap=200 characters between neighbours;
+# splitting on whitespace can stretch that, never doubling it
+MAX_CHUNK_OVERLAP = 400
+
+
+def _overlap(earlier: str, later: str, max_overlap: int) -> int:
+    """Length of the longest suffix of earlier that starts later"""
+    for size in range(min(len(earlier), len(later), max_overlap), 0, -1):
+        if earlier.endswith(later[:size]):
+            return size
+    return 0
+
+
+class ChunkReranker:
+    """Dedupe, optional cross-encoder scoring and MMR selection of chunks"""
+
+    def __init__(self, mmr_lambda: float = None, model_name: str = None):
+        self.mmr_lambda = mmr_lambda if mmr_lambda is not None else getattr(settings, 'RAG_MMR_LAMBDA', 0.7)
+        self.model_name = model_name if model_name is not None else getattr(settings, 'RAG_RERANKER_MODEL', '')
+        self.min_overlap = getattr(settings, 'RAG_DEDUPE_MIN_OVERLAP', 50)
+
+    @staticmethod
+    def enabled() -> bool:
+        return getattr(settings, 'RAG_RERANK', True)
+
+    @staticmethod
+    def overfetch() -> int:
+        return max(1, getattr(settings, 'RAG_RERANK_OVERFETCH', 4))
+
+    def rerank(self, query: str, query_embedding: List[float], chunks: List[Dict[str, Any]],
+               n_results: int, timings: Dict[str, float]) -> List[Dict[str, Any]]:
+        """The n_results chunks to use, best first"""
+        with timed(timings, 'dedupe'):
+            chunks = self.dedupe(chunks)
+
+        relevance = None
+        if self.model_name and len(chunks) > 1:
+            with timed(timings, 'cross_encoder'):
+                relevance = self.cross_encoder_scores(query, chunks)
+
+        with timed(timings, 'mmr'):
+            return self.mmr(query_embedding, chunks, n_results, relevance)
+
+    def dedupe(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Drop repeated texts and merge overlapping neighbours of one document.
+
+        A merged chunk keeps the better rank and covers both texts once;
+        metadata['merged_chunk_indexes'] lists what it covers.
+        """
+        kept: List[Dict[str, Any]] = []
+        seen_texts = set()
+        by_position = {}
+        for chunk in chunks:
+            content = chunk.get('content') or ''
+            if content in seen_texts:
+                continue
+            seen_texts.add(content)
+
+            metadata = chunk.get('metadata') or {}
+            document_id = metadata.get('document_id')
+            chunk_index = metadata.get('chunk_index')
+            if document_id is not None and chunk_index is not None:
+                merged = False
+                for neighbour_index, chunk_is_later in ((chunk_index - 1, True), (chunk_index + 1, False)):
+                    neighbour = by_position.get((document_id, neighbour_index))
+                    if neighbour is None:
+                        continue
+                    earlier, later = (neighbour['content'], content) if chunk_is_later else (content, neighbour['content'])
+                    overlap = _overlap(earlier, later, MAX_CHUNK_OVERLAP)
+                    if overlap >= self.min_overlap:
+                        neighbour['content'] = earlier + later[overlap:]
+                        indexes = neighbour['metadata'].setdefault('merged_chunk_indexes', [neighbour_index])
+                        indexes.append(chunk_index)
+                        indexes.sort()
+                        by_position[(document_id, chunk_index)] = neighbour
+                        merged = True
+                        break
+                if merged:
+                    continue
+
+            chunk = dict(chunk, metadata=dict(metadata))
+            kept.append(chunk)
+            if document_id is not None and chunk_index is not None:
+                by_position[(document_id, chunk_index)] = chunk
+        return kept
+
+    def cross_encoder_scores(self, query: str, chunks: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Cross-encoder relevance of each chunk scaled to 0-1, or None without a model"""
+        model = get_cross_encoder(self.model_name)
+        if model is None:
+            return None
+        try:
+            scores = np.asarray(model.predict([(query, chunk['content']) for chunk in chunks]), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Cross-encoder scoring failed: {e}")
+            return None
+        for chunk, score in zip(chunks, scores):
+            chunk['rerank_score'] = float(score)
+        spread = scores.max() - scores.min()
+        return (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+    def mmr(self, query_embedding: List[float], chunks: List[Dict[str, Any]], n_results: int,
+            relevance: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        Greedy Maximal Marginal Relevance selection.
+
+        Relevance is the cross-encoder score when given, otherwise cosine
+        similarity to the query. Without vectors for every chunk the
+        current order is kept.
+        """
+        if len(chunks) <= 1 or any(chunk.get('embedding') is None for chunk in chunks):
+            return chunks[:n_results]
+
+        vectors = np.asarray([chunk['embedding'] for chunk in chunks], dtype=np.float32)
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != query_vector.shape[0]:
+            return chunks[:n_results]
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+
+        if relevance is None:
+            relevance = vectors @ query_vector
+        similarity = vectors @ vectors.T
+
+        selected = [int(np.argmax(relevance))]
+        # Highest similarity of every candidate to anything selected so far
+        redundancy = similarity[selected[0]].copy()
+        while len(selected) < min(n_results, len(chunks)):
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+            scores[selected] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            redundancy = np.maximum(redundancy, similarity[best])
+        return [chunks[i] for i in selected]
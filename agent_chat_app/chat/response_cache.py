@@ -0,0 +1,148 @@
+"""
+Semantic cache of chat responses.
+
+Responses are grouped in buckets keyed by (user, document-set version,
+model, system instruction hash). A lookup embeds the question and returns
+the best cached answer in the bucket whose question embedding has cosine
+similarity of at least RESPONSE_CACHE_SIMILARITY_THRESHOLD. Buckets live in
+the Django cache (Redis); each keeps at most RESPONSE_CACHE_MAX_ENTRIES
+answers, evicting the least recently used, and entries expire after
+RESPONSE_CACHE_TTL.
+
+The document-set version is a per-user token that Document save/delete
+signals replace, so any upload, reprocess or deletion makes the user's
+older answers unreachable.
+"""
+
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import document_set_version_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+def get_document_set_version(user_id: int) -> str:
+    """Current document-set version of a user; a lost version is simply replaced"""
+    key = document_set_version_cache_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = str(time.time_ns())
+        # add() keeps a version another process just created
+        if not cache.add(key, version, None):
+            version = cache.get(key) or version
+    return version
+
+
+@dataclass
+class CachedResponse:
+    """A cache hit: the stored answer, its metadata and how close the question was"""
+    response: str
+    metadata: Dict[str, Any]
+    similarity: float
+    query: str
+    created_at: float = field(default_factory=time.time)
+
+
+class SemanticResponseCache:
+    """Embedding-similarity cache in front of LLM generation"""
+
+    KEY_PREFIX = "response_cache"
+
+    def __init__(self, threshold: float = None, max_entries: int = None, ttl: int = None):
+        self.threshold = threshold or getattr(settings, 'RESPONSE_CACHE_SIMILARITY_THRESHOLD', 0.95)
+        self.max_entries = max_entries or getattr(settings, 'RESPONSE_CACHE_MAX_ENTRIES', 50)
+        self.ttl = ttl or getattr(settings, 'RESPONSE_CACHE_TTL', 60 * 60 * 24)
+        self.min_query_words = getattr(settings, 'RESPONSE_CACHE_MIN_QUERY_WORDS', 4)
+
+    @staticmethod
+    def enabled() -> bool:
+        return getattr(settings, 'RESPONSE_CACHE_ENABLED', True)
+
+    def is_cacheable(self, query: str) -> bool:
+        # Short follow-ups ("why?", "and the second one?") depend on the conversation
+        return self.enabled() and len(query.split()) >= self.min_query_words
+
+    def bucket_key(self, user_id: int, model: str, system_instruction: str) -> str:
+        instruction_hash = hashlib.sha256((system_instruction or "").encode('utf-8')).hexdigest()[:16]
+        version = get_document_set_version(user_id)
+        return f"{self.KEY_PREFIX}:{user_id}:{version}:{model}:{instruction_hash}"
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not vector.size or norm == 0:
+            return None
+        return vector / norm
+
+    def _live_entries(self, key: str) -> List[Dict[str, Any]]:
+        entries = cache.get(key) or []
+        now = time.time()
+        return [entry for entry in entries if now - entry['created_at'] < self.ttl]
+
+    def lookup(self, user_id: int, model: str, system_instruction: str,
+               query: str, query_embedding: List[float]) -> Optional[CachedResponse]:
+        """Best cached answer for a similar enough question, or None"""
+        query_vector = self._normalize(query_embedding)
+        if query_vector is None:
+            return None
+        try:
+            key = self.bucket_key(user_id, model, system_instruction)
+            entries = self._live_entries(key)
+            if not entries:
+                return None
+
+            matrix = np.stack([np.frombuffer(entry['embedding'], dtype=np.float32) for entry in entries])
+            if matrix.shape[1] != query_vector.shape[0]:
+                return None
+            similarities = matrix @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            entry = entries[best]
+            entry['last_used'] = time.time()
+            cache.set(key, entries, self.ttl)
+            return CachedResponse(
+                response=entry['response'],
+                metadata=entry['metadata'],
+                similarity=float(similarities[best]),
+                query=entry['query'],
+                created_at=entry['created_at']
+            )
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            return None
+
+    def store(self, user_id: int, model: str, system_instruction: str, query: str,
+              query_embedding: List[float], response: str, metadata: Dict[str, Any]) -> None:
+        query_vector = self._normalize(query_embedding)
+        if query_vector is None:
+            return
+        try:
+            key = self.bucket_key(user_id, model, system_instruction)
+            entries = self._live_entries(key)
+            now = time.time()
+            entries.append({
+                'query': query,
+                'embedding': query_vector.tobytes(),
+                'response': response,
+                'metadata': metadata,
+                'created_at': now,
+                'last_used': now,
+            })
+            if len(entries) > self.max_entries:
+                # Least recently used answers go first
+                entries.sort(key=lambda entry: entry['last_used'])
+                entries = entries[-self.max_entries:]
+            cache.set(key, entries, self.ttl)
+        except Exception as e:
+            logger.warning(f"Response cache store failed: {e}")
@@ -1,13 +1,31 @@
-import requests
 import json
 import logging
-from .rag_service import RAGService
-from .models import UserSettings
+from typing import AsyncIterator
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+
+from agent_chat_app.core.ollama_client import get_ollama_client
+from . import conversation_history
+from .conversation_summary import get_summary
+from .prompt_assembler import PromptAssembler
+from .rag_service import get_rag_service
+from .models import UserSettings, user_settings_cache_key
 
 logger = logging.getLogger(__name__)
 
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
-OLLAMA_MODELS_URL = "http://localhost:11434/api/tags"
+OLLAMA_GENERATE_PATH = "/api/generate"
+OLLAMA_MODELS_PATH = "/api/tags"
+
+# Returned by get_response instead of raising
+NO_RESPONSE_FIELD_MESSAGE = "Error: No response field in Ollama output."
+CONNECTION_ERROR_MESSAGE = "Przepraszam, mam problem z połączeniem z modelem językowym."
+INVALID_RESPONSE_MESSAGE = "Przepraszam, otrzymałem nieprawidłową odpowiedź od modelu."
+
+
+class OllamaStreamError(Exception):
+    """Ollama reported an error inside a streamed response"""
 
 
 class OllamaService:
@@ -15,8 +33,7 @@ class OllamaService:
     def get_available_models():
         """Get list of available Ollama models"""
         try:
-            response = requests.get(OLLAMA_MODELS_URL, timeout=10)
-            response.raise_for_status()
+            response = get_ollama_client().get(OLLAMA_MODELS_PATH)
             data = response.json()
             
             models = []
@@ -53,178 +70,195 @@ class OllamaService:
     
     @staticmethod
     def get_user_settings(user_id: int):
-        """Get or create user settings"""
+        """
+        Get or create user settings.
+        
+        Cached per user; UserSettings save/delete signals drop the cached copy.
+        """
+        key = user_settings_cache_key(user_id)
         try:
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-            settings, created = UserSettings.objects.get_or_create(user=user)
-            return settings
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            logger.warning(f"Could not read user settings from cache: {e}")
+        
+        try:
+            user_settings, created = UserSettings.objects.get_or_create(user_id=user_id)
         except Exception as e:
             logger.error(f"Error getting user settings: {e}")
             return None
+        
+        try:
+            cache.set(key, user_settings, getattr(settings, 'USER_SETTINGS_CACHE_TTL', 60 * 30))
+        except Exception as e:
+            logger.warning(f"Could not cache user settings: {e}")
+        return user_settings
     
     @staticmethod
-    def get_response(prompt: str, model: str = None, user_id: int = None, use_rag: bool = True, custom_instruction: str = None, conversation_id: int = None) -> str:
+    def resolve_generation_settings(user_id: int = None, model: str = None, custom_instruction: str = None):
+        """
+        Resolve (user_settings, model, system_instruction) for a generation:
+        explicit arguments win over user settings, which win over defaults.
+        """
+        # Get user settings if user_id provided
+        user_settings = None
+        if user_id:
+            user_settings = OllamaService.get_user_settings(user_id)
+        
+        # Determine model to use
+        final_model = model
+        if not final_model and user_settings:
+            final_model = user_settings.preferred_model
+        if not final_model:
+            final_model = "gemma3:4b"
+        
+        # Prepare system instruction
+        system_instruction = custom_instruction
+        if not system_instruction and user_settings:
+            system_instruction = user_settings.system_instruction
+        if not system_instruction:
+            system_instruction = "You are a helpful AI assistant. Be concise and accurate in your responses."
+        
+        return user_settings, final_model, system_instruction
+    
+    @staticmethod
+    def build_generate_payload(prompt: str, model: str = None, user_id: int = None, use_rag: bool = True,
+                               custom_instruction: str = None, conversation_id: int = None,
+                               stream: bool = False, rag_chunks: list = None) -> dict:
+        """
+        Build the /api/generate payload: model, system instruction, optional RAG
+        chunks, conversation history and user generation options, packed into
+        the model's token budget.
+        
+        rag_chunks are already retrieved chunks (e.g. from hybrid RAG); with
+        use_rag they are retrieved here instead.
+        """
+        user_settings, final_model, system_instruction = OllamaService.resolve_generation_settings(
+            user_id, model=model, custom_instruction=custom_instruction
+        )
+        
+        # Retrieve RAG chunks if enabled and user provided
+        if rag_chunks is None and use_rag and user_id:
+            try:
+                rag_chunks = get_rag_service().retrieve(prompt, n_results=3, user_id=user_id).chunks
+            except Exception as e:
+                logger.warning(f"Failed to generate RAG context: {e}")
+                # Continue with original prompt if RAG fails
+        
+        # Get conversation summary and the turns after it (rolling window from the cache)
+        history = []
+        summary = ""
+        if conversation_id:
+            history = OllamaService.get_conversation_history(conversation_id)
+            try:
+                conversation_summary = get_summary(conversation_id)
+                summary = conversation_summary.text
+                if conversation_summary.through_message_id:
+                    history = [entry for entry in history if entry.pk > conversation_summary.through_message_id]
+            except Exception as e:
+                logger.warning(f"Failed to load conversation summary: {e}")
+        
+        # Pack instruction, chunks and history into the model's context window
+        assembler = PromptAssembler(final_model, response_tokens=user_settings.max_tokens if user_settings else None)
+        assembled = assembler.assemble(
+            system_instruction, prompt, rag_chunks=rag_chunks, history=history, summary=summary
+        )
+        if assembled.chunks_used:
+            logger.info(f"Enhanced prompt with {len(assembled.chunks_used)} RAG chunks for user {user_id}")
+        if assembled.history_dropped or assembled.chunks_dropped:
+            logger.debug(
+                f"Prompt for {final_model} at {assembled.prompt_tokens}/{assembled.budget} tokens; dropped "
+                f"{assembled.history_dropped} history messages and {assembled.chunks_dropped} chunks"
+            )
+        if assembled.messages_counted and conversation_id:
+            conversation_history.update_token_counts(conversation_id, history)
+        full_prompt = assembled.prompt
+        
+        # Prepare payload with user settings
+        payload = {
+            "model": final_model,
+            "prompt": full_prompt,
+            "stream": stream
+        }
+        
+        # Add optional parameters if user settings available
+        if user_settings:
+            if user_settings.temperature:
+                payload["options"] = payload.get("options", {})
+                payload["options"]["temperature"] = user_settings.temperature
+            if user_settings.max_tokens:
+                payload["options"] = payload.get("options", {})
+                payload["options"]["num_predict"] = user_settings.max_tokens
+        
+        return payload
+    
+    @staticmethod
+    def get_response(prompt: str, model: str = None, user_id: int = None, use_rag: bool = True, custom_instruction: str = None, conversation_id: int = None, rag_chunks: list = None) -> str:
         """
         Komunikuje się z API Ollama i zwraca wygenerowaną odpowiedź jako string.
         Opcjonalnie używa RAG do wzbogacenia kontekstu i ustawień użytkownika.
         """
         try:
-            # Get user settings if user_id provided
-            user_settings = None
-            if user_id:
-                user_settings = OllamaService.get_user_settings(user_id)
-            
-            # Determine model to use
-            final_model = model
-            if not final_model and user_settings:
-                final_model = user_settings.preferred_model
-            if not final_model:
-                final_model = "gemma3:4b"
-            
-            # Prepare system instruction
-            system_instruction = custom_instruction
-            if not system_instruction and user_settings:
-                system_instruction = user_settings.system_instruction
-            if not system_instruction:
-                system_instruction = "You are a helpful AI assistant. Be concise and accurate in your responses."
-            
-            # Prepare prompt with RAG context if enabled and user provided
-            final_prompt = prompt
-            if use_rag and user_id:
-                try:
-                    rag_service = RAGService()
-                    rag_context = rag_service.generate_rag_context(prompt, user_id=user_id)
-                    if rag_context:
-                        final_prompt = f"{rag_context}\n\nUser question: {prompt}"
-                        logger.info(f"Enhanced prompt with RAG context for user {user_id}")
-                except Exception as e:
-                    logger.warning(f"Failed to generate RAG context: {e}")
-                    # Continue with original prompt if RAG fails
-            
-            # Get conversation context if provided
-            context_messages = []
-            if conversation_id:
-                context_messages = OllamaService.get_conversation_context(conversation_id)
-            
-            # Build context-aware prompt
-            if context_messages:
-                context_str = "\n".join(context_messages[-10:])  # Last 10 messages for context
-                full_prompt = f"{system_instruction}\n\nConversation context:\n{context_str}\n\nUser: {final_prompt}\nAssistant:"
-            else:
-                full_prompt = f"{system_instruction}\n\nUser: {final_prompt}\nAssistant:"
-            
-            # Optimize context window
-            full_prompt = OllamaService.optimize_context_window(full_prompt, user_settings)
-            
-            # Prepare payload with user settings
-            payload = {
-                "model": final_model,
-                "prompt": full_prompt,
-                "stream": False
-            }
+            payload = OllamaService.build_generate_payload(
+                prompt,
+                model=model,
+                user_id=user_id,
+                use_rag=use_rag,
+                custom_instruction=custom_instruction,
+                conversation_id=conversation_id,
+                rag_chunks=rag_chunks
+            )
             
-            # Add optional parameters if user settings available
-            if user_settings:
-                if user_settings.temperature:
-                    payload["options"] = payload.get("options", {})
-                    payload["options"]["temperature"] = user_settings.temperature
-                if user_settings.max_tokens:
-                    payload["options"] = payload.get("options", {})
-                    payload["options"]["num_predict"] = user_settings.max_tokens
-            
-            response = requests.post(OLLAMA_API_URL, json=payload, timeout=90)
-            response.raise_for_status()
-
+            response = get_ollama_client().post(OLLAMA_GENERATE_PATH, json=payload)
             response_data = response.json()
             
-            return response_data.get("response", "Error: No response field in Ollama output.")
+            return response_data.get("response", NO_RESPONSE_FIELD_MESSAGE)
 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Błąd połączenia z Ollama: {e}")
-            return "Przepraszam, mam problem z połączeniem z modelem językowym."
+            return CONNECTION_ERROR_MESSAGE
         except json.JSONDecodeError as e:
             logger.error(f"Błąd parsowania odpowiedzi od Ollama: {e}")
-            return "Przepraszam, otrzymałem nieprawidłową odpowiedź od modelu."
+            return INVALID_RESPONSE_MESSAGE
+    
+    @staticmethod
+    def is_error_response(text: str) -> bool:
+        """Whether get_response returned one of its error messages instead of an answer"""
+        return text in (NO_RESPONSE_FIELD_MESSAGE, CONNECTION_ERROR_MESSAGE, INVALID_RESPONSE_MESSAGE)
     
     @staticmethod
-    def get_conversation_context(conversation_id: int, max_messages: int = 10) -> list:
-        """Get recent messages from conversation for context"""
+    async def stream_response(payload: dict) -> AsyncIterator[str]:
+        """
+        Stream response fragments from Ollama's NDJSON /api/generate output.
+        
+        Closing the generator (e.g. cancelling the consuming task) closes the
+        HTTP stream, which makes Ollama stop generating.
+        Raises httpx.HTTPError or OllamaStreamError on failure.
+        """
+        stream = get_ollama_client().astream_json(
+            OLLAMA_GENERATE_PATH,
+            json=dict(payload, stream=True),
+            timeout=getattr(settings, 'OLLAMA_STREAM_READ_TIMEOUT', 90)
+        )
         try:
-            from .models import Conversation, Message
-            conversation = Conversation.objects.get(id=conversation_id)
-            
-            recent_messages = Message.objects.filter(
-                conversation=conversation
-            ).order_by('-created_at')[:max_messages]
-            
-            context_messages = []
-            for msg in reversed(recent_messages):  # Chronological order
-                role = "User" if msg.is_from_user else "Assistant"
-                context_messages.append(f"{role}: {msg.text}")
-            
-            return context_messages
-        except Exception as e:
-            logger.error(f"Error getting conversation context: {e}")
-            return []
+            async for data in stream:
+                if data.get('error'):
+                    raise OllamaStreamError(data['error'])
+                fragment = data.get('response')
+                if fragment:
+                    yield fragment
+                if data.get('done'):
+                    break
+        finally:
+            # Release the connection and concurrency slot right away
+            await stream.aclose()
     
     @staticmethod
-    def optimize_context_window(prompt: str, user_settings=None, max_tokens: int = None) -> str:
-        """Optimize prompt to fit within context window limits"""
+    def get_conversation_history(conversation_id: int) -> list:
+        """Get recent messages of a conversation in chronological order"""
         try:
-            # Determine max tokens
-            if max_tokens is None:
-                max_tokens = user_settings.max_tokens if user_settings else 2048
-            
-            # Rough estimation: 1 token ≈ 4 characters
-            max_chars = max_tokens * 3  # Leave room for response
-            
-            if len(prompt) <= max_chars:
-                return prompt
-            
-            # If too long, prioritize recent context and current query
-            lines = prompt.split('\n')
-            system_instruction = []
-            context_lines = []
-            current_query = []
-            
-            in_context = False
-            for line in lines:
-                if "Conversation context:" in line:
-                    in_context = True
-                    continue
-                elif "User:" in line and in_context:
-                    in_context = False
-                    current_query.append(line)
-                elif in_context:
-                    context_lines.append(line)
-                elif not in_context and not current_query:
-                    system_instruction.append(line)
-                else:
-                    current_query.append(line)
-            
-            # Rebuild with truncated context if necessary
-            system_part = '\n'.join(system_instruction)
-            query_part = '\n'.join(current_query)
-            
-            remaining_chars = max_chars - len(system_part) - len(query_part) - 50  # Buffer
-            
-            if remaining_chars > 100 and context_lines:
-                # Keep most recent context that fits
-                context_str = ''
-                for line in reversed(context_lines):
-                    test_str = line + '\n' + context_str
-                    if len(test_str) <= remaining_chars:
-                        context_str = test_str
-                    else:
-                        break
-                
-                if context_str:
-                    return f"{system_part}\n\nConversation context:\n{context_str.strip()}\n\n{query_part}"
-            
-            return f"{system_part}\n\n{query_part}"
-            
+            return conversation_history.get_history(conversation_id)
         except Exception as e:
-            logger.error(f"Error optimizing context window: {e}")
-            return prompt  # Return original on error
\ No newline at end of file
+            logger.error(f"Error getting conversation history: {e}")
+            return []
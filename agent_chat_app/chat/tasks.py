@@ -4,12 +4,16 @@ from typing import Optional
 
 from celery import shared_task
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.utils import timezone
 
-from .models import Document
+from .models import Conversation, Document
 from .document_processor import DocumentProcessor
-from .rag_service import RAGService
+from .rag_service import get_rag_service
+from .embeddings import get_embedding_cache
+from .vector_store import get_vector_store_health, reset_vector_store
+from .conversation_summary import maybe_schedule_summary, summarize_conversation, summary_schedule_lock_key
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
@@ -23,6 +27,9 @@ def process_document_task(self, document_id: int) -> Optional[dict]:
     2. Create chunks
     3. Generate embeddings
     4. Store in vector database
+
+    The steps are streamed batch by batch, with Document.processing_progress
+    updated after every batch.
     """
     try:
         document = Document.objects.get(id=document_id)
@@ -37,41 +44,48 @@ def process_document_task(self, document_id: int) -> Optional[dict]:
             logger.error(f"File not found: {file_path}")
             raise FileNotFoundError(f"File not found: {file_path}")
         
-        # Process document based on file type
         processor = DocumentProcessor()
+        extracted = {'chunks': 0, 'content_length': 0}
+        
+        def counted(chunks):
+            for chunk in chunks:
+                extracted['chunks'] += 1
+                extracted['content_length'] += len(chunk['content'])
+                yield chunk
+        
+        def report_progress(stored_count, progress):
+            if progress is not None:
+                document.update_progress(progress)
         
         try:
-            # Process document using DocumentProcessor
-            documents = processor.process_document(file_path, document.filename)
+            # Extraction, splitting, embedding and storage run as one pipeline,
+            # a batch of chunks at a time
+            rag_service = get_rag_service()
+            chunks_created = rag_service.add_document_chunks(
+                document.id,
+                counted(processor.iter_chunks(file_path, document.filename)),
+                progress_callback=report_progress
+            )
             
-            if not documents:
+            if not extracted['chunks']:
                 raise ValueError("No content extracted from document")
-                
-            logger.info(f"Created {len(documents)} chunks from {document.filename}")
             
-            # Store chunks in RAG system
-            rag_service = RAGService()
-            success = rag_service.add_document_chunks(document.id, documents)
+            logger.info(f"Created {extracted['chunks']} chunks from {document.filename}")
             
-            if success:
-                chunks_created = len(documents)
-            else:
+            if not chunks_created:
                 raise ValueError("Failed to store document chunks in RAG system")
             
-            # Mark document as processed
+            # Mark document as processed - the only completed transition
             document.mark_as_completed(chunk_count=chunks_created)
             
             logger.info(f"Successfully processed document {document.filename} with {chunks_created} chunks")
             
-            # Calculate total content length
-            total_content_length = sum(len(doc['content']) for doc in documents)
-            
             return {
                 'status': 'success',
                 'document_id': document_id,
                 'filename': document.filename,
                 'chunks_created': chunks_created,
-                'content_length': total_content_length
+                'content_length': extracted['content_length']
             }
             
         except Exception as processing_error:
@@ -117,7 +131,7 @@ def delete_document_task(document_id: int, file_path: str) -> dict:
         logger.info(f"Deleting document with ID {document_id}")
         
         # Remove from vector database
-        rag_service = RAGService()
+        rag_service = get_rag_service()
         rag_service.remove_document(document_id)
         
         # Remove physical file
@@ -153,7 +167,7 @@ def cleanup_old_documents_task(days_old: int = 30) -> dict:
         old_documents = Document.objects.filter(uploaded_at__lt=cutoff_date)
         
         deleted_count = 0
-        rag_service = RAGService()
+        rag_service = get_rag_service()
         
         for document in old_documents:
             try:
@@ -186,6 +200,36 @@ def cleanup_old_documents_task(days_old: int = 30) -> dict:
         }
 
 
+@shared_task(bind=True, max_retries=3)
+def summarize_conversation_task(self, conversation_id: int) -> dict:
+    """
+    Fold older turns of a conversation into its rolling summary, then queue
+    another run if the backlog still exceeds one batch
+    """
+    try:
+        summary = summarize_conversation(conversation_id)
+    except Conversation.DoesNotExist:
+        cache.delete(summary_schedule_lock_key(conversation_id))
+        return {'status': 'error', 'conversation_id': conversation_id, 'error': 'Conversation not found'}
+    except Exception as e:
+        logger.error(f"Error summarizing conversation {conversation_id}: {e}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(countdown=60 * (self.request.retries + 1), exc=e)
+        cache.delete(summary_schedule_lock_key(conversation_id))
+        return {'status': 'error', 'conversation_id': conversation_id, 'error': str(e)}
+
+    cache.delete(summary_schedule_lock_key(conversation_id))
+    if summary is None:
+        return {'status': 'skipped', 'conversation_id': conversation_id}
+
+    maybe_schedule_summary(conversation_id)
+    return {
+        'status': 'success',
+        'conversation_id': conversation_id,
+        'summary_through_message_id': summary.through_message_id
+    }
+
+
 @shared_task
 def health_check_task() -> dict:
     """
@@ -198,15 +242,21 @@ def health_check_task() -> dict:
             cursor.execute("SELECT 1")
         
         # Test RAG service
-        rag_service = RAGService()
+        rag_service = get_rag_service()
         collection_info = rag_service.get_collection_info()
+        vector_store = get_vector_store_health()
+        if vector_store['status'] != 'ok':
+            # Drop the broken client so the next task in this worker reopens it
+            reset_vector_store()
         
         return {
             'status': 'healthy',
             'timestamp': timezone.now().isoformat(),
             'database': 'ok',
-            'rag_service': 'ok',
-            'collection_count': collection_info.get('count', 0)
+            'rag_service': collection_info.get('status', 'error'),
+            'collection_count': collection_info.get('count', 0),
+            'vector_store': vector_store,
+            'embedding_cache': get_embedding_cache().get_stats()
         }
         
     except Exception as e:
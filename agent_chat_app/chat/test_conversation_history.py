@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from . import conversation_history
+from .models import Conversation, Message, UserSettings
+from .services import OllamaService
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    LLM_MAX_HISTORY_MESSAGES=3
+)
+class TestConversationHistory(TestCase):
+    """Test the cached rolling history window"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='history-user', password='pass')
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def add_message(self, text, is_from_user=True):
+        return Message.objects.create(conversation=self.conversation, text=text, is_from_user=is_from_user)
+
+    def texts(self):
+        return [entry.text for entry in conversation_history.get_history(self.conversation.id)]
+
+    def test_seeds_once_and_appends_new_messages(self):
+        for i in range(4):
+            self.add_message(f"m{i}", is_from_user=i % 2 == 0)
+
+        self.assertEqual(self.texts(), ['m1', 'm2', 'm3'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.texts(), ['m1', 'm2', 'm3'])
+
+        self.add_message("m4")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.texts(), ['m2', 'm3', 'm4'])
+
+    def test_delete_drops_window(self):
+        first = self.add_message("first")
+        self.add_message("second")
+        self.assertEqual(self.texts(), ['first', 'second'])
+
+        first.delete()
+        self.assertEqual(self.texts(), ['second'])
+
+    def test_prompt_building_caches_token_counts(self):
+        self.add_message("earlier question")
+        self.add_message("earlier answer", is_from_user=False)
+        conversation_history.get_history(self.conversation.id)
+
+        payload = OllamaService.build_generate_payload(
+            "new question", user_id=self.user.id, use_rag=False, conversation_id=self.conversation.id
+        )
+
+        self.assertIn("Assistant: earlier answer", payload['prompt'])
+        entries = conversation_history.get_history(self.conversation.id)
+        self.assertTrue(all(entry.token_count for entry in entries))
+        self.assertFalse(Message.objects.filter(token_count__isnull=True).exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestUserSettingsCache(TestCase):
+    """Test per-user settings caching"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='settings-user', password='pass')
+
+    def test_cached_until_settings_change(self):
+        self.assertEqual(OllamaService.get_user_settings(self.user.id).preferred_model, 'gemma3:4b')
+        with self.assertNumQueries(0):
+            OllamaService.get_user_settings(self.user.id)
+
+        user_settings = UserSettings.objects.get(user=self.user)
+        user_settings.preferred_model = 'llama3:8b'
+        user_settings.save()
+
+        self.assertEqual(OllamaService.get_user_settings(self.user.id).preferred_model, 'llama3:8b')
+
+    def test_settings_api_update_invalidates(self):
+        OllamaService.get_user_settings(self.user.id)
+        self.client.force_login(self.user)
+
+        response = self.client.patch(
+            '/api/user-settings/1/', {'temperature': 0.2}, content_type='application/json', HTTP_ACCEPT='application/json; version=v1'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OllamaService.get_user_settings(self.user.id).temperature, 0.2)
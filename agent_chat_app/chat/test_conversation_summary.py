@@ -0,0 +1,108 @@
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .conversation_summary import get_summary, maybe_schedule_summary, summarize_conversation
+from .models import Conversation, Message
+from .services import OllamaService
+from .tasks import summarize_conversation_task
+
+
+def fake_client(summary_text):
+    client = Mock()
+    client.post.return_value.json.return_value = {'response': summary_text}
+    return client
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CONVERSATION_SUMMARY_KEEP_RECENT=2,
+    CONVERSATION_SUMMARY_EVERY=3,
+    CONVERSATION_SUMMARY_BATCH_SIZE=10
+)
+class TestConversationSummary(TestCase):
+    """Test rolling conversation summaries"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='summary-user', password='pass')
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def add_messages(self, count, start=0):
+        return [
+            Message.objects.create(conversation=self.conversation, text=f"m{i}", is_from_user=i % 2 == 0)
+            for i in range(start, start + count)
+        ]
+
+    def test_folds_older_turns_and_keeps_recent(self):
+        messages = self.add_messages(6)
+        updated_at = Conversation.objects.get(pk=self.conversation.pk).updated_at
+        client = fake_client("User asked about m0..m3.")
+
+        with patch('agent_chat_app.chat.conversation_summary.get_ollama_client', return_value=client):
+            summary = summarize_conversation(self.conversation.id)
+
+        self.assertEqual(summary.through_message_id, messages[3].id)
+        prompt = client.post.call_args.kwargs['json']['prompt']
+        self.assertIn("User: m0", prompt)
+        self.assertIn("Assistant: m3", prompt)
+        self.assertNotIn("m4", prompt)
+
+        conversation = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(conversation.summary, "User asked about m0..m3.")
+        self.assertEqual(conversation.updated_at, updated_at)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_summary(self.conversation.id).text, "User asked about m0..m3.")
+
+        # Only the two most recent messages are left; nothing more to fold in
+        self.assertIsNone(summarize_conversation(self.conversation.id))
+
+    def test_next_run_extends_previous_summary(self):
+        self.add_messages(4)
+        with patch('agent_chat_app.chat.conversation_summary.get_ollama_client', return_value=fake_client("first")):
+            summarize_conversation(self.conversation.id)
+        self.add_messages(2, start=4)
+
+        client = fake_client("second")
+        with patch('agent_chat_app.chat.conversation_summary.get_ollama_client', return_value=client):
+            summary = summarize_conversation(self.conversation.id)
+
+        prompt = client.post.call_args.kwargs['json']['prompt']
+        self.assertIn("Current summary:\nfirst", prompt)
+        self.assertIn("User: m2", prompt)
+        self.assertNotIn("m1", prompt)
+        self.assertEqual(summary.text, "second")
+
+    def test_schedules_every_n_messages_once(self):
+        self.add_messages(4)
+        with patch('agent_chat_app.chat.tasks.summarize_conversation_task.delay') as mock_delay:
+            self.assertFalse(maybe_schedule_summary(self.conversation.id))
+            self.add_messages(1, start=4)
+            self.assertTrue(maybe_schedule_summary(self.conversation.id))
+            # Already queued
+            self.assertFalse(maybe_schedule_summary(self.conversation.id))
+
+        mock_delay.assert_called_once_with(self.conversation.id)
+
+    def test_task_summarizes(self):
+        self.add_messages(5)
+        with patch('agent_chat_app.chat.conversation_summary.get_ollama_client', return_value=fake_client("done")):
+            result = summarize_conversation_task.apply(args=[self.conversation.id]).get()
+
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(Conversation.objects.get(pk=self.conversation.pk).summary, "done")
+
+    def test_prompt_uses_summary_and_later_turns(self):
+        self.add_messages(6)
+        with patch('agent_chat_app.chat.conversation_summary.get_ollama_client', return_value=fake_client("SUMMARY")):
+            summarize_conversation(self.conversation.id)
+
+        payload = OllamaService.build_generate_payload(
+            "next question", user_id=self.user.id, use_rag=False, conversation_id=self.conversation.id
+        )
+
+        self.assertIn("Summary of the earlier conversation:\nSUMMARY", payload['prompt'])
+        self.assertIn("User: m4\nAssistant: m5", payload['prompt'])
+        self.assertNotIn("m3", payload['prompt'])
@@ -0,0 +1,279 @@
+import os
+import tempfile
+from unittest.mock import Mock, patch
+
+import openpyxl
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .document_processor import DocumentProcessor
+from .embeddings import EmbeddingBatchResult
+from .models import Document, DocumentChunk
+from .tasks import process_document_task
+
+
+def write_pdf(path, page_texts):
+    """Write a minimal PDF with one line of text per page"""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(page_texts))), len(page_texts)
+        ),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(page_texts):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+class WordSplitter:
+    """Greedy word packer standing in for the langchain splitter"""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+
+    def split_text(self, text):
+        chunks, current = [], ""
+        for word in text.split():
+            if current and len(current) + 1 + len(word) > self.chunk_size:
+                chunks.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        if current:
+            chunks.append(current)
+        return chunks
+
+
+@patch('agent_chat_app.chat.document_processor.RecursiveCharacterTextSplitter', Mock(), create=True)
+class TestPdfExtraction(TestCase):
+    """Test page-level PDF extraction"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pages = [f"Page {i}" for i in range(7)]
+        self.path = os.path.join(directory.name, 'doc.pdf')
+        write_pdf(self.path, self.pages)
+
+    def test_small_pdf_is_extracted_serially(self):
+        processor = DocumentProcessor()
+
+        with patch('agent_chat_app.chat.document_processor._get_pdf_pool') as mock_pool:
+            texts = list(processor.iter_pdf_pages(self.path))
+
+        self.assertEqual([text.strip() for text in texts], self.pages)
+        mock_pool.assert_not_called()
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=2, PDF_PAGE_RANGE_SIZE=2, PDF_EXTRACTION_WORKERS=2)
+    def test_large_pdf_ranges_are_yielded_in_order(self):
+        processor = DocumentProcessor()
+
+        texts = list(processor.iter_pdf_pages(self.path))
+
+        self.assertEqual([text.strip() for text in texts], self.pages)
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=2, PDF_PAGE_RANGE_SIZE=3, PDF_EXTRACTION_WORKERS=2)
+    def test_falls_back_to_serial_when_pool_is_unavailable(self):
+        processor = DocumentProcessor()
+
+        with patch('agent_chat_app.chat.document_processor._get_pdf_pool', side_effect=OSError("no pool")):
+            text = processor.extract_text_from_pdf(self.path)
+
+        self.assertEqual([line.strip() for line in text.splitlines()], self.pages)
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=2, PDF_PAGE_RANGE_SIZE=2, PDF_EXTRACTION_WORKERS=2)
+    def test_falls_back_to_serial_when_pool_cannot_start_processes(self):
+        processor = DocumentProcessor()
+        pool = Mock()
+        pool.submit.side_effect = AssertionError("daemonic processes are not allowed to have children")
+
+        with patch('agent_chat_app.chat.document_processor._get_pdf_pool', return_value=pool):
+            texts = list(processor.iter_pdf_pages(self.path))
+
+        self.assertEqual([text.strip() for text in texts], self.pages)
+        pool.submit.assert_called_once()
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=2, PDF_PAGE_RANGE_SIZE=2, PDF_EXTRACTION_WORKERS=2)
+    def test_daemonic_process_extracts_serially(self):
+        processor = DocumentProcessor()
+
+        with patch('agent_chat_app.chat.document_processor.multiprocessing.current_process',
+                   return_value=Mock(daemon=True)), \
+                patch('agent_chat_app.chat.document_processor._get_pdf_pool') as mock_pool:
+            texts = list(processor.iter_pdf_pages(self.path))
+
+        self.assertEqual([text.strip() for text in texts], self.pages)
+        mock_pool.assert_not_called()
+
+    def test_segments_count_pages_once(self):
+        processor = DocumentProcessor()
+
+        with patch.object(DocumentProcessor, 'count_pdf_pages', wraps=processor.count_pdf_pages) as count_pages:
+            segments = list(processor.iter_pdf_segments(self.path))
+
+        self.assertEqual(count_pages.call_count, 1)
+        self.assertEqual(segments[-1][1], 1.0)
+
+
+class TestStreamingChunks(TestCase):
+    """Test chunking while the document is still being read"""
+
+    def setUp(self):
+        splitter_patcher = patch(
+            'agent_chat_app.chat.document_processor.RecursiveCharacterTextSplitter', Mock(), create=True
+        )
+        splitter_patcher.start()
+        self.addCleanup(splitter_patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.processor = DocumentProcessor(chunk_size=40)
+        self.processor.text_splitter = WordSplitter(40)
+        self.processor.SPLIT_BUFFER_CHUNKS = 2
+        self.processor.TEXT_BLOCK_SIZE = 50
+
+    def test_txt_chunks_match_whole_text_split(self):
+        text = " ".join(f"word{i}" for i in range(300))
+        path = os.path.join(self.directory, 'notes.txt')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+        chunks = list(self.processor.iter_chunks(path))
+
+        self.assertEqual([chunk['content'] for chunk in chunks], WordSplitter(40).split_text(text))
+        self.assertEqual([chunk['metadata']['chunk_index'] for chunk in chunks], list(range(len(chunks))))
+        progress = [chunk['progress'] for chunk in chunks]
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 1.0)
+
+    def test_xlsx_rows_are_streamed(self):
+        path = os.path.join(self.directory, 'sheet.xlsx')
+        workbook = openpyxl.Workbook()
+        workbook.active.title = 'Prices'
+        for i in range(20):
+            workbook.active.append([f"item{i}", i])
+        workbook.save(path)
+
+        with patch('agent_chat_app.chat.document_processor.openpyxl.load_workbook',
+                   wraps=openpyxl.load_workbook) as mock_load:
+            chunks = list(self.processor.iter_chunks(path))
+
+        self.assertTrue(mock_load.call_args.kwargs['read_only'])
+        text = " ".join(chunk['content'] for chunk in chunks)
+        self.assertTrue(text.startswith("Sheet: Prices item0 | 0"))
+        self.assertIn("item19 | 19", text)
+        self.assertEqual(chunks[-1]['progress'], 1.0)
+
+    def test_process_document_adds_total_chunks(self):
+        path = os.path.join(self.directory, 'notes.txt')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(" ".join(f"word{i}" for i in range(30)))
+
+        documents = self.processor.process_document(path)
+
+        self.assertTrue(all(doc['metadata']['total_chunks'] == len(documents) for doc in documents))
+        self.assertNotIn('progress', documents[0])
+        self.assertEqual(self.processor.process_document(os.path.join(self.directory, 'x.csv')), [])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestProcessDocumentTask(TestCase):
+    """Test the ingest task, reprocessing and the progress endpoint"""
+
+    def setUp(self):
+        splitter_patcher = patch(
+            'agent_chat_app.chat.document_processor.RecursiveCharacterTextSplitter',
+            Mock(side_effect=lambda chunk_size, **kwargs: WordSplitter(chunk_size)), create=True
+        )
+        splitter_patcher.start()
+        self.addCleanup(splitter_patcher.stop)
+        collection_patcher = patch('agent_chat_app.chat.rag_service.get_collection', return_value=Mock())
+        collection_patcher.start()
+        self.addCleanup(collection_patcher.stop)
+        embedding_patcher = patch(
+            'agent_chat_app.chat.rag_service.EmbeddingService.generate_embeddings_batch',
+            side_effect=lambda texts: EmbeddingBatchResult(embeddings=[[1.0, 0.0] for _ in texts])
+        )
+        embedding_patcher.start()
+        self.addCleanup(embedding_patcher.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'notes.txt')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(" ".join(f"word{i}" for i in range(2000)))
+
+        self.user = get_user_model().objects.create_user(username='ingest-user', password='pass')
+        self.document = Document.objects.create(
+            user=self.user, filename='notes.txt', file_path=path, file_type='.txt', file_size=os.path.getsize(path)
+        )
+
+    @override_settings(RAG_CHUNK_BATCH_SIZE=5)
+    def test_reports_progress_per_batch(self):
+        progress = []
+        update_progress = Document.update_progress
+
+        def record(document, fraction):
+            update_progress(document, fraction)
+            progress.append(Document.objects.get(pk=document.pk).processing_progress)
+
+        with patch.object(Document, 'update_progress', autospec=True, side_effect=record):
+            result = process_document_task.apply(args=[self.document.id]).get()
+
+        self.assertEqual(result['status'], 'success')
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.processing_status, 'completed')
+        self.assertEqual(self.document.processing_progress, 100)
+        self.assertEqual(self.document.chunk_count, DocumentChunk.objects.filter(document=self.document).count())
+        self.assertGreater(len(progress), 1)
+        self.assertEqual(progress, sorted(progress))
+        self.assertLess(progress[0], 100)
+
+    def test_progress_endpoint(self):
+        self.document.update_progress(0.42)
+        other = get_user_model().objects.create_user(username='other-user', password='pass')
+        foreign = Document.objects.create(
+            user=other, filename='x.txt', file_path='/tmp/x.txt', file_type='.txt', file_size=1
+        )
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse('chat:document_progress'), {'id': [self.document.id, foreign.id]}
+        )
+
+        self.assertEqual(response.json()['documents'], [
+            {'id': self.document.id, 'processing_status': 'pending', 'processing_progress': 42}
+        ])
+
+    def test_reprocess_queues_task_for_completed_document_with_force(self):
+        self.document.mark_as_completed(chunk_count=3)
+        self.client.force_login(self.user)
+        url = f'/api/documents/{self.document.id}/reprocess/'
+
+        with patch('agent_chat_app.chat.api.views.process_document_task.delay') as mock_delay:
+            refused = self.client.post(url, HTTP_ACCEPT='application/json; version=v1')
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'{url}?force=true', HTTP_ACCEPT='application/json; version=v1')
+
+        self.assertEqual(refused.status_code, 400)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['processing_status'], 'pending')
+        mock_delay.assert_called_once_with(self.document.id)
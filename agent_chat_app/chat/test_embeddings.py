@@ -0,0 +1,136 @@
+import json
+import unittest
+
+import httpx
+
+from agent_chat_app.core.ollama_client import OllamaClient
+from .embeddings import EmbeddingService, EmbeddingBatchResult, EmbeddingCache, normalize_embedding
+
+
+def vector(text):
+    """Unnormalized fake embedding that differs per text length"""
+    return [3.0, float(len(text))]
+
+
+class FakeOllama:
+    """Records requests and answers them with the given handler(path, body) -> (status, payload)"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    def __call__(self, request):
+        body = json.loads(request.content)
+        self.requests.append((request.url.path, body))
+        status_code, payload = self.handler(request.url.path, body)
+        return httpx.Response(status_code, json=payload)
+
+    def client(self):
+        return OllamaClient(base_url='http://ollama.test', max_retries=0, transport=httpx.MockTransport(self))
+
+
+class TestEmbeddingBatch(unittest.TestCase):
+    """Test batched embedding generation"""
+
+    def make_service(self, handler):
+        self.ollama = FakeOllama(handler)
+        return EmbeddingService(batch_size=2, max_workers=2, cache=EmbeddingCache(use_shared=False),
+                                client=self.ollama.client())
+
+    def setUp(self):
+        self.service = self.make_service(lambda path, body: (500, {}))
+
+    def test_empty_batch(self):
+        result = self.service.generate_embeddings_batch([])
+
+        self.assertIsInstance(result, EmbeddingBatchResult)
+        self.assertEqual(result.embeddings, [])
+        self.assertTrue(result.all_succeeded)
+
+    def test_uses_multi_input_endpoint(self):
+        def handler(path, body):
+            self.assertEqual(path, '/api/embed')
+            return 200, {'embeddings': [vector(t) for t in body['input']]}
+
+        service = self.make_service(handler)
+        result = service.generate_embeddings_batch(['a', 'bb', 'ccc'])
+
+        # 3 texts with batch_size=2 -> 2 calls
+        self.assertEqual(len(self.ollama.requests), 2)
+        self.assertEqual(result.embeddings, [normalize_embedding(vector(t)) for t in ['a', 'bb', 'ccc']])
+        self.assertTrue(result.all_succeeded)
+        self.assertTrue(service._batch_endpoint_available)
+
+    def test_falls_back_to_concurrent_requests_in_order(self):
+        def handler(path, body):
+            if path == '/api/embed':
+                return 404, {}
+            if body['prompt'] == 'broken':
+                return 500, {}
+            return 200, {'embedding': vector(body['prompt'])}
+
+        service = self.make_service(handler)
+        result = service.generate_embeddings_batch(['a', 'broken', 'ccc', 'dddd'])
+
+        self.assertFalse(service._batch_endpoint_available)
+        self.assertEqual(result.embeddings, [normalize_embedding(vector('a')), [],
+                                             normalize_embedding(vector('ccc')), normalize_embedding(vector('dddd'))])
+        self.assertEqual(result.failed_indices, [1])
+        self.assertEqual(result.success_count, 3)
+
+    def test_single_and_batch_endpoints_agree(self):
+        def handler(path, body):
+            if path == '/api/embed':
+                return 200, {'embeddings': [normalize_embedding(vector(t)) for t in body['input']]}
+            # /api/embeddings returns the same direction, unnormalized
+            return 200, {'embedding': [10 * x for x in vector(body['prompt'])]}
+
+        service = self.make_service(handler)
+        service.cache = None
+        batch = service.generate_embeddings_batch(['chunk'])
+
+        for single, batched in zip(service.generate_embedding('chunk'), batch.embeddings[0]):
+            self.assertAlmostEqual(single, batched, places=6)
+        self.assertAlmostEqual(sum(x * x for x in batch.embeddings[0]), 1.0, places=6)
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    """Test the content-addressed embedding cache"""
+
+    def setUp(self):
+        self.cache = EmbeddingCache(max_entries=2, use_shared=False)
+        self.ollama = FakeOllama(lambda path, body: (200, {'embeddings': [vector(t) for t in body['input']]}))
+        self.service = EmbeddingService(batch_size=8, cache=self.cache, client=self.ollama.client())
+
+    def test_lru_eviction_and_counters(self):
+        self.cache.set_many('model', {'a': [1.0], 'b': [2.0]})
+        self.assertEqual(self.cache.get('model', 'a'), [1.0])  # 'a' becomes most recent
+        self.cache.set_many('model', {'c': [3.0]})  # evicts 'b'
+
+        self.assertIsNone(self.cache.get('model', 'b'))
+        self.assertEqual(self.cache.get('model', 'c'), [1.0])
+        self.assertIsNone(self.cache.get('other-model', 'c'))
+
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['local_hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['local_entries'], 2)
+
+    def test_batch_only_embeds_uncached_texts(self):
+        self.cache.set_many(self.service.model, {'cached': [0.5, 0.0]})
+
+        result = self.service.generate_embeddings_batch(['cached', 'new', 'new'])
+
+        self.assertEqual(len(self.ollama.requests), 1)
+        self.assertEqual(self.ollama.requests[0][1]['input'], ['new'])
+        self.assertEqual(result.embeddings, [[1.0, 0.0], normalize_embedding(vector('new')), normalize_embedding(vector('new'))])
+
+        self.assertEqual(self.service.generate_embedding('new'), normalize_embedding(vector('new')))
+        self.assertEqual(len(self.ollama.requests), 1)
+
+    def test_key_records_normalization(self):
+        self.assertTrue(EmbeddingCache.make_key('model', 'text').startswith('embedding_cache:l2:model:'))
+
+
+if __name__ == '__main__':
+    unittest.main()
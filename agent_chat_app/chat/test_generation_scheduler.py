@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+
+from .generation_scheduler import GenerationScheduler
+
+
+class TestGenerationScheduler(unittest.TestCase):
+    """Test per-model limits, fair queuing and cancellation"""
+
+    def test_round_robin_across_users_and_positions(self):
+        async def run():
+            scheduler = GenerationScheduler(max_in_flight=1)
+            started = []
+            positions = {}
+            release = asyncio.Event()
+
+            async def generate(name, user_id):
+                async def on_position(position):
+                    positions.setdefault(name, []).append(position)
+
+                async with scheduler.slot('model', user_id, on_position=on_position):
+                    started.append(name)
+                    await release.wait()
+                    release.clear()
+
+            tasks = [asyncio.create_task(generate('a1', 'alice'))]
+            await asyncio.sleep(0)
+            # Alice bursts three more requests before Bob sends one
+            for name, user in [('a2', 'alice'), ('a3', 'alice'), ('a4', 'alice'), ('b1', 'bob')]:
+                tasks.append(asyncio.create_task(generate(name, user)))
+                await asyncio.sleep(0)
+
+            self.assertEqual(scheduler.get_stats()['model']['queued'], 4)
+            while len(started) < 5:
+                release.set()
+                await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.gather(*tasks)
+            return started, positions, scheduler.get_stats()
+
+        started, positions, stats = asyncio.run(run())
+
+        # Bob is served right after Alice's second request, not after all of hers
+        self.assertEqual(started, ['a1', 'a2', 'b1', 'a3', 'a4'])
+        self.assertEqual(positions['b1'], [2, 1, 0])
+        self.assertNotIn('a1', positions)
+        self.assertEqual(stats['model']['in_flight'], 0)
+
+    def test_limits_are_per_model(self):
+        async def run():
+            scheduler = GenerationScheduler(max_in_flight=1, model_limits={'big': 2})
+            await scheduler.acquire('small', 'u1')
+            await scheduler.acquire('big', 'u1')
+            await scheduler.acquire('big', 'u2')
+            return scheduler.get_stats()
+
+        stats = asyncio.run(run())
+        self.assertEqual(stats['small']['in_flight'], 1)
+        self.assertEqual(stats['big']['in_flight'], 2)
+
+    def test_cancelled_waiter_leaves_queue(self):
+        async def run():
+            scheduler = GenerationScheduler(max_in_flight=1)
+            await scheduler.acquire('model', 'alice')
+
+            waiting = asyncio.create_task(scheduler.acquire('model', 'bob'))
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.get_stats()['model']['queued'], 1)
+
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            scheduler.release('model')
+            return scheduler.get_stats()
+
+        stats = asyncio.run(run())
+        self.assertEqual(stats['model'], {'in_flight': 0, 'max_in_flight': 1, 'queued': 0, 'queued_users': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 from unittest.mock import Mock, patch, MagicMock
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from .hybrid_rag_service import (
     HybridRAGService, 
@@ -9,6 +9,7 @@ from .hybrid_rag_service import (
     ResponseMetadata
 )
 from .models import Document, DocumentChunk, UserSettings
+from .rag_service import RetrievalResult, annotate_similarity
 
 User = get_user_model()
 
@@ -44,6 +45,7 @@ class TestConfidenceScore(unittest.TestCase):
         self.assertEqual(confidence.source_reliability, 1.0)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
 class TestHybridRAGService(TestCase):
     """Test HybridRAGService functionality"""
     
@@ -123,6 +125,32 @@ class TestHybridRAGService(TestCase):
         self.assertGreater(confidence.overall, 0.6)
         self.assertGreater(confidence.rag_relevance, 0.6)  # Good similarity (low distance)
     
+    def test_confidence_follows_similarity_distribution(self):
+        clear = [{'distance': 0.2}, {'distance': 0.6}, {'distance': 0.7}]
+        flat = [{'distance': 0.45}, {'distance': 0.45}, {'distance': 0.45}]
+        
+        stats = self.hybrid_rag.similarity_stats(clear)
+        clear_confidence = self.hybrid_rag.calculate_confidence_score("q", clear, has_rag_context=True)
+        flat_confidence = self.hybrid_rag.calculate_confidence_score("q", flat, has_rag_context=True)
+        
+        self.assertAlmostEqual(stats['top1'], 0.9)
+        self.assertAlmostEqual(stats['margin'], 0.2)
+        self.assertGreater(stats['spread'], 0.0)
+        # A clearly better top hit is more relevant than an evenly mediocre set
+        self.assertGreater(clear_confidence.rag_relevance, flat_confidence.rag_relevance)
+        # ...but is backed up by fewer close chunks
+        self.assertLess(clear_confidence.knowledge_coverage, 0.8)
+    
+    def test_similarity_is_cosine(self):
+        query = [1.0, 0.0]
+        # A vector stored before normalization: its squared L2 distance overstates the angle
+        chunks = [{'distance': 20.0, 'embedding': [3.0, 4.0]}, {'distance': 1.0}]
+        annotate_similarity(query, chunks)
+        
+        self.assertAlmostEqual(chunks[0]['similarity'], 0.6, places=6)
+        self.assertAlmostEqual(chunks[1]['similarity'], 0.5)
+        self.assertAlmostEqual(self.hybrid_rag.similarity_stats(chunks)['top1'], 0.6, places=6)
+    
     def test_calculate_confidence_score_without_rag(self):
         confidence = self.hybrid_rag.calculate_confidence_score(
             "simple question", [], has_rag_context=False
@@ -244,28 +272,39 @@ class TestHybridRAGService(TestCase):
         # Mock RAG service methods
         mock_should_use_rag.return_value = (True, 0.9)
         
-        with patch.object(self.hybrid_rag.rag_service, 'search_similar_chunks') as mock_search, \
-             patch.object(self.hybrid_rag.rag_service, 'generate_rag_context') as mock_context:
+        with patch.object(self.hybrid_rag.rag_service, 'retrieve') as mock_retrieve:
             
-            mock_search.return_value = [
-                {
-                    'id': 'test_chunk',
-                    'content': 'test content',
-                    'metadata': {'filename': 'test.pdf', 'chunk_index': 0},
-                    'distance': 0.2
-                }
-            ]
-            mock_context.return_value = "RAG context with test content"
+            mock_retrieve.return_value = RetrievalResult(
+                query="question about document",
+                query_embedding=[0.1, 0.2],
+                chunks=[
+                    {
+                        'id': 'test_chunk',
+                        'content': 'test content',
+                        'metadata': {'filename': 'test.pdf', 'chunk_index': 0},
+                        'distance': 0.2
+                    }
+                ],
+                context="RAG context with test content",
+                timings={'embed': 5.0, 'search': 3.0}
+            )
             mock_ollama.get_response.return_value = "AI response with RAG"
             
             response, metadata = self.hybrid_rag.get_enhanced_response(
                 "question about document", user_id=self.user.id
             )
             
+            # One retrieval per turn
+            mock_retrieve.assert_called_once()
+            # Retrieved chunks go to the prompt assembler rather than being pasted into the prompt
+            self.assertEqual(mock_ollama.get_response.call_args.kwargs['rag_chunks'], mock_retrieve.return_value.chunks)
             self.assertEqual(response, "AI response with RAG")
             self.assertEqual(metadata.knowledge_source, KnowledgeSource.HYBRID)
             self.assertEqual(len(metadata.rag_chunks_used), 1)
             self.assertFalse(metadata.fallback_used)
+            self.assertEqual(set(metadata.timings), {'embed', 'search', 'generate'})
+            self.assertIsNotNone(metadata.processing_time)
+            self.assertIn('retrieval_diagnostics', metadata.transparency_info)
     
     @patch('agent_chat_app.chat.hybrid_rag_service.OllamaService')
     def test_get_enhanced_response_uncertainty_handling(self, mock_ollama):
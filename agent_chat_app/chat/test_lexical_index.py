@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .embeddings import EmbeddingBatchResult
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from .models import Document, DocumentChunk
+from .rag_service import RAGService
+from .test_rag_service import FakeCollection
+
+
+class TestTokenize(SimpleTestCase):
+    """Test Polish-aware index terms"""
+
+    def test_inflections_and_missing_diacritics_match(self):
+        self.assertEqual(tokenize("faktura"), tokenize("faktury"))
+        self.assertEqual(tokenize("fakturą"), tokenize("fakturami"))
+        self.assertEqual(tokenize("Żubrówka"), tokenize("zubrowka"))
+
+    def test_identifiers_are_kept_whole_and_split(self):
+        terms = tokenize("Błąd ERR-1042 w module v2.3")
+
+        self.assertIn("err-1042", terms)
+        self.assertIn("1042", terms)
+        self.assertIn("v2.3", terms)
+        self.assertNotIn("w", terms)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'd']], k=1)
+
+        self.assertEqual([item_id for item_id, _ in fused], ['c', 'a', 'b', 'd'])
+
+
+class LexicalIndexTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index_path = directory.name
+        settings_override = override_settings(
+            RAG_LEXICAL_SEARCH=True,
+            LEXICAL_INDEX_PATH=self.index_path,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class TestLexicalIndex(LexicalIndexTestCase):
+    """Test the per-user FTS5 index"""
+
+    def test_search_ranks_and_isolates_users(self):
+        index = LexicalIndex()
+        index.add_chunks(1, 10, [
+            ('a', "Kod błędu ERR-1042 oznacza brak połączenia z drukarką fiskalną"),
+            ('b', "Drukarka fiskalna wymaga konfiguracji portu"),
+            ('c', "Zupełnie inny temat o fakturach"),
+        ])
+        index.add_chunks(2, 20, [('other', "ERR-1042 in another account")])
+
+        hits = index.search(1, "co znaczy err-1042?")
+
+        self.assertEqual([vector_id for vector_id, _ in hits], ['a'])
+        self.assertEqual([vector_id for vector_id, _ in index.search(1, "drukarki fiskalnej")][:2], ['b', 'a'])
+        self.assertEqual(index.search(3, "ERR-1042"), [])
+
+    def test_remove_document(self):
+        index = LexicalIndex()
+        index.add_chunks(1, 10, [('a', "faktura korygująca")])
+        index.add_chunks(1, 11, [('b', "faktura zaliczkowa")])
+
+        index.remove_document(1, 10)
+
+        self.assertEqual([vector_id for vector_id, _ in index.search(1, "faktury")], ['b'])
+
+
+class TestHybridRetrieval(LexicalIndexTestCase):
+    """Test keyword hits fused with vector hits"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username='lexical-user', password='pass')
+        self.document = Document.objects.create(
+            user=self.user, filename='manual.txt', file_path='/tmp/manual.txt', file_type='.txt', file_size=1
+        )
+        self.store = FakeCollection()
+        self.collection = Mock(wraps=self.store)
+        collection_patcher = patch('agent_chat_app.chat.rag_service.get_collection', return_value=self.collection)
+        collection_patcher.start()
+        self.addCleanup(collection_patcher.stop)
+
+        self.service = RAGService()
+        self.service.embedding_service = Mock()
+        vectors = {
+            'Printer setup guide': [1.0, 0.0],
+            'Printer paper sizes': [0.9, 0.1],
+            'Error ERR-1042 means no connection': [0.0, 1.0],
+        }
+        self.service.embedding_service.generate_embeddings_batch.side_effect = lambda texts: EmbeddingBatchResult(
+            embeddings=[vectors[text] for text in texts]
+        )
+        self.service.embedding_service.generate_embedding.return_value = [1.0, 0.0]
+        self.service.add_document_chunks(self.document.id, [
+            {'content': text, 'metadata': {'filename': 'manual.txt', 'file_type': '.txt'}} for text in vectors
+        ])
+        self.ids = {
+            text: RAGService.chunk_vector_id(self.document.id, DocumentChunk.hash_content(text)) for text in vectors
+        }
+
+    def dense_hits(self, *texts):
+        return {
+            'ids': [[self.ids[text] for text in texts]],
+            'documents': [list(texts)],
+            'metadatas': [[self.store.vectors[self.ids[text]][1] for text in texts]],
+            'distances': [[0.1 * (i + 1) for i in range(len(texts))]],
+        }
+
+    def test_keyword_only_hit_is_fused_in(self):
+        self.collection.query = Mock(return_value=self.dense_hits('Printer setup guide', 'Printer paper sizes'))
+
+        result = self.service.retrieve("printer ERR-1042", n_results=3, user_id=self.user.id)
+
+        by_content = {chunk['content']: chunk for chunk in result.chunks}
+        error_chunk = by_content['Error ERR-1042 means no connection']
+        self.assertEqual(error_chunk['retrieval'], 'lexical')
+        self.assertAlmostEqual(error_chunk['distance'], 2.0)
+        self.assertEqual(by_content['Printer setup guide']['retrieval'], 'hybrid')
+        self.assertIn('ERR-1042', result.context)
+        self.assertEqual(self.collection.query.call_args.kwargs['n_results'], 20)
+
+    def test_deleting_document_drops_keyword_entries(self):
+        self.service.delete_document(self.document.id)
+
+        self.assertEqual(self.service.lexical_index.search(self.user.id, "ERR-1042"), [])
+
+    def test_benchmark_reports_every_mode(self):
+        self.collection.query = Mock(return_value=self.dense_hits('Printer setup guide', 'Printer paper sizes'))
+        queries = os.path.join(self.index_path, 'queries.json')
+        with open(queries, 'w', encoding='utf-8') as file:
+            json.dump([{
+                'query': "ERR-1042",
+                'user_id': self.user.id,
+                'relevant': [self.ids['Error ERR-1042 means no connection']]
+            }], file)
+        out = StringIO()
+
+        with patch('agent_chat_app.chat.management.commands.benchmark_retrieval.get_rag_service', return_value=self.service):
+            call_command('benchmark_retrieval', queries, '-k', '2', '--repeat', '1', stdout=out)
+
+        lines = {line.split()[0]: line.split() for line in out.getvalue().splitlines()[2:]}
+        self.assertEqual(lines['vector'][1], '0.00')
+        self.assertEqual(lines['keyword'][1], '1.00')
+        self.assertEqual(lines['hybrid'][1], '1.00')
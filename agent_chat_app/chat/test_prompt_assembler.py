@@ -0,0 +1,153 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, SimpleTestCase, override_settings
+from tokenizers import Tokenizer, models, pre_tokenizers
+
+from .models import Conversation, Message
+from .prompt_assembler import (
+    HeuristicTokenCounter, PromptAssembler, TokenizerTokenCounter, get_token_counter
+)
+from .services import OllamaService
+
+
+class WordCounter:
+    """One token per whitespace-separated word"""
+
+    name = 'words'
+
+    def count(self, text):
+        return len(text.split())
+
+    def count_batch(self, texts):
+        return [self.count(text) for text in texts]
+
+
+def make_chunk(content, filename='doc.txt'):
+    return {'content': content, 'metadata': {'filename': filename}, 'distance': 0.1}
+
+
+class TestTokenCounters(SimpleTestCase):
+    """Test tokenizer loading and caching"""
+
+    def test_loads_and_caches_tokenizer_per_model(self):
+        tokenizer = Tokenizer(models.WordLevel({'[UNK]': 0, 'hello': 1}, unk_token='[UNK]'))
+        tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'tokenizer.json')
+            tokenizer.save(path)
+
+            with override_settings(LLM_TOKENIZER_FILES={'gemma3': path}):
+                counter = get_token_counter('gemma3:4b')
+                self.assertIsInstance(counter, TokenizerTokenCounter)
+                self.assertEqual(counter.count('hello big world'), 3)
+                self.assertEqual(counter.count_batch(['hello', 'a b']), [1, 2])
+                self.assertIs(get_token_counter('gemma3:12b'), counter)
+
+    def test_falls_back_to_heuristic(self):
+        with override_settings(LLM_TOKENIZER_FILES={'broken': '/nonexistent/tokenizer.json'}):
+            self.assertIsInstance(get_token_counter('broken'), HeuristicTokenCounter)
+            self.assertIsInstance(get_token_counter('unknown-model'), HeuristicTokenCounter)
+        self.assertEqual(HeuristicTokenCounter().count('abcdefg'), 3)
+
+
+@override_settings(LLM_CONTEXT_WINDOWS={'tiny': 60, 'small': 100}, LLM_RAG_BUDGET_SHARE=0.5)
+class TestPromptAssembler(TestCase):
+    """Test packing chunks and history into the token budget"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='prompt-user', password='pass')
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def add_message(self, text, is_from_user=True):
+        return Message.objects.create(conversation=self.conversation, text=text, is_from_user=is_from_user)
+
+    def test_reserves_response_tokens(self):
+        assembler = PromptAssembler('tiny', response_tokens=1000, counter=WordCounter())
+        self.assertEqual(assembler.response_tokens, 30)
+        self.assertEqual(assembler.budget, 30)
+
+    def test_keeps_newest_history_that_fits(self):
+        for i in range(6):
+            self.add_message(f"message {i} " + "word " * 5, is_from_user=i % 2 == 0)
+        self.add_message("current question")
+        history = OllamaService.get_conversation_history(self.conversation.id)
+
+        assembler = PromptAssembler('tiny', response_tokens=10, counter=WordCounter())
+        assembled = assembler.assemble("Be brief.", "current question", history=history)
+
+        # The stored copy of the current question is not repeated as history
+        self.assertEqual(assembled.prompt.count("current question"), 1)
+        self.assertIn("message 5", assembled.prompt)
+        self.assertNotIn("message 0", assembled.prompt)
+        self.assertEqual(assembled.history_used + assembled.history_dropped, 6)
+        self.assertLessEqual(assembled.prompt_tokens, assembled.budget)
+        self.assertLessEqual(WordCounter().count(assembled.prompt), assembled.budget)
+        self.assertTrue(assembled.prompt.endswith("User: current question\nAssistant:"))
+
+        # Token counts are memoized on the messages
+        self.assertFalse(Message.objects.filter(token_count__isnull=True).exclude(text="current question").exists())
+
+    def test_uses_stored_token_counts(self):
+        message = self.add_message("short")
+        Message.objects.filter(pk=message.pk).update(token_count=500, token_counter='words')
+        history = OllamaService.get_conversation_history(self.conversation.id)
+
+        assembled = PromptAssembler('tiny', counter=WordCounter()).assemble("Be brief.", "next", history=history)
+
+        self.assertEqual(assembled.history_used, 0)
+        self.assertEqual(assembled.history_dropped, 1)
+
+    def test_recounts_tokens_from_another_tokenizer(self):
+        message = self.add_message("short")
+        Message.objects.filter(pk=message.pk).update(token_count=500, token_counter='other-model-tokenizer')
+        history = OllamaService.get_conversation_history(self.conversation.id)
+
+        assembled = PromptAssembler('tiny', counter=WordCounter()).assemble("Be brief.", "next", history=history)
+
+        self.assertEqual(assembled.history_used, 1)
+        self.assertEqual(assembled.messages_counted, 1)
+        message.refresh_from_db()
+        self.assertEqual((message.token_count, message.token_counter), (1, 'words'))
+
+    def test_packs_chunks_in_rank_order_within_share(self):
+        chunks = [
+            make_chunk("first " * 4, 'a.txt'),
+            make_chunk("huge " * 50, 'b.txt'),
+            make_chunk("third " * 2, 'c.txt'),
+        ]
+        assembler = PromptAssembler('small', response_tokens=10, counter=WordCounter())
+        assembled = assembler.assemble("Be brief.", "question", rag_chunks=chunks)
+
+        self.assertEqual([chunk['metadata']['filename'] for chunk in assembled.chunks_used], ['a.txt', 'c.txt'])
+        self.assertEqual(assembled.chunks_dropped, 1)
+        self.assertIn("[Document 2: c.txt]", assembled.prompt)
+        self.assertIn("User question: question", assembled.prompt)
+        self.assertLessEqual(WordCounter().count(assembled.prompt), assembled.budget)
+
+
+class TestBuildGeneratePayload(TestCase):
+    """Test the payload uses the assembled prompt"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='payload-user', password='pass')
+        self.conversation = Conversation.objects.create(user=self.user)
+        Message.objects.create(conversation=self.conversation, text="earlier question", is_from_user=True)
+        Message.objects.create(conversation=self.conversation, text="earlier answer", is_from_user=False)
+
+    def test_includes_history_and_given_chunks(self):
+        with patch('agent_chat_app.chat.services.get_rag_service') as mock_rag:
+            payload = OllamaService.build_generate_payload(
+                "new question",
+                user_id=self.user.id,
+                use_rag=False,
+                conversation_id=self.conversation.id,
+                rag_chunks=[make_chunk("chunk text", 'notes.txt')]
+            )
+
+        mock_rag.assert_not_called()
+        self.assertIn("User: earlier question\nAssistant: earlier answer", payload['prompt'])
+        self.assertIn("[Document 1: notes.txt]\nchunk text", payload['prompt'])
+        self.assertEqual(payload['options']['num_predict'], 2048)
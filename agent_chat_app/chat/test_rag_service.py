@@ -0,0 +1,321 @@
+import os
+from io import StringIO
+import tempfile
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from .embeddings import EmbeddingBatchResult
+from .models import Document, DocumentChunk
+from .rag_service import ChunkIngestError, RAGService, RetrievalResult, get_rag_service
+from . import vector_store
+
+
+class FakeCollection:
+    """In-memory stand-in for the parts of a ChromaDB collection used at ingest"""
+
+    def __init__(self):
+        self.vectors = {}
+        self.documents = {}
+
+    def get(self, ids=None, where=None, include=None):
+        if ids is None:
+            ids = [
+                vector_id for vector_id, (_, metadata) in self.vectors.items()
+                if all(metadata.get(key) == value for key, value in (where or {}).items())
+            ]
+        ids = [vector_id for vector_id in ids if vector_id in self.vectors]
+        return {
+            'ids': ids,
+            'embeddings': [self.vectors[vector_id][0] for vector_id in ids],
+            'metadatas': [self.vectors[vector_id][1] for vector_id in ids],
+            'documents': [self.documents[vector_id] for vector_id in ids],
+        }
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        for vector_id, embedding, metadata, document in zip(ids, embeddings, metadatas, documents):
+            self.vectors[vector_id] = (embedding, metadata)
+            self.documents[vector_id] = document
+
+    def update(self, ids, metadatas):
+        for vector_id, metadata in zip(ids, metadatas):
+            self.vectors[vector_id] = (self.vectors[vector_id][0], metadata)
+
+    def delete(self, ids=None, where=None):
+        for vector_id in ids if ids is not None else self.get(where=where)['ids']:
+            del self.vectors[vector_id]
+            del self.documents[vector_id]
+
+
+class TestAddDocumentChunks(TestCase):
+    """Test bulk chunk persistence"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='rag-user', password='pass')
+        self.document = Document.objects.create(
+            user=self.user,
+            filename='notes.txt',
+            file_path='/tmp/notes.txt',
+            file_type='txt',
+            file_size=5,
+        )
+
+        self.store = FakeCollection()
+        self.collection = Mock(wraps=self.store)
+        collection_patcher = patch('agent_chat_app.chat.rag_service.get_collection', return_value=self.collection)
+        collection_patcher.start()
+        self.addCleanup(collection_patcher.stop)
+
+        self.service = RAGService()
+        self.service.embedding_service = Mock()
+        self.service.embedding_service.generate_embeddings_batch.side_effect = lambda texts: EmbeddingBatchResult(
+            embeddings=[[] if text == 'broken' else [float(len(text)), 0.5] for text in texts],
+            failed_indices=[i for i, text in enumerate(texts) if text == 'broken'],
+        )
+
+    def make_chunks(self, contents):
+        return [{'content': content, 'metadata': {'filename': 'notes.txt', 'file_type': 'txt'}} for content in contents]
+
+    def test_batches_and_skips_failed_embeddings(self):
+        stored = self.service.add_document_chunks(
+            self.document.id, self.make_chunks(['one', 'broken', 'three', 'four', 'five']), batch_size=2
+        )
+
+        self.assertEqual(stored, 4)
+        self.assertEqual(self.service.embedding_service.generate_embeddings_batch.call_count, 3)
+        self.assertEqual(self.collection.upsert.call_count, 3)
+
+        chunks = list(DocumentChunk.objects.filter(document=self.document).order_by('chunk_index'))
+        self.assertEqual([chunk.chunk_index for chunk in chunks], [0, 2, 3, 4])
+        self.assertEqual(chunks[1].character_count, 5)
+        self.assertEqual(chunks[1].get_embedding(), [5.0, 0.5])
+
+        upserted_ids = [
+            chunk_id
+            for call in self.collection.upsert.call_args_list
+            for chunk_id in call.kwargs['ids']
+        ]
+        self.assertEqual(upserted_ids, [
+            RAGService.chunk_vector_id(self.document.id, DocumentChunk.hash_content(content))
+            for content in ('one', 'three', 'four', 'five')
+        ])
+        self.assertEqual(chunks[1].content_hash, DocumentChunk.hash_content('three'))
+        metadata = self.collection.upsert.call_args.kwargs['metadatas'][0]
+        self.assertEqual(metadata['user_id'], self.user.id)
+
+        # Status transition is left to the caller
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.processing_status, 'pending')
+
+    def test_retry_replaces_previous_chunks(self):
+        chunks = self.make_chunks(['alpha', 'beta'])
+        self.service.add_document_chunks(self.document.id, chunks)
+        stored = self.service.add_document_chunks(self.document.id, chunks)
+
+        self.assertEqual(stored, 2)
+        self.assertEqual(DocumentChunk.objects.filter(document=self.document).count(), 2)
+        self.assertEqual(len(self.store.vectors), 2)
+        # Nothing changed, so nothing was embedded again
+        self.assertEqual(self.service.embedding_service.generate_embeddings_batch.call_count, 1)
+
+    def test_reindex_embeds_only_changed_chunks(self):
+        self.service.add_document_chunks(self.document.id, self.make_chunks(['alpha', 'beta', 'gamma', 'alpha']))
+        embed = self.service.embedding_service.generate_embeddings_batch
+        embed.reset_mock()
+
+        stored = self.service.add_document_chunks(self.document.id, self.make_chunks(['new', 'alpha', 'gamma', 'alpha']))
+
+        self.assertEqual(stored, 4)
+        embed.assert_called_once_with(['new'])
+        beta_id = RAGService.chunk_vector_id(self.document.id, DocumentChunk.hash_content('beta'))
+        self.assertNotIn(beta_id, self.store.vectors)
+        self.assertEqual(len(self.store.vectors), 4)
+
+        # Moved chunks point at their new rows and positions
+        gamma_id = RAGService.chunk_vector_id(self.document.id, DocumentChunk.hash_content('gamma'))
+        gamma = DocumentChunk.objects.get(document=self.document, content='gamma')
+        _, metadata = self.store.vectors[gamma_id]
+        self.assertEqual((metadata['chunk_index'], metadata['django_chunk_id']), (2, gamma.id))
+        self.assertEqual(gamma.get_embedding(), [5.0, 0.5])
+
+    def test_consumes_generator_batch_by_batch(self):
+        consumed = []
+
+        def chunks():
+            for i, content in enumerate(['one', 'two', 'three']):
+                consumed.append(i)
+                yield {**self.make_chunks([content])[0], 'progress': (i + 1) / 3}
+
+        reports = []
+
+        def report(stored, progress):
+            reports.append((stored, progress, len(consumed)))
+
+        stored = self.service.add_document_chunks(self.document.id, chunks(), batch_size=2, progress_callback=report)
+
+        self.assertEqual(stored, 3)
+        # The first batch was stored before the generator produced the third chunk
+        self.assertEqual(reports, [(2, 2 / 3, 2), (3, 1.0, 3)])
+        self.assertEqual(
+            set(DocumentChunk.objects.filter(document=self.document).values_list('total_chunks', flat=True)), {3}
+        )
+
+    def test_missing_document_returns_zero(self):
+        self.assertEqual(self.service.add_document_chunks(999999, self.make_chunks(['alpha'])), 0)
+
+    def test_failure_mid_stream_reports_stored_chunks(self):
+        def chunks():
+            yield from self.make_chunks(['one', 'two'])
+            raise OSError("extraction failed")
+
+        with self.assertRaises(ChunkIngestError) as raised:
+            self.service.add_document_chunks(self.document.id, chunks(), batch_size=1)
+
+        self.assertEqual(raised.exception.stored_count, 2)
+        self.assertEqual(DocumentChunk.objects.filter(document=self.document).count(), 2)
+        self.assertEqual(len(self.store.vectors), 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestRetrieval(TestCase):
+    """Test single-pass retrieval and the cached document flag"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='retrieval-user', password='pass')
+        collection_patcher = patch('agent_chat_app.chat.rag_service.get_collection', return_value=Mock())
+        self.collection = collection_patcher.start()()
+        self.addCleanup(collection_patcher.stop)
+
+        self.service = RAGService()
+        self.service.embedding_service = Mock()
+        self.service.embedding_service.generate_embedding.return_value = [0.1, 0.2]
+
+    def create_document(self, status='completed'):
+        return Document.objects.create(
+            user=self.user,
+            filename='guide.pdf',
+            file_path='/tmp/guide.pdf',
+            file_type='pdf',
+            file_size=10,
+            processing_status=status,
+        )
+
+    def test_retrieve_embeds_and_queries_once(self):
+        self.create_document()
+        self.collection.query.return_value = {
+            'ids': [['doc_1_chunk_0']],
+            'documents': [['install with pip']],
+            'metadatas': [[{'filename': 'guide.pdf', 'chunk_index': 0}]],
+            'distances': [[0.25]],
+        }
+
+        result = self.service.retrieve('how to install', n_results=3, user_id=self.user.id)
+
+        self.assertIsInstance(result, RetrievalResult)
+        self.assertEqual(result.query_embedding, [0.1, 0.2])
+        self.assertEqual(len(result.chunks), 1)
+        self.assertIn('[Document 1: guide.pdf]', result.context)
+        self.assertTrue(result.has_context)
+        self.service.embedding_service.generate_embedding.assert_called_once()
+        self.collection.query.assert_called_once()
+        self.assertEqual(self.collection.query.call_args.kwargs['where'], {'user_id': self.user.id})
+
+    def test_user_has_documents_is_cached_and_invalidated(self):
+        self.assertFalse(self.service.user_has_documents(self.user.id))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.service.user_has_documents(self.user.id))
+
+        document = self.create_document(status='processing')
+        self.assertFalse(self.service.user_has_documents(self.user.id))
+
+        document.mark_as_completed(chunk_count=1)
+        self.assertTrue(self.service.user_has_documents(self.user.id))
+
+        document.delete()
+        self.assertFalse(self.service.user_has_documents(self.user.id))
+
+
+class TestVectorStoreRegistry(SimpleTestCase):
+    """Test the process-wide ChromaDB registry"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        settings_override = override_settings(CHROMADB_PATH=os.path.join(self.tmpdir.name, 'chromadb'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        vector_store.reset_vector_store()
+        self.addCleanup(vector_store.reset_vector_store)
+
+    def test_client_and_collections_are_reused(self):
+        with patch('agent_chat_app.chat.vector_store.chromadb.PersistentClient',
+                   wraps=vector_store.chromadb.PersistentClient) as mock_client:
+            collection = vector_store.get_collection('registry_test')
+            self.assertIs(vector_store.get_collection('registry_test'), collection)
+            self.assertIs(RAGService('registry_test').collection, collection)
+            self.assertEqual(mock_client.call_count, 1)
+
+            vector_store.reset_vector_store()
+            self.assertIsNot(vector_store.get_collection('registry_test'), collection)
+            self.assertEqual(mock_client.call_count, 2)
+
+    def test_construction_does_not_open_client(self):
+        with patch('agent_chat_app.chat.vector_store.chromadb.PersistentClient') as mock_client:
+            RAGService()
+        mock_client.assert_not_called()
+
+    def test_rag_service_singleton_and_health(self):
+        self.assertIs(get_rag_service(), get_rag_service())
+
+        vector_store.get_collection('registry_test')
+        health = vector_store.get_vector_store_health()
+        self.assertEqual(health['status'], 'ok')
+        self.assertEqual(health['collections'], {'registry_test': 0})
+
+
+class TestBackfillChunkUserIds(TestCase):
+    """Test tagging and sharding of chunks indexed without user_id"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        settings_override = override_settings(CHROMADB_PATH=os.path.join(self.tmpdir.name, 'chromadb'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        vector_store.reset_vector_store()
+        self.addCleanup(vector_store.reset_vector_store)
+
+        self.user = get_user_model().objects.create_user(username='backfill-user', password='pass')
+        self.document = Document.objects.create(
+            user=self.user,
+            filename='legacy.txt',
+            file_path='/tmp/legacy.txt',
+            file_type='txt',
+            file_size=10,
+            processing_status='completed',
+        )
+        self.service = get_rag_service()
+        self.service.collection.add(
+            ids=[f"doc_{self.document.id}_chunk_0", f"doc_{self.document.id}_chunk_1"],
+            embeddings=[[1.0, 0.0], [0.0, 1.0]],
+            metadatas=[{'document_id': self.document.id, 'chunk_index': i} for i in range(2)],
+            documents=['first', 'second'],
+        )
+
+    def test_tags_chunks_with_user_id(self):
+        call_command('backfill_chunk_user_ids', stdout=StringIO())
+
+        stored = self.service.collection.get(where={'user_id': self.user.id})
+        self.assertEqual(len(stored['ids']), 2)
+
+    def test_shard_moves_chunks_to_user_collection(self):
+        call_command('backfill_chunk_user_ids', '--shard', stdout=StringIO())
+
+        self.assertEqual(self.service.collection.count(), 0)
+        with override_settings(RAG_PER_USER_COLLECTIONS=True):
+            self.assertEqual(self.service.collection_for_user(self.user.id).count(), 2)
+            chunks = self.service._query_collection([1.0, 0.0], n_results=1, user_id=self.user.id)
+        self.assertEqual(chunks[0]['content'], 'first')
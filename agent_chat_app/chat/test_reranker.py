@@ -0,0 +1,108 @@
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from .rag_service import RAGService
+from .reranker import ChunkReranker
+
+
+def chunk(content, document_id=1, chunk_index=0, embedding=None):
+    return {
+        'id': f'doc_{document_id}_{chunk_index}',
+        'content': content,
+        'metadata': {'document_id': document_id, 'chunk_index': chunk_index, 'filename': 'guide.txt'},
+        'distance': 0.5,
+        'embedding': embedding,
+    }
+
+
+class TestChunkReranker(SimpleTestCase):
+    """Test dedupe, MMR and the optional cross-encoder"""
+
+    def test_dedupe_merges_overlapping_neighbours(self):
+        shared = "the printer must be connected before the fiscal day is opened. "
+        first = "Step one: plug in the cable. " + shared
+        second = shared + "Step two: open the fiscal day."
+        reranker = ChunkReranker(model_name='')
+
+        chunks = reranker.dedupe([
+            chunk(second, chunk_index=4),
+            chunk("Unrelated section", chunk_index=9),
+            chunk(first, chunk_index=3),
+            chunk("Unrelated section", document_id=2),
+        ])
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0]['content'], first + "Step two: open the fiscal day.")
+        self.assertEqual(chunks[0]['metadata']['merged_chunk_indexes'], [3, 4])
+        self.assertEqual(chunks[1]['content'], "Unrelated section")
+
+    def test_mmr_prefers_diverse_chunks(self):
+        reranker = ChunkReranker(mmr_lambda=0.3, model_name='')
+        chunks = [
+            chunk("a", chunk_index=0, embedding=[1.0, 0.0]),
+            chunk("a'", chunk_index=5, embedding=[0.99, 0.01]),
+            chunk("b", chunk_index=10, embedding=[0.6, 0.8]),
+        ]
+
+        selected = reranker.mmr([1.0, 0.0], chunks, n_results=2)
+
+        self.assertEqual([c['content'] for c in selected], ["a", "b"])
+
+    def test_mmr_keeps_order_without_vectors(self):
+        chunks = [chunk("a", chunk_index=0), chunk("b", chunk_index=10)]
+
+        self.assertEqual(ChunkReranker(model_name='').mmr([1.0], chunks, n_results=1), chunks[:1])
+
+    def test_cross_encoder_scores_drive_relevance(self):
+        model = Mock()
+        model.predict.return_value = [0.1, 2.5]
+        chunks = [
+            chunk("close vector", chunk_index=0, embedding=[1.0, 0.0]),
+            chunk("answers the question", chunk_index=10, embedding=[0.0, 1.0]),
+        ]
+        timings = {}
+
+        with patch('agent_chat_app.chat.reranker.get_cross_encoder', return_value=model):
+            selected = ChunkReranker(model_name='local-model').rerank("q", [1.0, 0.0], chunks, 1, timings)
+
+        self.assertEqual(selected[0]['content'], "answers the question")
+        self.assertEqual(selected[0]['rerank_score'], 2.5)
+        self.assertEqual(set(timings), {'dedupe', 'cross_encoder', 'mmr'})
+
+    def test_missing_cross_encoder_is_skipped(self):
+        chunks = [chunk("a", chunk_index=0, embedding=[1.0, 0.0]), chunk("b", chunk_index=10, embedding=[0.0, 1.0])]
+
+        with patch('agent_chat_app.chat.reranker.get_cross_encoder', return_value=None):
+            selected = ChunkReranker(model_name='missing').rerank("q", [1.0, 0.0], chunks, 1, {})
+
+        self.assertEqual(selected[0]['content'], "a")
+
+
+class TestRerankedRetrieval(TestCase):
+    """Test that retrieval over-fetches, reranks and times every stage"""
+
+    def test_retrieve_overfetches_and_strips_vectors(self):
+        user = get_user_model().objects.create_user(username='rerank-user', password='pass')
+        collection = Mock()
+        collection.query.return_value = {
+            'ids': [['x', 'y', 'z']],
+            'documents': [['alpha', 'alpha copy', 'beta']],
+            'metadatas': [[{'document_id': 1, 'chunk_index': i, 'filename': 'a.txt'} for i in (0, 5, 10)]],
+            'distances': [[0.1, 0.11, 0.5]],
+            'embeddings': [[[1.0, 0.0], [0.99, 0.01], [0.6, 0.8]]],
+        }
+        with patch('agent_chat_app.chat.rag_service.get_collection', return_value=collection):
+            service = RAGService()
+            service.reranker = ChunkReranker(mmr_lambda=0.3, model_name='')
+            service.embedding_service = Mock()
+            service.embedding_service.generate_embedding.return_value = [1.0, 0.0]
+
+            result = service.retrieve("alpha", n_results=2, user_id=user.id)
+
+        self.assertEqual(collection.query.call_args.kwargs['n_results'], 8)
+        self.assertIn('embeddings', collection.query.call_args.kwargs['include'])
+        self.assertEqual([c['content'] for c in result.chunks], ['alpha', 'beta'])
+        self.assertTrue(all('embedding' not in c for c in result.chunks))
+        self.assertTrue({'embed', 'search', 'rerank', 'dedupe', 'mmr'} <= set(result.timings))
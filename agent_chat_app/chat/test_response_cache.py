@@ -0,0 +1,113 @@
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .hybrid_rag_service import HybridRAGService
+from .models import Document
+from .response_cache import SemanticResponseCache
+from .services import CONNECTION_ERROR_MESSAGE
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TestSemanticResponseCache(TestCase):
+    """Test similarity lookups, eviction and invalidation"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='cache-user', password='pass')
+        self.cache = SemanticResponseCache(threshold=0.9, max_entries=2, ttl=60)
+
+    def store(self, query, embedding, response, **kwargs):
+        self.cache.store(self.user.id, kwargs.get('model', 'm'), kwargs.get('instruction', 'sys'),
+                         query, embedding, response, {'knowledge_source': 'built_in'})
+
+    def lookup(self, embedding, **kwargs):
+        return self.cache.lookup(self.user.id, kwargs.get('model', 'm'), kwargs.get('instruction', 'sys'),
+                                 'query', embedding)
+
+    def test_hit_on_similar_question_only(self):
+        self.store('what is the refund policy', [1.0, 0.0, 0.0], 'answer')
+
+        hit = self.lookup([0.98, 0.05, 0.0])
+        self.assertEqual(hit.response, 'answer')
+        self.assertGreater(hit.similarity, 0.9)
+        self.assertIsNone(self.lookup([0.0, 1.0, 0.0]))
+
+    def test_bucket_includes_model_and_instruction(self):
+        self.store('q', [1.0, 0.0], 'answer')
+
+        self.assertIsNone(self.lookup([1.0, 0.0], model='other'))
+        self.assertIsNone(self.lookup([1.0, 0.0], instruction='be terse'))
+
+    def test_evicts_least_recently_used(self):
+        self.store('a', [1.0, 0.0, 0.0], 'A')
+        self.store('b', [0.0, 1.0, 0.0], 'B')
+        self.lookup([1.0, 0.0, 0.0])  # 'a' becomes most recent
+        self.store('c', [0.0, 0.0, 1.0], 'C')
+
+        self.assertEqual(self.lookup([1.0, 0.0, 0.0]).response, 'A')
+        self.assertIsNone(self.lookup([0.0, 1.0, 0.0]))
+        self.assertEqual(self.lookup([0.0, 0.0, 1.0]).response, 'C')
+
+    def test_entries_expire(self):
+        self.store('a', [1.0, 0.0], 'A')
+        with patch('agent_chat_app.chat.response_cache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(self.lookup([1.0, 0.0]))
+
+    def test_document_changes_invalidate(self):
+        self.store('a', [1.0, 0.0], 'A')
+        Document.objects.create(
+            user=self.user, filename='new.txt', file_path='/tmp/new.txt', file_type='txt', file_size=1
+        )
+
+        self.assertIsNone(self.lookup([1.0, 0.0]))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TestHybridResponseCache(TestCase):
+    """Test the cache in front of get_enhanced_response"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='hybrid-cache-user', password='pass')
+        self.hybrid_rag = HybridRAGService()
+        embedding_patcher = patch.object(
+            self.hybrid_rag.rag_service.embedding_service, 'generate_embedding', return_value=[0.3, 0.4, 0.5]
+        )
+        embedding_patcher.start()
+        self.addCleanup(embedding_patcher.stop)
+
+    @patch('agent_chat_app.chat.hybrid_rag_service.OllamaService.get_response')
+    @patch.object(HybridRAGService, 'should_use_rag', return_value=(False, 0.8))
+    def test_repeated_question_skips_llm(self, mock_should_use_rag, mock_get_response):
+        mock_get_response.return_value = "Generated answer"
+        question = "how do I reset my password"
+
+        first, first_metadata = self.hybrid_rag.get_enhanced_response(question, user_id=self.user.id)
+        second, second_metadata = self.hybrid_rag.get_enhanced_response(question + "?", user_id=self.user.id)
+
+        self.assertEqual(first, "Generated answer")
+        self.assertEqual(second, "Generated answer")
+        mock_get_response.assert_called_once()
+        self.assertNotIn('cache', first_metadata.transparency_info)
+        # The miss's lookup is part of the first turn
+        self.assertIn('cache_lookup', first_metadata.timings)
+        self.assertTrue(second_metadata.transparency_info['cache']['hit'])
+        self.assertEqual(second_metadata.knowledge_source, first_metadata.knowledge_source)
+        self.assertIn("pamięci podręcznej", self.hybrid_rag.format_response_with_transparency(second, second_metadata))
+
+    @patch('agent_chat_app.chat.hybrid_rag_service.OllamaService.get_response')
+    @patch.object(HybridRAGService, 'should_use_rag', return_value=(False, 0.8))
+    def test_error_responses_are_not_cached(self, mock_should_use_rag, mock_get_response):
+        mock_get_response.return_value = CONNECTION_ERROR_MESSAGE
+        question = "how do I reset my password"
+
+        self.hybrid_rag.get_enhanced_response(question, user_id=self.user.id)
+        self.hybrid_rag.get_enhanced_response(question, user_id=self.user.id)
+
+        self.assertEqual(mock_get_response.call_count, 2)
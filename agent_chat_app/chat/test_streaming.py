@@ -0,0 +1,132 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+
+import httpx
+from django.test import override_settings
+
+from agent_chat_app.core.ollama_client import OllamaClient
+from .consumers import ChatConsumer
+from .hybrid_rag_service import HybridRAGService, PreparedResponse
+from .services import OllamaService, OllamaStreamError
+
+
+def ndjson(*chunks):
+    return '\n'.join(json.dumps(chunk) for chunk in chunks) + '\n'
+
+
+def mock_async_client(handler):
+    client = OllamaClient(base_url='http://ollama.test', max_retries=0, transport=httpx.MockTransport(handler))
+    return patch('agent_chat_app.chat.services.get_ollama_client', return_value=client)
+
+
+async def collect(async_iterator):
+    return [item async for item in async_iterator]
+
+
+class TestOllamaStreamResponse(unittest.TestCase):
+    """Test parsing of Ollama's NDJSON stream"""
+
+    def test_yields_fragments_until_done(self):
+        def handler(request):
+            self.assertTrue(json.loads(request.content)['stream'])
+            return httpx.Response(200, text=ndjson(
+                {'response': 'Hel', 'done': False},
+                {'response': 'lo', 'done': False},
+                {'response': '', 'done': True},
+                {'response': 'ignored', 'done': False},
+            ))
+
+        with mock_async_client(handler):
+            fragments = asyncio.run(collect(OllamaService.stream_response({'model': 'm', 'prompt': 'p'})))
+
+        self.assertEqual(fragments, ['Hel', 'lo'])
+
+    def test_error_line_raises(self):
+        def handler(request):
+            return httpx.Response(200, text=ndjson({'error': 'model not found'}))
+
+        with mock_async_client(handler):
+            with self.assertRaises(OllamaStreamError):
+                asyncio.run(collect(OllamaService.stream_response({'model': 'm', 'prompt': 'p'})))
+
+
+class TestChatConsumerStreaming(unittest.TestCase):
+    """Test token forwarding from the chat consumer"""
+
+    def setUp(self):
+        self.consumer = ChatConsumer()
+        self.consumer.room_group_name = 'chat_1'
+        self.consumer.scope = {'user': Mock(id=1)}
+        self.consumer.channel_layer = AsyncMock()
+
+    def test_stream_tokens_forwards_and_returns_full_text(self):
+        async def fake_stream(payload):
+            for fragment in ['Dzień', ' ', 'dobry']:
+                yield fragment
+
+        parts = []
+        with patch.object(OllamaService, 'stream_response', side_effect=fake_stream), \
+             override_settings(CHAT_STREAM_FLUSH_INTERVAL=10):
+            text = asyncio.run(self.consumer.stream_tokens({}, 'abc', parts))
+
+        self.assertEqual(text, 'Dzień dobry')
+        self.assertEqual(parts, ['Dzień', ' ', 'dobry'])
+
+        events = [call.args[1] for call in self.consumer.channel_layer.group_send.call_args_list]
+        self.assertEqual(events[0], {'type': 'typing_indicator', 'is_typing': False})
+        tokens = [event for event in events if event['type'] == 'chat_token']
+        # First fragment goes out immediately, the rest are coalesced
+        self.assertEqual([event['token'] for event in tokens], ['Dzień', ' dobry'])
+        self.assertTrue(all(event['stream_id'] == 'abc' for event in tokens))
+
+    def test_cancelled_generation_saves_partial_response_once(self):
+        async def stalled_stream(payload):
+            yield 'Partial'
+            await asyncio.Event().wait()
+
+        prepared = PreparedResponse(prompt='q', metadata=HybridRAGService.fallback_metadata('test'))
+        self.consumer.conversation_id = 1
+        self.consumer.save_message = AsyncMock()
+
+        async def run():
+            task = asyncio.create_task(self.consumer.generate_ai_response('q'))
+            while not self.consumer.channel_layer.group_send.await_count:
+                await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with patch.object(ChatConsumer, 'prepare_generation', return_value=(prepared, {'model': 'm'})), \
+             patch.object(OllamaService, 'stream_response', side_effect=stalled_stream):
+            asyncio.run(run())
+
+        self.consumer.save_message.assert_awaited_once_with(conversation_id=1, text='Partial', is_from_user=False)
+
+    def test_finished_response_is_saved_with_stage_timings(self):
+        async def fake_stream(payload):
+            yield 'Gotowe'
+
+        metadata = HybridRAGService.fallback_metadata('test')
+        metadata.timings = {'embed': 12.0, 'search': 8.0}
+        prepared = PreparedResponse(prompt='q', metadata=metadata)
+        self.consumer.conversation_id = 1
+        self.consumer.save_message = AsyncMock(return_value=Mock(id=7, created_at=Mock(isoformat=lambda: 'now')))
+        self.consumer.schedule_summary = AsyncMock()
+        self.consumer.hybrid_rag_service = Mock()
+        self.consumer.hybrid_rag_service.format_response_with_transparency.side_effect = lambda text, _: text
+
+        with patch.object(ChatConsumer, 'prepare_generation', return_value=(prepared, {'model': 'm'})), \
+             patch.object(OllamaService, 'stream_response', side_effect=fake_stream):
+            asyncio.run(self.consumer.generate_ai_response('q'))
+
+        saved = self.consumer.save_message.call_args.kwargs
+        self.assertEqual(saved['text'], 'Gotowe')
+        self.assertEqual(saved['model_used'], 'm')
+        self.assertTrue({'embed', 'search', 'queue', 'generate'} <= set(saved['stage_timings']))
+        self.assertGreaterEqual(saved['processing_time'], 0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
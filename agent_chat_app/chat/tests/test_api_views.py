@@ -271,6 +271,21 @@ class TestDocumentAPI:
         assert response.data['id'] == document.id
         assert response.data['filename'] == document.filename
         assert 'chunks' in response.data
+        assert 'embedding' not in response.data['chunks'][0]
+
+    def test_retrieve_document_with_embeddings(self, authenticated_client):
+        """Test that chunk embeddings are only returned when requested"""
+        user = authenticated_client.user
+        document = ProcessedDocumentFactory(user=user, chunks=1)
+        chunk = document.chunks.get()
+        chunk.set_embedding([0.5, 0.25])
+        chunk.save()
+        
+        url = reverse('api:document-detail', kwargs={'pk': document.pk})
+        response = authenticated_client.get(url, {'include_embeddings': 'true'})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['chunks'][0]['embedding'] == [0.5, 0.25]
 
     def test_delete_document(self, authenticated_client):
         """Test deleting a document"""
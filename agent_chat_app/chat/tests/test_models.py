@@ -3,7 +3,7 @@ from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from unittest.mock import patch
-import json
+import numpy as np
 
 from agent_chat_app.chat.models import (
     Conversation,
@@ -295,18 +295,35 @@ class TestDocumentChunkModel:
         """Test embedding storage and retrieval methods"""
         chunk = DocumentChunkFactory()
         
-        # Test setting embedding
-        test_embedding = [0.1, 0.2, 0.3, 0.4, 0.5]
+        # Test setting embedding - stored as packed float32 bytes
+        test_embedding = [0.5, 0.25, -1.0, 2.0, 0.125]
         chunk.set_embedding(test_embedding)
-        assert chunk.embedding == json.dumps(test_embedding)
+        assert chunk.embedding_dtype == "float32"
+        assert len(chunk.embedding) == len(test_embedding) * 4
         
         # Test getting embedding
         retrieved_embedding = chunk.get_embedding()
         assert retrieved_embedding == test_embedding
+        assert chunk.get_embedding_array().dtype == np.float32
+        
+        # Round trip through the database
+        chunk.save()
+        chunk.refresh_from_db()
+        assert chunk.get_embedding() == test_embedding
         
         # Test with no embedding
         chunk.embedding = None
         assert chunk.get_embedding() is None
+        assert chunk.get_embedding_array() is None
+
+    def test_embedding_float16_storage(self):
+        """Test optional half-precision embedding storage"""
+        chunk = DocumentChunkFactory()
+        chunk.set_embedding([0.1, 0.2, 0.3], dtype="float16")
+        
+        assert chunk.embedding_dtype == "float16"
+        assert len(chunk.embedding) == 3 * 2
+        assert np.allclose(chunk.get_embedding(), [0.1, 0.2, 0.3], atol=1e-3)
 
     def test_chunk_save_calculates_character_count(self):
         """Test that save method calculates character count"""
@@ -0,0 +1,22 @@
+"""
+Per-turn stage timings.
+
+Stages of a chat turn (embedding, search, reranking, generation) record
+their wall-clock cost into a plain dict of stage name -> milliseconds, which
+travels with the retrieval result and response metadata.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+@contextmanager
+def timed(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    """Add the duration of the block to timings[stage], in milliseconds"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        timings[stage] = round(timings.get(stage, 0.0) + elapsed, 3)
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ChatView, DocumentUploadView, DocumentDeleteView, UserSettingsView, ConversationDeleteView
+from .views import ChatView, DocumentUploadView, DocumentDeleteView, DocumentProgressView, UserSettingsView, ConversationDeleteView
 
 app_name = 'chat'
 
@@ -9,6 +9,7 @@ urlpatterns = [
     path('<int:conversation_id>/', ChatView.as_view(), name='chat_view'),
     path('<int:conversation_id>/delete/', ConversationDeleteView.as_view(), name='conversation_delete'),
     path('documents/', DocumentUploadView.as_view(), name='document_upload'),
+    path('documents/progress/', DocumentProgressView.as_view(), name='document_progress'),
     path('documents/<int:document_id>/delete/', DocumentDeleteView.as_view(), name='document_delete'),
     path('settings/', UserSettingsView.as_view(), name='user_settings'),
 ]
\ No newline at end of file
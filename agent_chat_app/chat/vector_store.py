@@ -0,0 +1,137 @@
+"""
+Process-wide ChromaDB client and collection registry.
+
+Opening a PersistentClient is expensive, so each process opens it once,
+lazily, on first use and shares it between threads. The registry is
+dropped in forked children (Celery prefork workers, gunicorn) so a child
+never reuses the parent's SQLite handles.
+"""
+
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import chromadb
+from celery.signals import worker_process_init
+from chromadb.config import Settings
+from django.conf import settings
+
+# Disable ChromaDB telemetry completely
+os.environ["ANONYMIZED_TELEMETRY"] = "False"
+os.environ["CHROMA_CLIENT_AUTH_PROVIDER"] = ""
+os.environ["CHROMA_SERVER_AUTHN_PROVIDER"] = ""
+
+# Import telemetry fix
+from . import chromadb_fix  # noqa: E402,F401
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pid: Optional[int] = None
+_client = None
+_collections: Dict[str, Any] = {}
+
+
+def get_db_path() -> str:
+    return getattr(settings, 'CHROMADB_PATH', os.path.join(settings.BASE_DIR, "chromadb"))
+
+
+def _ensure_current_process() -> None:
+    """Forget objects inherited from a parent process (caller holds the lock)"""
+    global _pid, _client
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _client = None
+        _collections.clear()
+
+
+def _open_client():
+    db_path = get_db_path()
+    os.makedirs(db_path, exist_ok=True)
+    client_settings = Settings(
+        anonymized_telemetry=False,
+        allow_reset=True,
+        is_persistent=True
+    )
+    try:
+        return chromadb.PersistentClient(path=db_path, settings=client_settings)
+    except Exception as telemetry_error:
+        # Fallback: ignore telemetry errors
+        logger.warning(f"ChromaDB telemetry initialization warning: {telemetry_error}")
+        return chromadb.PersistentClient(path=db_path, settings=client_settings)
+
+
+def get_chroma_client():
+    """Get the ChromaDB client for this process, opening it on first use"""
+    global _client
+    with _lock:
+        _ensure_current_process()
+        if _client is None:
+            _client = _open_client()
+            logger.info(f"Opened ChromaDB client at {get_db_path()} (pid {_pid})")
+        return _client
+
+
+def get_collection(name: str = "documents"):
+    """Get (or create) a collection, reusing the handle across the process"""
+    client = get_chroma_client()
+    with _lock:
+        _ensure_current_process()
+        collection = _collections.get(name)
+        if collection is None:
+            collection = client.get_or_create_collection(
+                name=name,
+                metadata={"description": "Document chunks for RAG"}
+            )
+            _collections[name] = collection
+        return collection
+
+
+def reset_vector_store() -> None:
+    """
+    Drop the cached client and collection handles.
+
+    Stored vectors are untouched; the next call reopens the client. Use after
+    a fork or when the client got into a bad state.
+    """
+    global _client, _pid, _lock
+    # A fork may have copied the lock in a held state, so replace it
+    _lock = threading.Lock()
+    _client = None
+    _pid = os.getpid()
+    _collections.clear()
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+    except Exception as e:
+        logger.debug(f"Could not clear ChromaDB system cache: {e}")
+
+
+def get_vector_store_health() -> Dict[str, Any]:
+    """Health information for the vector store of this process"""
+    try:
+        client = get_chroma_client()
+        client.heartbeat()
+        return {
+            'status': 'ok',
+            'pid': os.getpid(),
+            'path': get_db_path(),
+            'collections': {name: collection.count() for name, collection in list(_collections.items())}
+        }
+    except Exception as e:
+        logger.error(f"Vector store health check failed: {e}")
+        return {
+            'status': 'error',
+            'pid': os.getpid(),
+            'error': str(e)
+        }
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_vector_store)
+
+
+@worker_process_init.connect
+def _reset_in_worker_process(**kwargs):
+    reset_vector_store()
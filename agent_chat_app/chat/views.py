@@ -7,13 +7,18 @@ from django.conf import settings
 from django.http import JsonResponse
 from django.core.cache import cache
 import os
+import logging
 from .models import Conversation, Message, Document, UserSettings
 from .services import OllamaService
 from .forms import DocumentUploadForm, UserSettingsForm
 from .document_processor import DocumentProcessor
-from .rag_service import RAGService
+from .rag_service import get_rag_service
+from .hybrid_rag_service import TOP_LEVEL_STAGES
+from .timing import timed
 from .tasks import process_document_task, delete_document_task
 
+logger = logging.getLogger(__name__)
+
 
 class ChatView(LoginRequiredMixin, View):
     template_name = 'chat/chat_interface.html'
@@ -82,16 +87,36 @@ class ChatView(LoginRequiredMixin, View):
             # Zapisz wiadomość użytkownika
             Message.objects.create(conversation=conversation, text=user_message_text, is_from_user=True)
             
+            # Retrieve here so embed/search/rerank are timed apart from generation
+            timings = {}
+            rag_chunks = None
+            try:
+                retrieval = get_rag_service().retrieve(user_message_text, n_results=3, user_id=request.user.id)
+                rag_chunks = retrieval.chunks
+                timings.update(retrieval.timings)
+            except Exception as e:
+                logger.warning(f"Failed to generate RAG context: {e}")
+            
             # Pobierz odpowiedź z Ollama (z RAG i opcjonalnymi ustawieniami)
-            ai_response_text = OllamaService.get_response(
-                user_message_text, 
-                model=selected_model if selected_model else None,
-                user_id=request.user.id,
-                custom_instruction=temp_instruction if temp_instruction else None
-            )
+            with timed(timings, 'generate'):
+                ai_response_text = OllamaService.get_response(
+                    user_message_text, 
+                    model=selected_model if selected_model else None,
+                    user_id=request.user.id,
+                    use_rag=False,
+                    custom_instruction=temp_instruction if temp_instruction else None,
+                    rag_chunks=rag_chunks
+                )
             
             # Zapisz odpowiedź AI
-            Message.objects.create(conversation=conversation, text=ai_response_text, is_from_user=False)
+            processing_time = sum(timings.get(stage, 0.0) for stage in TOP_LEVEL_STAGES)
+            Message.objects.create(
+                conversation=conversation,
+                text=ai_response_text,
+                is_from_user=False,
+                processing_time=round(processing_time / 1000, 3),
+                stage_timings=timings
+            )
 
         return redirect('chat:chat_view', conversation_id=conversation.id)
 
@@ -106,7 +131,7 @@ class DocumentUploadView(LoginRequiredMixin, View):
         
         # Get RAG stats
         try:
-            rag_service = RAGService()
+            rag_service = get_rag_service()
             stats = rag_service.get_document_stats(user_id=request.user.id)
         except Exception:
             stats = {'documents': 0, 'chunks': 0, 'chromadb_items': 0}
@@ -183,6 +208,17 @@ class DocumentDeleteView(LoginRequiredMixin, View):
         return redirect('chat:document_upload')
 
 
+class DocumentProgressView(LoginRequiredMixin, View):
+    """Processing status and progress of the requested documents, polled by the upload page"""
+    
+    def get(self, request):
+        ids = [value for value in request.GET.getlist('id') if value.isdigit()]
+        documents = Document.objects.filter(user=request.user, id__in=ids).values(
+            'id', 'processing_status', 'processing_progress'
+        )
+        return JsonResponse({'documents': list(documents)})
+
+
 class ConversationDeleteView(LoginRequiredMixin, View):
     """Delete conversation and its messages"""
     
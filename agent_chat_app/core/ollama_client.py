@@ -0,0 +1,263 @@
+"""
+Shared HTTP client for the Ollama API.
+
+One pooled keep-alive client per process serves every Ollama caller (chat,
+embeddings, receipt parsing), with per-endpoint timeouts, retries with
+jittered exponential backoff and a cap on concurrent in-flight requests.
+Both a sync interface (views, Celery tasks, threads) and an async interface
+(Channels consumers) are provided. Each event loop gets its own async client,
+closed when the loop shuts down its async generators (asyncio.run does) or
+by aclose().
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from json import loads as json_loads
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Read timeouts per endpoint; generation is slow, listing models is not
+ENDPOINT_TIMEOUTS = {
+    '/api/generate': 90.0,
+    '/api/chat': 90.0,
+    '/api/embed': 60.0,
+    '/api/embeddings': 30.0,
+    '/api/tags': 10.0,
+}
+DEFAULT_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 5.0
+
+# Gateway/overload statuses worth retrying; other errors are returned to the caller
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+class OllamaClient:
+    """Pooled sync + async Ollama client with retries and a concurrency limit"""
+
+    def __init__(self, base_url: str = None, max_connections: int = None, max_concurrency: int = None,
+                 max_retries: int = None, backoff: float = None, transport: httpx.BaseTransport = None):
+        self.base_url = (base_url or getattr(settings, 'OLLAMA_BASE_URL', 'http://localhost:11434')).rstrip('/')
+        self.max_connections = max_connections or getattr(settings, 'OLLAMA_MAX_CONNECTIONS', 20)
+        self.max_concurrency = max_concurrency or getattr(settings, 'OLLAMA_MAX_CONCURRENCY', 8)
+        self.max_retries = getattr(settings, 'OLLAMA_MAX_RETRIES', 2) if max_retries is None else max_retries
+        self.backoff = getattr(settings, 'OLLAMA_RETRY_BACKOFF', 0.5) if backoff is None else backoff
+        # Custom transport (e.g. httpx.MockTransport) shared by both clients
+        self._transport = transport
+
+        self._limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections
+        )
+        self._lock = threading.Lock()
+        self._sync_client: Optional[httpx.Client] = None
+        self._sync_semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        # Async client, semaphore and closer bound to the event loop that created them
+        self._async_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    @staticmethod
+    def timeout_for(path: str, timeout: float = None) -> httpx.Timeout:
+        read_timeout = timeout if timeout is not None else ENDPOINT_TIMEOUTS.get(path, DEFAULT_TIMEOUT)
+        return httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT)
+
+    def _retry_delay(self, attempt: int) -> float:
+        # Full jitter: spreads out retries from many workers hitting the same outage
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def _should_retry(self, attempt: int, error: Exception = None, response: httpx.Response = None) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if response is not None:
+            return response.status_code in RETRY_STATUS_CODES
+        return isinstance(error, httpx.TransportError)
+
+    # Sync interface
+
+    def _get_sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None:
+                kwargs = {'limits': self._limits}
+                if self._transport is not None:
+                    kwargs['transport'] = self._transport
+                self._sync_client = httpx.Client(**kwargs)
+            return self._sync_client
+
+    def request(self, method: str, path: str, json: Any = None, timeout: float = None) -> httpx.Response:
+        """
+        Send a request, retrying transport errors and 429/502/503/504.
+
+        Returns the successful response; raises httpx.HTTPStatusError for
+        error statuses and httpx.TransportError when retries are exhausted.
+        """
+        client = self._get_sync_client()
+        attempt = 0
+        while True:
+            try:
+                with self._sync_semaphore:
+                    response = client.request(method, self.url(path), json=json, timeout=self.timeout_for(path, timeout))
+                if self._should_retry(attempt, response=response):
+                    logger.warning(f"Ollama {path} returned {response.status_code}, retrying")
+                else:
+                    response.raise_for_status()
+                    return response
+            except httpx.TransportError as e:
+                if not self._should_retry(attempt, error=e):
+                    raise
+                logger.warning(f"Ollama {path} request failed ({e}), retrying")
+            time.sleep(self._retry_delay(attempt))
+            attempt += 1
+
+    def post(self, path: str, json: Any = None, timeout: float = None) -> httpx.Response:
+        return self.request('POST', path, json=json, timeout=timeout)
+
+    def get(self, path: str, timeout: float = None) -> httpx.Response:
+        return self.request('GET', path, timeout=timeout)
+
+    # Async interface
+
+    async def _get_async_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._async_state.get(loop)
+        if state is None:
+            kwargs = {'limits': self._limits}
+            if self._transport is not None:
+                kwargs['transport'] = self._transport
+            client = httpx.AsyncClient(**kwargs)
+            closer = self._close_on_shutdown(client)
+            # Started here, the closer is one of the loop's async generators from now on
+            await closer.__anext__()
+            state = (client, asyncio.Semaphore(self.max_concurrency), closer)
+            self._async_state[loop] = state
+        return state[:2]
+
+    async def _close_on_shutdown(self, client: httpx.AsyncClient):
+        """
+        Stay suspended for the loop's lifetime and close its client when closed.
+
+        The loop's shutdown_asyncgens closes every suspended async generator,
+        so the client's connections go with the loop. The loop is not held
+        here, so a loop dropped without shutting down still gets collected.
+        """
+        try:
+            yield
+        finally:
+            self._async_state.pop(asyncio.get_running_loop(), None)
+            await client.aclose()
+
+    async def arequest(self, method: str, path: str, json: Any = None, timeout: float = None) -> httpx.Response:
+        """Async counterpart of request()"""
+        client, semaphore = await self._get_async_state()
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    response = await client.request(
+                        method, self.url(path), json=json, timeout=self.timeout_for(path, timeout)
+                    )
+                if self._should_retry(attempt, response=response):
+                    logger.warning(f"Ollama {path} returned {response.status_code}, retrying")
+                else:
+                    response.raise_for_status()
+                    return response
+            except httpx.TransportError as e:
+                if not self._should_retry(attempt, error=e):
+                    raise
+                logger.warning(f"Ollama {path} request failed ({e}), retrying")
+            await asyncio.sleep(self._retry_delay(attempt))
+            attempt += 1
+
+    async def apost(self, path: str, json: Any = None, timeout: float = None) -> httpx.Response:
+        return await self.arequest('POST', path, json=json, timeout=timeout)
+
+    async def aget(self, path: str, timeout: float = None) -> httpx.Response:
+        return await self.arequest('GET', path, timeout=timeout)
+
+    @asynccontextmanager
+    async def astream(self, path: str, json: Any = None, timeout: float = None) -> AsyncIterator[httpx.Response]:
+        """
+        Open a streaming POST, holding a concurrency slot for its lifetime.
+
+        Only establishing the stream is retried; once the response has
+        started, errors go to the caller.
+        """
+        client, semaphore = await self._get_async_state()
+        attempt = 0
+        async with semaphore:
+            while True:
+                try:
+                    request = client.build_request('POST', self.url(path), json=json, timeout=self.timeout_for(path, timeout))
+                    response = await client.send(request, stream=True)
+                except httpx.TransportError as e:
+                    if not self._should_retry(attempt, error=e):
+                        raise
+                    logger.warning(f"Ollama {path} stream failed to open ({e}), retrying")
+                else:
+                    if not self._should_retry(attempt, response=response):
+                        break
+                    await response.aclose()
+                    logger.warning(f"Ollama {path} returned {response.status_code}, retrying")
+                await asyncio.sleep(self._retry_delay(attempt))
+                attempt += 1
+
+            try:
+                response.raise_for_status()
+                yield response
+            finally:
+                await response.aclose()
+
+    async def astream_json(self, path: str, json: Any = None, timeout: float = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the objects of an NDJSON streaming response"""
+        async with self.astream(path, json=json, timeout=timeout) as response:
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json_loads(line)
+
+    def close(self) -> None:
+        """Close the sync client; async clients close on aclose() or their loop's shutdown"""
+        with self._lock:
+            if self._sync_client is not None:
+                self._sync_client.close()
+                self._sync_client = None
+
+    async def aclose(self) -> None:
+        """Close the running event loop's async client now"""
+        state = self._async_state.get(asyncio.get_running_loop())
+        if state is not None:
+            await state[2].aclose()
+
+
+_ollama_client: Optional[OllamaClient] = None
+_ollama_client_lock = threading.Lock()
+
+
+def get_ollama_client() -> OllamaClient:
+    """Get the process-wide Ollama client"""
+    global _ollama_client
+    if _ollama_client is None:
+        with _ollama_client_lock:
+            if _ollama_client is None:
+                _ollama_client = OllamaClient()
+    return _ollama_client
+
+
+def _reset_after_fork() -> None:
+    """Forked children must not reuse the parent's pooled sockets"""
+    global _ollama_client, _ollama_client_lock
+    _ollama_client_lock = threading.Lock()
+    _ollama_client = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
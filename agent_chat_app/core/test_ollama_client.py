@@ -0,0 +1,95 @@
+import asyncio
+import unittest
+
+import httpx
+
+from .ollama_client import OllamaClient
+
+
+class TestOllamaClient(unittest.TestCase):
+    """Test retries and streaming of the shared Ollama client"""
+
+    def make_client(self, handler, max_retries=2):
+        return OllamaClient(
+            base_url='http://ollama.test',
+            max_retries=max_retries,
+            backoff=0,
+            transport=httpx.MockTransport(handler)
+        )
+
+    def test_retries_overload_statuses_then_succeeds(self):
+        statuses = [503, 502, 200]
+
+        def handler(request):
+            return httpx.Response(statuses.pop(0), json={'models': []})
+
+        response = self.make_client(handler).get('/api/tags')
+
+        self.assertEqual(response.json(), {'models': []})
+        self.assertEqual(statuses, [])
+
+    def test_does_not_retry_server_errors(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(500, json={'error': 'model failed'})
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.make_client(handler).post('/api/generate', json={'model': 'm'})
+        self.assertEqual(len(calls), 1)
+
+    def test_gives_up_after_max_retries(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            raise httpx.ConnectError('connection refused', request=request)
+
+        with self.assertRaises(httpx.ConnectError):
+            self.make_client(handler, max_retries=1).post('/api/embed', json={})
+        self.assertEqual(len(calls), 2)
+
+    def test_async_stream_json_retries_opening(self):
+        statuses = [503, 200]
+
+        def handler(request):
+            return httpx.Response(statuses.pop(0), text='{"response": "a"}\n\n{"done": true}\n')
+
+        async def run():
+            client = self.make_client(handler)
+            return [item async for item in client.astream_json('/api/generate', json={})]
+
+        self.assertEqual(asyncio.run(run()), [{'response': 'a'}, {'done': True}])
+
+    def test_async_client_is_closed_with_its_event_loop(self):
+        client = self.make_client(lambda request: httpx.Response(200, json={}))
+
+        async def run():
+            await client.aget('/api/tags')
+            return await client._get_async_state()
+
+        async_client, _ = asyncio.run(run())
+
+        self.assertTrue(async_client.is_closed)
+        self.assertEqual(len(client._async_state), 0)
+
+    def test_aclose_closes_the_running_loops_client(self):
+        client = self.make_client(lambda request: httpx.Response(200, json={}))
+
+        async def run():
+            await client.aget('/api/tags')
+            async_client, _ = await client._get_async_state()
+            await client.aclose()
+            # The next request opens a fresh client
+            await client.aget('/api/tags')
+            return async_client, (await client._get_async_state())[0]
+
+        first, second = asyncio.run(run())
+
+        self.assertTrue(first.is_closed)
+        self.assertIsNot(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, Receipt, ReceiptLineItem, InventoryItem, InventoryHistory
+from .models import Category, Product, Receipt, ReceiptLineItem, InventoryItem, InventoryHistory, OCRResultCache
 
 
 @admin.register(Category)
@@ -70,3 +70,11 @@ class InventoryHistoryAdmin(admin.ModelAdmin):
     list_filter = ['change_type', 'created_at']
     search_fields = ['inventory_item__product__name', 'notes']
     readonly_fields = ['created_at']
+
+
+@admin.register(OCRResultCache)
+class OCRResultCacheAdmin(admin.ModelAdmin):
+    list_display = ['content_hash', 'user', 'backend_name', 'confidence', 'hits', 'updated_at']
+    list_filter = ['backend_name']
+    search_fields = ['content_hash', 'user__username']
+    readonly_fields = ['created_at', 'updated_at']
@@ -319,3 +319,25 @@ class InventoryHistory(models.Model):
     
     def __str__(self):
         return f"{self.inventory_item.product.name} - {self.change_type} - {self.quantity_change}"
+
+
+class OCRResultCache(models.Model):
+    """OCR text of a user's receipt file, reused when the same file comes in again."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ocr_results')
+    # sha256 of the uploaded file
+    content_hash = models.CharField(max_length=64)
+    
+    text = models.TextField()
+    backend_name = models.CharField(max_length=50)
+    confidence = models.FloatField(default=0.0)
+    hits = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-updated_at']
+        unique_together = ['user', 'content_hash']
+    
+    def __str__(self):
+        return f"{self.backend_name} ({self.confidence:.2f}) - {self.content_hash[:12]}"
@@ -130,7 +130,8 @@ class PerformanceMonitor:
                 'success_rate': 0,
                 'avg_processing_time': 0,
                 'median_processing_time': 0,
-                'slow_processing_count': 0
+                'slow_processing_count': 0,
+                'ocr_backends': self.get_ocr_backend_performance()
             }
         
         times = sorted(stats['processing_times'])
@@ -150,9 +151,15 @@ class PerformanceMonitor:
             'avg_processing_time': avg_time,
             'median_processing_time': median_time,
             'slow_processing_count': slow_count,
-            'recent_failure_rate': self._calculate_recent_failure_rate()
+            'recent_failure_rate': self._calculate_recent_failure_rate(),
+            'ocr_backends': self.get_ocr_backend_performance()
         }
     
+    def get_ocr_backend_performance(self) -> Dict:
+        """Rolling latency, success rate and confidence of each OCR backend."""
+        from .services.ocr_stats import get_ocr_backend_stats
+        return get_ocr_backend_stats().summary()
+    
     def get_step_performance(self, step: str) -> Dict:
         """Get performance stats for a specific processing step."""
         times_key = f"{self.PROCESSING_TIMES_KEY}:{step}"
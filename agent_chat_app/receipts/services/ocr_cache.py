@@ -0,0 +1,74 @@
+"""
+Cache of OCR results by receipt file.
+
+Users upload the same receipt more than once and retries run OCR on the
+same file again. Results are stored per user under the sha256 of the file,
+so an identical upload is answered without decoding it, and a cached
+paid-backend result means the paid API is never charged twice for it.
+
+Only identical bytes are reused. Photos of two receipts from the same store
+share their layout and differ in a few printed digits, which perceptual
+hashes cannot tell apart, so a re-encoded or resized copy is read again.
+"""
+
+import hashlib
+import logging
+
+from django.conf import settings
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(image_path: str) -> str:
+    """sha256 of the file's bytes"""
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as image_file:
+        for block in iter(lambda: image_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_enabled() -> bool:
+    return getattr(settings, 'OCR_RESULT_CACHE', True)
+
+
+def get_cached_result(user_id: int, file_hash: str):
+    """The user's cached result for a file, None on a miss"""
+    from ..models import OCRResultCache
+
+    if not user_id or not file_hash:
+        return None
+    try:
+        entry = OCRResultCache.objects.filter(user_id=user_id, content_hash=file_hash).first()
+        if entry is not None:
+            OCRResultCache.objects.filter(pk=entry.pk).update(hits=F('hits') + 1)
+        return entry
+    except Exception as e:
+        logger.warning(f"OCR cache lookup failed: {e}")
+        return None
+
+
+def store_result(user_id: int, file_hash: str, text: str, backend_name: str, confidence: float) -> None:
+    """Cache the text of a user's file, keeping an existing entry when it is more confident"""
+    from ..models import OCRResultCache
+
+    if not user_id or not file_hash or not text.strip():
+        return
+    try:
+        entry, created = OCRResultCache.objects.get_or_create(
+            user_id=user_id,
+            content_hash=file_hash,
+            defaults={
+                'text': text,
+                'backend_name': backend_name,
+                'confidence': confidence,
+            }
+        )
+        if not created and confidence > entry.confidence:
+            entry.text = text
+            entry.backend_name = backend_name
+            entry.confidence = confidence
+            entry.save(update_fields=['text', 'backend_name', 'confidence', 'updated_at'])
+    except Exception as e:
+        logger.warning(f"Could not cache OCR result: {e}")
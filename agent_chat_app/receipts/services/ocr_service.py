@@ -7,15 +7,44 @@ import asyncio
 import logging
 import os
 import sys
+import threading
+import time
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List, Optional
-from PIL import Image, ImageEnhance, ImageFilter
+from typing import Dict, List, Optional, Union
+from PIL import Image, ImageOps
 import cv2
 import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .ocr_cache import cache_enabled, content_hash, get_cached_result, store_result
+from .ocr_stats import get_ocr_backend_stats
+from .ocr_workers import (
+    OCRBackendBusy, OCRWorkerError, OCRWorkerUnavailable, get_ocr_worker, ocr_workers_status, run_in_thread
+)
 
 logger = logging.getLogger(__name__)
 
+# Backends take an image file path or a decoded grayscale array
+OCRImage = Union[str, np.ndarray]
+
+
+def image_to_pil(image: OCRImage) -> Image.Image:
+    """PIL image for a path or an array, without a round trip through disk."""
+    return Image.fromarray(image) if isinstance(image, np.ndarray) else Image.open(image)
+
+
+def image_to_png_bytes(image: OCRImage) -> bytes:
+    """Encoded image for HTTP APIs; files are sent as they are."""
+    if isinstance(image, np.ndarray):
+        ok, encoded = cv2.imencode('.png', image)
+        if not ok:
+            raise ValueError("Could not encode image")
+        return encoded.tobytes()
+    with open(image, 'rb') as image_file:
+        return image_file.read()
+
 
 @dataclass
 class OCRResult:
@@ -31,14 +60,23 @@ class OCRResult:
 class ImageProcessingResult:
     """Result from image preprocessing."""
     success: bool
-    processed_path: str
     original_path: str
     error_message: str = ""
+    # Preprocessed grayscale image, handed to the backends in memory
+    image: Optional[np.ndarray] = None
+    
+    @property
+    def ocr_input(self) -> OCRImage:
+        """What to give the backends: the processed array, or the original file."""
+        return self.image if self.success and self.image is not None else self.original_path
 
 
 class OCRBackend(ABC):
     """Abstract base class for OCR backends."""
     
+    # CPU-bound backends run in a worker process of their own (see ocr_workers)
+    runs_in_worker = False
+    
     def __init__(self, name: str):
         self.name = name
     
@@ -48,14 +86,20 @@ class OCRBackend(ABC):
         pass
     
     @abstractmethod
-    async def extract_text(self, image_path: str) -> OCRResult:
-        """Extract text from image."""
+    async def extract_text(self, image: OCRImage) -> OCRResult:
+        """Extract text from an image file path or grayscale array."""
+        pass
+    
+    def warm_up(self) -> None:
+        """Load models ahead of the first image (called once per worker process)."""
         pass
 
 
 class TesseractBackend(OCRBackend):
     """Tesseract OCR backend."""
     
+    runs_in_worker = True
+    
     def __init__(self):
         super().__init__("Tesseract")
     
@@ -68,17 +112,20 @@ class TesseractBackend(OCRBackend):
             logger.warning("pytesseract not available")
             return False
     
-    async def extract_text(self, image_path: str) -> OCRResult:
+    def warm_up(self) -> None:
+        """Fail early when the tesseract binary is missing."""
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    
+    async def extract_text(self, image: OCRImage) -> OCRResult:
         """Extract text using Tesseract."""
         try:
             import pytesseract
-            from PIL import Image
             
             # Configure Tesseract for receipts
             config = '--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,!@#$%^&*()_+-=[]{}|;:\'\"<>?/~ '
             
-            image = Image.open(image_path)
-            text = pytesseract.image_to_string(image, config=config)
+            text = pytesseract.image_to_string(image_to_pil(image), config=config)
             
             # Calculate confidence (Tesseract doesn't provide it directly)
             confidence = 0.7 if text.strip() else 0.1
@@ -104,6 +151,8 @@ class TesseractBackend(OCRBackend):
 class EasyOCRBackend(OCRBackend):
     """EasyOCR backend for improved accuracy."""
     
+    runs_in_worker = True
+    
     def __init__(self):
         super().__init__("EasyOCR")
         self._reader = None
@@ -117,16 +166,21 @@ class EasyOCRBackend(OCRBackend):
             logger.warning("easyocr not available")
             return False
     
-    async def extract_text(self, image_path: str) -> OCRResult:
+    def _get_reader(self):
+        if self._reader is None:
+            import easyocr
+            # Initialize with Polish and English
+            self._reader = easyocr.Reader(['pl', 'en'], gpu=False)  # Set gpu=True if CUDA is available
+        return self._reader
+    
+    def warm_up(self) -> None:
+        self._get_reader()
+    
+    async def extract_text(self, image: OCRImage) -> OCRResult:
         """Extract text using EasyOCR."""
         try:
-            import easyocr
-            
-            if self._reader is None:
-                # Initialize with Polish and English
-                self._reader = easyocr.Reader(['pl', 'en'], gpu=False)  # Set gpu=True if CUDA is available
-            
-            results = self._reader.readtext(image_path)
+            # readtext takes a path or an array alike
+            results = self._get_reader().readtext(image)
             
             # Combine all text results
             text_parts = []
@@ -160,8 +214,11 @@ class EasyOCRBackend(OCRBackend):
 class PaddleOCRBackend(OCRBackend):
     """PaddleOCR backend as additional fallback."""
     
+    runs_in_worker = True
+    
     def __init__(self):
         super().__init__("PaddleOCR")
+        self._ocr = None
     
     def is_available(self) -> bool:
         """Check if PaddleOCR is available."""
@@ -172,13 +229,22 @@ class PaddleOCRBackend(OCRBackend):
             logger.warning("paddleocr not available")
             return False
     
-    async def extract_text(self, image_path: str) -> OCRResult:
+    def _get_ocr(self):
+        if self._ocr is None:
+            from paddleocr import PaddleOCR
+            self._ocr = PaddleOCR(use_angle_cls=True, lang='en', use_gpu=False)
+        return self._ocr
+    
+    def warm_up(self) -> None:
+        self._get_ocr()
+    
+    async def extract_text(self, image: OCRImage) -> OCRResult:
         """Extract text using PaddleOCR."""
         try:
-            from paddleocr import PaddleOCR
-            
-            ocr = PaddleOCR(use_angle_cls=True, lang='en', use_gpu=False)
-            result = ocr.ocr(image_path, cls=True)
+            if isinstance(image, np.ndarray) and image.ndim == 2:
+                # PaddleOCR expects 3-channel arrays
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            result = self._get_ocr().ocr(image, cls=True)
             
             text_parts = []
             confidence_scores = []
@@ -224,18 +290,15 @@ class GoogleVisionBackend(OCRBackend):
             logger.warning("google-cloud-vision not available")
             return False
     
-    async def extract_text(self, image_path: str) -> OCRResult:
+    async def extract_text(self, image: OCRImage) -> OCRResult:
         """Extract text using Google Vision API."""
         try:
             from google.cloud import vision
             
             client = vision.ImageAnnotatorClient()
             
-            with open(image_path, 'rb') as image_file:
-                content = image_file.read()
-            
-            image = vision.Image(content=content)
-            response = client.text_detection(image=image)
+            vision_image = vision.Image(content=image_to_png_bytes(image))
+            response = client.text_detection(image=vision_image)
             
             if response.error.message:
                 raise Exception(response.error.message)
@@ -280,7 +343,7 @@ class MistralOCRBackend(OCRBackend):
             logger.warning("Mistral API key not available")
             return False
     
-    async def extract_text(self, image_path: str) -> OCRResult:
+    async def extract_text(self, image: OCRImage) -> OCRResult:
         """Extract text using Mistral OCR API."""
         try:
             import httpx
@@ -321,60 +384,104 @@ class MistralOCRBackend(OCRBackend):
 
 
 class ImageProcessor:
-    """Image preprocessing for better OCR results."""
+    """
+    Image preprocessing for better OCR results.
+    
+    One NumPy/OpenCV pass over the decoded image: grayscale decode (EXIF
+    orientation applied), downscale of oversized photos to OCR_TARGET_DPI,
+    contrast, sharpening, median denoise and adaptive threshold. The result
+    stays in memory and goes to the backends as an array.
+    
+    The downscale is measured on the receipt itself, the largest bright
+    region of the photo, since a receipt often fills only part of the
+    frame. When no receipt is found the photo is assumed to be at most
+    OCR_DOWNSCALE_FALLBACK_FACTOR receipts wide.
+    """
+    
+    # PIL's ImageFilter.SMOOTH kernel, the blur ImageEnhance.Sharpness works against
+    SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+    
+    @staticmethod
+    def max_width_px() -> int:
+        """Pixel width of a receipt roll scanned at the target DPI."""
+        target_dpi = getattr(settings, 'OCR_TARGET_DPI', 300)
+        receipt_width_mm = getattr(settings, 'OCR_RECEIPT_WIDTH_MM', 80)
+        return round(receipt_width_mm / 25.4 * target_dpi)
     
     @staticmethod
-    def preprocess_image(image_path: str) -> ImageProcessingResult:
+    def receipt_width_px(image: np.ndarray) -> Optional[float]:
+        """Width in pixels of the receipt in a grayscale photo, None when none is found."""
+        height, width = image.shape[:2]
+        # Paper against a darker background; a small copy is enough to find it
+        scale = min(1.0, 512 / max(height, width))
+        small = image
+        if scale < 1.0:
+            small = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5, 5), dtype=np.uint8))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+        paper = max(contours, key=cv2.contourArea)
+        if cv2.contourArea(paper) < 0.05 * small.shape[0] * small.shape[1]:
+            return None
+        # The receipt may be rotated; its width is the short side of the enclosing box
+        # (contour points are pixel centres, so the box is a pixel short)
+        _, (box_width, box_height), _ = cv2.minAreaRect(paper)
+        return min((min(box_width, box_height) + 1) / scale, width)
+    
+    @classmethod
+    def preprocess_array(cls, image: np.ndarray) -> np.ndarray:
+        """Preprocess a grayscale uint8 image; returns a binarized image."""
+        # Phone photos are several times the resolution OCR needs
+        max_width = cls.max_width_px()
+        height, width = image.shape[:2]
+        if width > max_width:
+            receipt_width = cls.receipt_width_px(image)
+            if receipt_width is None:
+                receipt_width = width / getattr(settings, 'OCR_DOWNSCALE_FALLBACK_FACTOR', 2.5)
+            scale = max_width / receipt_width
+            if scale < 1.0:
+                image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                   interpolation=cv2.INTER_AREA)
+        
+        # Enhance contrast around the mean (as ImageEnhance.Contrast(1.5))
+        mean = float(image.mean())
+        image = cv2.convertScaleAbs(image, alpha=1.5, beta=-0.5 * mean)
+        
+        # Enhance sharpness (as ImageEnhance.Sharpness(2.0): 2 * image - smoothed)
+        smoothed = cv2.filter2D(image, -1, cls.SMOOTH_KERNEL)
+        image = cv2.addWeighted(image, 2.0, smoothed, -1.0, 0)
+        
+        # Reduce noise
+        image = cv2.medianBlur(image, 3)
+        
+        # Apply adaptive threshold
+        return cv2.adaptiveThreshold(
+            image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
+        )
+    
+    @classmethod
+    def preprocess_image(cls, image_path: str) -> ImageProcessingResult:
         """Preprocess image to improve OCR accuracy."""
         try:
-            # Create output path
-            base, ext = os.path.splitext(image_path)
-            processed_path = f"{base}_processed{ext}"
-            
-            # Open and process image
-            image = Image.open(image_path)
-            
-            # Convert to grayscale
-            if image.mode != 'L':
-                image = image.convert('L')
-            
-            # Enhance contrast
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.5)
-            
-            # Enhance sharpness
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(2.0)
-            
-            # Apply filters to reduce noise
-            image = image.filter(ImageFilter.MedianFilter(size=3))
-            
-            # Convert to OpenCV format for advanced processing
-            opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_GRAY2BGR)
-            opencv_image = cv2.cvtColor(opencv_image, cv2.COLOR_BGR2GRAY)
-            
-            # Apply adaptive threshold
-            processed_cv = cv2.adaptiveThreshold(
-                opencv_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
-            )
-            
-            # Convert back to PIL
-            processed_image = Image.fromarray(processed_cv)
-            
-            # Save processed image
-            processed_image.save(processed_path, optimize=True, quality=95)
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                # Formats OpenCV cannot decode (e.g. some HEIC/WebP builds)
+                with Image.open(image_path) as pil_image:
+                    image = np.asarray(ImageOps.exif_transpose(pil_image).convert('L'))
             
             return ImageProcessingResult(
                 success=True,
-                processed_path=processed_path,
-                original_path=image_path
+                original_path=image_path,
+                image=cls.preprocess_array(image)
             )
             
         except Exception as e:
             logger.error(f"Image preprocessing failed: {e}")
             return ImageProcessingResult(
                 success=False,
-                processed_path=image_path,
                 original_path=image_path,
                 error_message=str(e)
             )
@@ -390,6 +497,10 @@ class AdaptiveHybridOCRService:
         self.confidence_threshold = confidence_threshold
         self.max_backends = max_backends
         self.timeout = timeout
+        self.use_worker_processes = getattr(settings, 'OCR_WORKER_PROCESSES', True)
+        # Order and skip local backends by their observed latency and confidence
+        self.adaptive_ordering = getattr(settings, 'OCR_ADAPTIVE_ORDERING', True)
+        self.stats = get_ocr_backend_stats()
         
         # Initialize local (free) backends first - priority order
         self.local_backends = [
@@ -430,43 +541,33 @@ class AdaptiveHybridOCRService:
         if not self.available_local_backends and not self.available_paid_backends:
             raise RuntimeError("No OCR backends are available")
         
+        # Step 0: The user uploaded this exact file before
+        user_id = getattr(receipt, 'user_id', None)
+        use_cache = cache_enabled() and bool(user_id)
+        file_hash = ''
+        if use_cache:
+            try:
+                file_hash = content_hash(image_path)
+            except OSError as e:
+                logger.warning(f"Could not hash {image_path}, skipping OCR cache: {e}")
+                use_cache = False
+        if use_cache:
+            cached = await sync_to_async(get_cached_result)(user_id, file_hash)
+            if self._use_cached_result(cached, receipt):
+                return cached.text
+        
         # Preprocess image
         processor = ImageProcessor()
         processing_result = processor.preprocess_image(image_path)
-        ocr_image_path = processing_result.processed_path if processing_result.success else image_path
+        ocr_image = processing_result.ocr_input
         
         logger.info(f"Starting adaptive OCR processing for receipt {receipt.id}")
+        # Known when a receipt is processed again; backends are compared per store then
+        store = getattr(receipt, 'store_name', '') or None
         
-        results = []
-        best_local_confidence = 0.0
-        
-        # Step 1: Always try local backends first (free)
-        for backend in self.available_local_backends:
-            try:
-                logger.info(f"Trying local OCR backend: {backend.name}")
-                
-                result = await asyncio.wait_for(
-                    backend.extract_text(ocr_image_path),
-                    timeout=self.timeout
-                )
-                
-                results.append(result)
-                logger.info(f"{backend.name} result: success={result.success}, confidence={result.confidence:.2f}")
-                
-                if result.success:
-                    best_local_confidence = max(best_local_confidence, result.confidence)
-                
-                # Stop if we have high confidence result from local backend
-                if result.success and result.confidence >= self.confidence_threshold:
-                    logger.info(f"High confidence result from local {backend.name}, stopping")
-                    break
-                    
-            except asyncio.TimeoutError:
-                logger.warning(f"Local OCR backend {backend.name} timed out")
-                continue
-            except Exception as e:
-                logger.warning(f"Local OCR backend {backend.name} failed: {e}")
-                continue
+        # Step 1: Always try local backends first (free), best performers first
+        results = await self._run_local_backends(ocr_image, store)
+        best_local_confidence = max((r.confidence for r in results if r.success), default=0.0)
         
         # Step 2: Use paid backends only if local confidence is low AND attempts_mistral < 1
         if (best_local_confidence < self.confidence_threshold and 
@@ -479,10 +580,12 @@ class AdaptiveHybridOCRService:
                 try:
                     logger.info(f"Trying paid OCR backend: {backend.name}")
                     
+                    started = time.monotonic()
                     result = await asyncio.wait_for(
-                        backend.extract_text(ocr_image_path),
+                        backend.extract_text(ocr_image),
                         timeout=self.timeout * 2  # More time for paid services
                     )
+                    self._record_run(backend, time.monotonic() - started, result, store)
                     
                     results.append(result)
                     logger.info(f"{backend.name} result: success={result.success}, confidence={result.confidence:.2f}")
@@ -490,7 +593,7 @@ class AdaptiveHybridOCRService:
                     # Increment attempts counter for paid services  
                     if backend.name == "Mistral OCR":
                         receipt.attempts_mistral += 1
-                        receipt.save(update_fields=['attempts_mistral'])
+                        await sync_to_async(receipt.save)(update_fields=['attempts_mistral'])
                         logger.info(f"Incremented attempts_mistral to {receipt.attempts_mistral} for receipt {receipt.id}")
                     
                     # Stop after first paid attempt
@@ -515,15 +618,151 @@ class AdaptiveHybridOCRService:
         best_result = self._select_best_result(results)
         logger.info(f"Selected best result from {best_result.backend_name} with confidence {best_result.confidence:.2f}")
         
-        # Clean up processed image
-        if processing_result.success and os.path.exists(processing_result.processed_path):
-            try:
-                os.remove(processing_result.processed_path)
-            except OSError:
-                pass
+        if use_cache and best_result.success:
+            await sync_to_async(store_result)(
+                user_id, file_hash, best_result.text, best_result.backend_name, best_result.confidence
+            )
         
         return best_result.text
     
+    def _use_cached_result(self, cached, receipt) -> bool:
+        """
+        Whether a cached result answers this receipt.
+        
+        Local backends give the same text for the same image, so a cached
+        result is only passed over when it is below the threshold and this
+        receipt may still try a paid backend that has not read the image.
+        """
+        if cached is None:
+            return False
+        paid_names = {backend.name for backend in self.paid_backends}
+        may_use_paid = receipt.attempts_mistral < 1 and bool(self.available_paid_backends)
+        if (cached.confidence < self.confidence_threshold and may_use_paid
+                and cached.backend_name not in paid_names):
+            logger.info(f"Cached OCR result for receipt {receipt.id} below threshold, trying paid backends")
+            return False
+        logger.info(f"Using cached OCR result from {cached.backend_name} with confidence {cached.confidence:.2f} for receipt {receipt.id}")
+        return True
+    
+    def start_workers(self) -> None:
+        """Start the local backends' worker processes so they load their models now."""
+        if not self.use_worker_processes:
+            return
+        for backend in self.available_local_backends:
+            if backend.runs_in_worker:
+                try:
+                    get_ocr_worker(backend).start()
+                except OCRWorkerUnavailable as e:
+                    logger.error(f"{e}; {backend.name} will run in-process without a kill-able timeout")
+    
+    def workers_ready(self) -> Dict[str, bool]:
+        """Readiness of each local backend's worker process."""
+        status = ocr_workers_status()
+        return {
+            backend.name: status.get(backend.name, {}).get('ready', False)
+            for backend in self.available_local_backends if backend.runs_in_worker
+        }
+    
+    async def _run_local_backends(self, image: OCRImage, store: Optional[str] = None) -> List[OCRResult]:
+        """
+        Run the local backends in parallel and collect their results.
+        
+        Backends run in the order their statistics favour, unpromising ones
+        skipped. When the first one usually passes the threshold the others
+        wait up to its p95 latency before starting, so they only spend CPU
+        when it fails or is slow. Returns as soon as one result passes the
+        confidence threshold; the slower backends are no longer waited for.
+        """
+        backends = self.available_local_backends
+        hedge_delay = 0.0
+        if self.adaptive_ordering and backends:
+            backends = self.stats.order(backends, store)
+            if len(backends) > 1:
+                hedge_delay = self.stats.hedge_delay(backends[0].name, store)
+        
+        tasks = []
+        for backend in backends:
+            leader = tasks[0] if tasks and hedge_delay else None
+            tasks.append(asyncio.create_task(self._extract_local(backend, image, store, leader, hedge_delay)))
+        results = []
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                if result is None:
+                    continue
+                results.append(result)
+                logger.info(f"{result.backend_name} result: success={result.success}, confidence={result.confidence:.2f}")
+                
+                # Stop if we have high confidence result from local backend
+                if self._is_acceptable(result):
+                    logger.info(f"High confidence result from local {result.backend_name}, stopping")
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return results
+    
+    async def _extract_local(self, backend: OCRBackend, image: OCRImage, store: Optional[str] = None,
+                             leader: Optional[asyncio.Task] = None, delay: float = 0.0) -> Optional[OCRResult]:
+        """One local backend's result, or None when it timed out, crashed or was not needed"""
+        if leader is not None:
+            await asyncio.wait({leader}, timeout=delay)
+            if leader.done() and not leader.cancelled() and self._is_acceptable(leader.result()):
+                return None
+        logger.info(f"Trying local OCR backend: {backend.name}")
+        started = time.monotonic()
+        try:
+            if backend.runs_in_worker and self.use_worker_processes:
+                try:
+                    result = await get_ocr_worker(backend).extract_text(image, self.timeout)
+                    self._record_run(backend, time.monotonic() - started, result, store)
+                    return result
+                except OCRWorkerUnavailable as e:
+                    logger.error(f"{e}, running {backend.name} in-process although OCR_WORKER_PROCESSES is on")
+            # Off the event loop at least, though a thread cannot be stopped on timeout
+            result = await run_in_thread(backend, image, self.timeout)
+            self._record_run(backend, time.monotonic() - started, result, store)
+            return result
+        except asyncio.CancelledError:
+            # Another backend was good enough first; this run only shows it takes longer
+            self._record_run(backend, time.monotonic() - started, None, store, censored=True)
+            raise
+        except (asyncio.TimeoutError, TimeoutError):
+            logger.warning(f"Local OCR backend {backend.name} timed out")
+            self._record_run(backend, time.monotonic() - started, None, store)
+        except OCRBackendBusy as e:
+            # Not a run of the backend; it gets its chance once the abandoned image is done
+            logger.warning(f"Skipping local OCR backend: {e}")
+        except OCRWorkerError as e:
+            logger.warning(f"Local OCR backend {backend.name} failed: {e}")
+            self._record_run(backend, time.monotonic() - started, None, store)
+            return OCRResult(success=False, text="", error_message=str(e), backend_name=backend.name)
+        except Exception as e:
+            logger.warning(f"Local OCR backend {backend.name} failed: {e}")
+            self._record_run(backend, time.monotonic() - started, None, store)
+        return None
+    
+    def _is_acceptable(self, result: Optional[OCRResult]) -> bool:
+        return result is not None and result.success and result.confidence >= self.confidence_threshold
+    
+    def _record_run(self, backend: OCRBackend, latency: float, result: Optional[OCRResult],
+                    store: Optional[str] = None, censored: bool = False) -> None:
+        """Add a backend run to its statistics; None for a timeout, crash or cancelled (censored) run"""
+        self.stats.record(
+            backend.name,
+            latency,
+            success=bool(result and result.success),
+            confidence=result.confidence if result and result.success else 0.0,
+            accepted=self._is_acceptable(result),
+            store=store,
+            censored=censored
+        )
+    
+    def backend_stats(self) -> Dict[str, Dict]:
+        """Rolling statistics of every configured backend."""
+        return self.stats.summary([backend.name for backend in self.local_backends + self.paid_backends])
+    
     async def extract_text_from_file(self, image_path: str) -> str:
         """
         Extract text from image file using hybrid OCR approach.
@@ -543,7 +782,7 @@ class AdaptiveHybridOCRService:
         # Preprocess image
         processor = ImageProcessor()
         processing_result = processor.preprocess_image(image_path)
-        ocr_image_path = processing_result.processed_path if processing_result.success else image_path
+        ocr_image = processing_result.ocr_input
         
         logger.info(f"Starting OCR processing for: {image_path}")
         
@@ -553,7 +792,7 @@ class AdaptiveHybridOCRService:
                 logger.info(f"Trying OCR backend: {backend.name}")
                 
                 result = await asyncio.wait_for(
-                    backend.extract_text(ocr_image_path),
+                    backend.extract_text(ocr_image),
                     timeout=self.timeout
                 )
                 
@@ -579,13 +818,6 @@ class AdaptiveHybridOCRService:
         best_result = self._select_best_result(results)
         logger.info(f"Selected best result from {best_result.backend_name} with confidence {best_result.confidence:.2f}")
         
-        # Clean up processed image
-        if processing_result.success and os.path.exists(processing_result.processed_path):
-            try:
-                os.remove(processing_result.processed_path)
-            except OSError:
-                pass
-        
         return best_result.text
     
     def _select_best_result(self, results: List[OCRResult]) -> OCRResult:
@@ -614,9 +846,30 @@ def get_image_processor() -> ImageProcessor:
     return ImageProcessor()
 
 
+_ocr_services: Dict[float, AdaptiveHybridOCRService] = {}
+_ocr_services_lock = threading.Lock()
+
+
 def get_hybrid_ocr_service(confidence_threshold=0.75) -> AdaptiveHybridOCRService:
-    """Get adaptive hybrid OCR service instance."""
-    return AdaptiveHybridOCRService(confidence_threshold=confidence_threshold)
+    """Get the process-wide adaptive hybrid OCR service for a confidence threshold."""
+    with _ocr_services_lock:
+        service = _ocr_services.get(confidence_threshold)
+        if service is None:
+            service = _ocr_services[confidence_threshold] = AdaptiveHybridOCRService(
+                confidence_threshold=confidence_threshold
+            )
+        return service
+
+
+def _reset_ocr_services() -> None:
+    global _ocr_services_lock
+    # A fork may have copied the lock in a held state
+    _ocr_services_lock = threading.Lock()
+    _ocr_services.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_ocr_services)
 
 
 def get_legacy_hybrid_ocr_service(confidence_threshold=0.7) -> 'HybridOCRService':
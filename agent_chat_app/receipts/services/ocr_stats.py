@@ -0,0 +1,293 @@
+"""
+Rolling statistics of the OCR backends and bandit-style backend ordering.
+
+Every backend run records its latency, whether it succeeded and its
+confidence, in Redis lists shared by all Celery workers (RPUSH + LTRIM, so
+concurrent workers never overwrite each other's runs): once for the backend
+and once for the store when the receipt's store is already known. The last
+OCR_STATS_WINDOW runs give p50/p95 latency, success rate, mean confidence
+and how often the result passed the confidence threshold.
+
+A run cancelled because another backend's result was good enough is kept as
+a censored observation: not accepted, and its latency only a lower bound.
+Latency percentiles are Kaplan-Meier estimates, so slow backends that are
+usually cancelled do not look fast.
+
+Before each receipt the local backends are ordered by Thompson sampling:
+each backend draws an acceptance rate from Beta(accepted + 1, rejected + 1)
+and is ranked by that draw per second of median latency, the expected
+acceptable results per unit of time. A backend without runs draws from the
+uniform prior at the other backends' median latency, and only goes first
+while no backend has OCR_STATS_MIN_RUNS runs. A backend whose draw falls
+below OCR_SKIP_BELOW_ACCEPTANCE is skipped for this receipt; since the draw
+is random, a skipped backend is still tried now and then and can recover.
+When the first backend is usually accepted, the others wait up to its p95
+latency instead of competing with it for CPU.
+"""
+
+import json
+import logging
+import random
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.text import slugify
+
+logger = logging.getLogger(__name__)
+
+BACKENDS_KEY = "ocr_backend_stats:backends"
+STATS_KEY = "ocr_backend_stats:{backend}"
+STORE_STATS_KEY = "ocr_backend_stats:{backend}:{store}"
+
+# Latency floor so an untried or instant backend does not divide by zero
+MIN_LATENCY = 0.05
+
+# Fields of a recorded run; runs recorded before censoring have the first four
+RUN_FIELDS = ('latency', 'success', 'confidence', 'accepted', 'censored')
+
+
+def survival_percentile(latency: np.ndarray, censored: np.ndarray, q: float) -> float:
+    """
+    Kaplan-Meier estimate of the q-th latency percentile (q in 0-1).
+
+    Censored latencies only say the run would have taken longer. When the
+    completed runs never reach q, the longest observed latency is returned.
+    """
+    # Completed runs go before censored ones at the same latency
+    order = np.lexsort((censored, latency))
+    latency, censored = latency[order], censored[order]
+    at_risk = np.arange(len(latency), 0, -1)
+    survival = np.cumprod(np.where(censored > 0, 1.0, 1.0 - 1.0 / at_risk))
+    reached = np.flatnonzero(1.0 - survival >= q - 1e-9)
+    return float(latency[reached[0]] if reached.size else latency[-1])
+
+
+@dataclass
+class BackendStats:
+    """Summary of a backend's recent runs."""
+    backend: str
+    runs: int = 0
+    success_rate: float = 0.0
+    acceptance_rate: float = 0.0
+    mean_confidence: float = 0.0
+    p50_latency: float = 0.0
+    p95_latency: float = 0.0
+    accepted: int = 0
+    censored: int = 0
+
+    @classmethod
+    def from_runs(cls, backend: str, runs: Sequence[Sequence[float]]) -> 'BackendStats':
+        """
+        Summarize runs stored as [latency, success, confidence, accepted, censored].
+
+        Censored runs count as not accepted and only bound the latency;
+        success rate and confidence are over the completed runs.
+        """
+        if not runs:
+            return cls(backend=backend)
+        observations = np.zeros((len(runs), len(RUN_FIELDS)), dtype=np.float64)
+        for row, run in enumerate(runs):
+            observations[row, :len(run)] = run
+        latency, success, confidence, accepted, censored = observations.T
+        completed = censored == 0
+        succeeded = completed & (success > 0)
+        return cls(
+            backend=backend,
+            runs=len(observations),
+            success_rate=round(float(success[completed].mean()) if completed.any() else 0.0, 3),
+            acceptance_rate=round(float(accepted.mean()), 3),
+            mean_confidence=round(float(confidence[succeeded].mean()) if succeeded.any() else 0.0, 3),
+            p50_latency=round(survival_percentile(latency, censored, 0.5), 3),
+            p95_latency=round(survival_percentile(latency, censored, 0.95), 3),
+            accepted=int(accepted.sum()),
+            censored=int((~completed).sum()),
+        )
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _store_key(store: Optional[str]) -> str:
+    return slugify(store or '')[:50]
+
+
+def _stats_key(backend: str, store: Optional[str] = None) -> str:
+    if _store_key(store):
+        return STORE_STATS_KEY.format(backend=slugify(backend), store=_store_key(store))
+    return STATS_KEY.format(backend=slugify(backend))
+
+
+class OCRBackendStats:
+    """
+    Per-backend OCR statistics kept in Redis.
+
+    Without raw Redis access (another cache backend) the runs go to the
+    Django cache instead, where concurrent writers can lose runs.
+    """
+
+    def __init__(self, window: int = None, min_runs: int = None, skip_below: float = None):
+        self.window = window or getattr(settings, 'OCR_STATS_WINDOW', 200)
+        self.min_runs = min_runs if min_runs is not None else getattr(settings, 'OCR_STATS_MIN_RUNS', 20)
+        self.skip_below = skip_below if skip_below is not None else getattr(settings, 'OCR_SKIP_BELOW_ACCEPTANCE', 0.05)
+        self.use_redis = True
+
+    def _get_redis(self):
+        if not self.use_redis:
+            return None
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            self.use_redis = False
+            return None
+
+    def record(self, backend: str, latency: float, success: bool, confidence: float,
+               accepted: bool, store: Optional[str] = None, censored: bool = False) -> None:
+        """
+        Add one run of a backend to its rolling window (and its store's).
+
+        censored marks a run stopped before it finished; latency is how long it had run.
+        """
+        run = [round(latency, 3), int(success), round(confidence, 3), int(accepted), int(censored)]
+        keys = [_stats_key(backend)]
+        if _store_key(store):
+            keys.append(_stats_key(backend, store))
+        try:
+            redis_client = self._get_redis()
+            if redis_client is not None:
+                pipeline = redis_client.pipeline(transaction=False)
+                for key in keys:
+                    pipeline.rpush(key, json.dumps(run))
+                    pipeline.ltrim(key, -self.window, -1)
+                pipeline.sadd(BACKENDS_KEY, backend)
+                pipeline.execute()
+                return
+            for key in keys:
+                runs = cache.get(key, [])
+                runs.append(run)
+                cache.set(key, runs[-self.window:], timeout=None)
+            known = cache.get(BACKENDS_KEY, [])
+            if backend not in known:
+                cache.set(BACKENDS_KEY, known + [backend], timeout=None)
+        except Exception as e:
+            logger.warning(f"Could not record OCR stats for {backend}: {e}")
+
+    def _read_runs(self, keys: List[str]) -> Dict[str, List]:
+        """Recorded runs by key; missing keys are left out"""
+        redis_client = self._get_redis()
+        if redis_client is None:
+            return cache.get_many(keys)
+        pipeline = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.lrange(key, -self.window, -1)
+        return {
+            key: [json.loads(run) for run in runs]
+            for key, runs in zip(keys, pipeline.execute()) if runs
+        }
+
+    def known_backends(self) -> List[str]:
+        """Every backend with recorded runs"""
+        redis_client = self._get_redis()
+        if redis_client is None:
+            return cache.get(BACKENDS_KEY, [])
+        return sorted(
+            name.decode() if isinstance(name, bytes) else name for name in redis_client.smembers(BACKENDS_KEY)
+        )
+
+    def get(self, backends: Sequence[str], store: Optional[str] = None) -> Dict[str, BackendStats]:
+        """
+        Stats of each backend, for the store when it has enough runs there.
+
+        Backends without recorded runs get empty stats.
+        """
+        keys = {backend: _stats_key(backend) for backend in backends}
+        store_keys = {}
+        if _store_key(store):
+            store_keys = {backend: _stats_key(backend, store) for backend in backends}
+        try:
+            cached = self._read_runs(list(keys.values()) + list(store_keys.values()))
+        except Exception as e:
+            logger.warning(f"Could not read OCR stats: {e}")
+            cached = {}
+
+        stats = {}
+        for backend in backends:
+            runs = cached.get(store_keys.get(backend), [])
+            if len(runs) < self.min_runs:
+                runs = cached.get(keys[backend], [])
+            stats[backend] = BackendStats.from_runs(backend, runs)
+        return stats
+
+    def order(self, backends: Sequence, store: Optional[str] = None) -> List:
+        """
+        Backends (anything with a .name) in the order to run them, skipped ones left out.
+
+        Backends with fewer than OCR_STATS_MIN_RUNS runs are never skipped,
+        and at least one backend always remains.
+        """
+        if len(backends) <= 1:
+            return list(backends)
+        stats = self.get([backend.name for backend in backends], store)
+        tried = [backend_stats for backend_stats in stats.values() if backend_stats.runs]
+        warmed_up = any(backend_stats.runs >= self.min_runs for backend_stats in tried)
+        typical_latency = float(np.median([backend_stats.p50_latency for backend_stats in tried])) if tried else 0.0
+
+        scored = []
+        for position, backend in enumerate(backends):
+            backend_stats = stats[backend.name]
+            if backend_stats.runs:
+                draw = random.betavariate(backend_stats.accepted + 1, backend_stats.runs - backend_stats.accepted + 1)
+                latency = max(backend_stats.p50_latency, MIN_LATENCY)
+            elif not warmed_up:
+                # Nothing is known yet: untried backends go first, in their configured order
+                draw, latency = 1.0, MIN_LATENCY
+            else:
+                # Uniform prior at a typical latency; competes with the proven backends
+                draw = random.betavariate(1, 1)
+                latency = max(typical_latency, MIN_LATENCY)
+            skip = backend_stats.runs >= self.min_runs and draw < self.skip_below
+            scored.append((skip, -draw / latency, position, backend))
+        scored.sort(key=lambda item: item[:3])
+
+        ordered = [backend for skip, _, _, backend in scored if not skip] or [scored[0][3]]
+        skipped = [backend.name for skip, _, _, backend in scored if skip and backend not in ordered]
+        if skipped:
+            logger.info(f"Skipping OCR backends with low acceptance: {skipped}")
+        return ordered
+
+    def hedge_delay(self, backend_name: str, store: Optional[str] = None) -> float:
+        """
+        Seconds to give a proven backend before starting the others, 0 for none.
+
+        A backend whose results usually pass the threshold gets its p95
+        latency; the others start right away when it fails sooner.
+        """
+        backend_stats = self.get([backend_name], store)[backend_name]
+        hedge_above = getattr(settings, 'OCR_HEDGE_ABOVE_ACCEPTANCE', 0.8)
+        if backend_stats.runs < self.min_runs or backend_stats.acceptance_rate < hedge_above:
+            return 0.0
+        return backend_stats.p95_latency
+
+    def summary(self, backends: Optional[Sequence[str]] = None) -> Dict[str, Dict]:
+        """Stats of each backend (default: every backend with runs) across all stores."""
+        if backends is None:
+            try:
+                backends = self.known_backends()
+            except Exception as e:
+                logger.warning(f"Could not read OCR stats: {e}")
+                backends = []
+        return {backend: stats.to_dict() for backend, stats in self.get(backends).items()}
+
+
+_backend_stats: Optional[OCRBackendStats] = None
+
+
+def get_ocr_backend_stats() -> OCRBackendStats:
+    """Get the OCR backend statistics tracker."""
+    global _backend_stats
+    if _backend_stats is None:
+        _backend_stats = OCRBackendStats()
+    return _backend_stats
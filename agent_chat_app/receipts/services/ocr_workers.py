@@ -0,0 +1,413 @@
+"""
+Worker processes for the local OCR backends.
+
+EasyOCR, Tesseract and PaddleOCR do blocking CPU work inside their async
+extract_text, so awaited in the task's event loop they run one after another
+and asyncio.wait_for cannot interrupt them. Each local backend gets a
+long-lived process of its own, fed over a local queue: backends run in
+parallel, a backend that overruns its timeout has its process killed (a new
+one starts for the next image), and models a backend loads stay loaded
+between images. An image abandoned once another backend's result was good
+enough keeps the worker busy; the next image's timeout only starts when it
+is done, and a worker stuck on it past its own timeout is killed. Where no
+worker can be started, backends run in threads (run_in_thread), bounded by
+OCR_MAX_ABANDONED_THREADS since a timed-out thread cannot be killed.
+
+A worker loads its backend's models (warm_up) before taking images and then
+reports ready; Celery worker processes start them at worker_process_init so
+the first receipt does not pay for model loading. A worker exits after
+OCR_WORKER_MAX_JOBS images or once its memory passes OCR_WORKER_MAX_MEMORY_MB,
+and the next image starts a fresh one.
+
+Celery prefork children are daemonic, and multiprocessing refuses to start
+children from a daemonic process. Workers are therefore started with
+billiard (Celery's multiprocessing fork), which has no such restriction;
+plain multiprocessing is used only where billiard is not installed.
+
+Workers belong to the process that started them: every Celery prefork child
+has its own, so a host runs concurrency x local backends model processes,
+each up to OCR_WORKER_MAX_MEMORY_MB. Run the receipt_processing queue on a
+worker with low concurrency and set OCR_PREWARM_WORKERS off elsewhere.
+"""
+
+import asyncio
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting job checks for cancellation, overrun and a dead worker
+POLL_INTERVAL = 0.1
+
+
+def _spawn_context():
+    """spawn start method of billiard when available, which may start children of daemonic processes"""
+    try:
+        import billiard
+        return billiard.get_context('spawn')
+    except ImportError:
+        return multiprocessing.get_context('spawn')
+
+
+class OCRWorkerError(Exception):
+    """The backend failed or its worker process died"""
+
+
+class OCRWorkerUnavailable(OCRWorkerError):
+    """The worker process could not be started; run the backend in-process"""
+
+
+class OCRBackendBusy(OCRWorkerError):
+    """Too many in-process runs of the backend were abandoned and still run"""
+
+
+# Job id of the message a worker sends once its backend is loaded
+READY = -1
+
+
+def _rss_mb() -> float:
+    """Resident memory of this process in MB"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Peak rather than current size where /proc is missing (kB on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker_main(backend_path: str, requests, responses, max_jobs: int = 0, max_memory_mb: float = 0) -> None:
+    """Worker process loop: load the backend once, then OCR images until told to stop or recycled"""
+    module_name, class_name = backend_path.rsplit('.', 1)
+    backend = getattr(importlib.import_module(module_name), class_name)()
+    try:
+        warm_up = getattr(backend, 'warm_up', None)
+        if warm_up is not None:
+            warm_up()
+        responses.put((READY, True, os.getpid(), False))
+    except Exception as e:
+        # The backend may still load lazily on the first image
+        responses.put((READY, False, f"{type(e).__name__}: {e}", False))
+    
+    jobs = 0
+    while True:
+        job = requests.get()
+        if job is None:
+            return
+        job_id, image = job
+        try:
+            ok, outcome = True, asyncio.run(backend.extract_text(image))
+        except Exception as e:
+            ok, outcome = False, f"{type(e).__name__}: {e}"
+        jobs += 1
+        recycle = bool((max_jobs and jobs >= max_jobs) or (max_memory_mb and _rss_mb() > max_memory_mb))
+        responses.put((job_id, ok, outcome, recycle))
+        if recycle:
+            # The parent starts a fresh worker for the next image
+            return
+
+
+def _kill(process) -> None:
+    """Kill a worker process outright; billiard processes have no kill()"""
+    kill = getattr(process, 'kill', None)
+    if kill is not None:
+        kill()
+        return
+    try:
+        os.kill(process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    except (ProcessLookupError, TypeError):
+        pass  # Already gone, or never started
+
+
+class OCRWorker:
+    """One long-lived process running a single OCR backend, one image at a time"""
+
+    def __init__(self, name: str, backend_path: str, max_jobs: int = 0, max_memory_mb: float = 0,
+                 startup_timeout: float = 180):
+        self.name = name
+        self.backend_path = backend_path
+        self.max_jobs = max_jobs
+        self.max_memory_mb = max_memory_mb
+        # Model loading does not count against an image's timeout
+        self.startup_timeout = startup_timeout
+        # spawn: the worker never inherits sockets, locks or threads of a Celery child
+        self._context = _spawn_context()
+        self._process = None
+        self._requests = None
+        self._responses = None
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._ready = threading.Event()
+        # Job id -> deadline of images whose caller stopped waiting but the worker still runs
+        self._abandoned: Dict[int, float] = {}
+        self.started_count = 0
+
+    @property
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._process.pid if self._process is not None else None
+
+    def start(self) -> None:
+        if self.is_alive:
+            return
+        try:
+            self._requests = self._context.Queue()
+            self._responses = self._context.Queue()
+            self._process = self._context.Process(
+                target=_worker_main,
+                args=(self.backend_path, self._requests, self._responses, self.max_jobs, self.max_memory_mb),
+                name=f"ocr-{self.name}",
+                daemon=True
+            )
+            self._ready.clear()
+            self._process.start()
+        except Exception as e:
+            self._process = None
+            raise OCRWorkerUnavailable(f"Could not start {self.name} worker: {e}") from e
+        self.started_count += 1
+        logger.info(f"Started OCR worker {self.name} (pid {self._process.pid})")
+
+    def _handle_ready(self, ok: bool, outcome: Any) -> None:
+        self._ready.set()
+        if ok:
+            logger.info(f"OCR worker {self.name} ready (pid {outcome})")
+        else:
+            logger.warning(f"OCR worker {self.name} could not preload its models: {outcome}")
+
+    def is_ready(self) -> bool:
+        """Whether the worker runs and has loaded its backend; never blocks on a busy worker"""
+        if not self.is_alive:
+            return False
+        if not self._ready.is_set() and self._lock.acquire(blocking=False):
+            try:
+                # Nobody waits for a job, so anything queued is a readiness message or stale
+                while True:
+                    response_id, ok, outcome, _ = self._responses.get_nowait()
+                    if response_id == READY:
+                        self._handle_ready(ok, outcome)
+                    else:
+                        self._abandoned.pop(response_id, None)
+            except queue.Empty:
+                pass
+            finally:
+                self._lock.release()
+        return self._ready.is_set()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'alive': self.is_alive,
+            'ready': self.is_ready(),
+            'pid': self.pid,
+            'starts': self.started_count,
+        }
+
+    def stop(self, kill: bool = False) -> None:
+        """Ask the worker to exit, or kill it when it is busy with an image nobody waits for"""
+        process, self._process = self._process, None
+        self._ready.clear()
+        self._abandoned.clear()
+        if process is None:
+            return
+        if kill or not process.is_alive():
+            _kill(process)
+        else:
+            self._requests.put(None)
+        process.join(timeout=5)
+        if process.is_alive():
+            _kill(process)
+
+    def run(self, image: Any, timeout: float, cancelled: threading.Event) -> Any:
+        """
+        OCR one image (a file path or an array, pickled to the worker)
+        in the worker and return the backend's result.
+
+        Raises TimeoutError after killing an overrunning worker, and
+        OCRWorkerError when the backend failed. When cancelled is set the
+        wait stops and the image is abandoned; its result is skipped once
+        it arrives, and the timeout of the image queued behind it starts then.
+        """
+        if not self._lock.acquire(timeout=timeout):
+            raise TimeoutError(f"{self.name} worker busy for {timeout}s")
+        try:
+            # Starts a fresh worker when the previous one was recycled or killed
+            self.start()
+            # Abandoned images ahead of this one get their own timeout first
+            started = max([time.monotonic(), *self._abandoned.values()])
+            deadline = started + timeout + (0 if self._ready.is_set() else self.startup_timeout)
+            job_id = next(self._job_ids)
+            self._requests.put((job_id, image))
+            while not cancelled.is_set():
+                try:
+                    response_id, ok, outcome, recycle = self._responses.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if not self.is_alive:
+                        self._process = None
+                        self._abandoned.clear()
+                        raise OCRWorkerError(f"{self.name} worker exited before finishing the image")
+                    if self._abandoned and time.monotonic() >= max(self._abandoned.values()):
+                        # Nobody waits for the image holding up ours; start over without it
+                        logger.warning(f"OCR worker {self.name} overran an abandoned image, restarting it")
+                        self.stop(kill=True)
+                        self.start()
+                        self._requests.put((job_id, image))
+                        deadline = time.monotonic() + timeout + self.startup_timeout
+                        continue
+                    if time.monotonic() >= deadline:
+                        self.stop(kill=True)
+                        raise TimeoutError(f"{self.name} did not finish in {timeout}s")
+                    continue
+                if response_id == READY:
+                    self._handle_ready(ok, outcome)
+                    deadline = time.monotonic() + timeout
+                    continue
+                if recycle:
+                    logger.info(f"Recycling OCR worker {self.name} (pid {self.pid})")
+                    self.stop()
+                if response_id != job_id:
+                    # Late result of an abandoned image
+                    self._abandoned.pop(response_id, None)
+                    if recycle:
+                        # Our image was queued to the worker that just exited
+                        self.start()
+                        self._requests.put((job_id, image))
+                        deadline = time.monotonic() + timeout + self.startup_timeout
+                    elif not self._abandoned:
+                        # The worker only now starts on our image
+                        deadline = time.monotonic() + timeout
+                    continue
+                if not ok:
+                    raise OCRWorkerError(outcome)
+                return outcome
+            if self.is_alive:
+                self._abandoned[job_id] = deadline
+            raise asyncio.CancelledError()
+        finally:
+            self._lock.release()
+
+    async def extract_text(self, image: Any, timeout: float) -> Any:
+        """Run the backend on an image without blocking the event loop"""
+        cancelled = threading.Event()
+        try:
+            return await asyncio.to_thread(self.run, image, timeout, cancelled)
+        except asyncio.CancelledError:
+            # Release the waiting thread; asyncio.run waits for it on shutdown
+            cancelled.set()
+            raise
+
+
+_workers: Dict[str, OCRWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def get_ocr_worker(backend) -> OCRWorker:
+    """The process-wide worker for an OCR backend instance"""
+    backend_path = f"{type(backend).__module__}.{type(backend).__qualname__}"
+    with _workers_lock:
+        worker = _workers.get(backend_path)
+        if worker is None:
+            worker = _workers[backend_path] = OCRWorker(
+                backend.name,
+                backend_path,
+                max_jobs=getattr(settings, 'OCR_WORKER_MAX_JOBS', 500),
+                max_memory_mb=getattr(settings, 'OCR_WORKER_MAX_MEMORY_MB', 768),
+                startup_timeout=getattr(settings, 'OCR_WORKER_STARTUP_TIMEOUT', 180)
+            )
+        return worker
+
+
+# Backend name -> in-process threads still running after their caller gave up
+_abandoned_threads: Dict[str, int] = {}
+_abandoned_threads_lock = threading.Lock()
+
+
+def _settle(future: asyncio.Future, ok: bool, outcome: Any) -> None:
+    if future.done():
+        return
+    if ok:
+        future.set_result(outcome)
+    else:
+        future.set_exception(outcome)
+
+
+async def run_in_thread(backend, image: Any, timeout: float) -> Any:
+    """
+    Run a backend in a daemon thread of this process, where no worker process is available.
+
+    A thread cannot be stopped: after a timeout or cancellation it runs on,
+    abandoned. A backend with OCR_MAX_ABANDONED_THREADS abandoned threads
+    raises OCRBackendBusy instead of starting another one, so a stuck
+    backend cannot pile up threads that slow down later images. The thread
+    is not the event loop's executor, so asyncio.run does not wait for it.
+    """
+    with _abandoned_threads_lock:
+        if _abandoned_threads.get(backend.name, 0) >= getattr(settings, 'OCR_MAX_ABANDONED_THREADS', 1):
+            raise OCRBackendBusy(f"{backend.name} is still busy with an abandoned image")
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    state = {'abandoned': False, 'done': False}
+
+    def run():
+        try:
+            ok, outcome = True, asyncio.run(backend.extract_text(image))
+        except Exception as e:
+            ok, outcome = False, e
+        with _abandoned_threads_lock:
+            state['done'] = True
+            if state['abandoned']:
+                _abandoned_threads[backend.name] -= 1
+                return
+        try:
+            loop.call_soon_threadsafe(_settle, future, ok, outcome)
+        except RuntimeError:
+            pass  # The loop closed meanwhile; nobody waits for the result
+
+    threading.Thread(target=run, name=f"ocr-{backend.name}", daemon=True).start()
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    except BaseException:
+        # Timed out or cancelled: the thread runs on
+        with _abandoned_threads_lock:
+            if not state['done']:
+                state['abandoned'] = True
+                _abandoned_threads[backend.name] = _abandoned_threads.get(backend.name, 0) + 1
+        raise
+
+
+def ocr_workers_status() -> Dict[str, Dict[str, Any]]:
+    """Readiness of this process's OCR workers, by backend name"""
+    with _workers_lock:
+        workers = list(_workers.values())
+    return {worker.name: worker.status() for worker in workers}
+
+
+def stop_ocr_workers() -> None:
+    with _workers_lock:
+        for worker in _workers.values():
+            worker.stop()
+        _workers.clear()
+
+
+def _forget_ocr_workers() -> None:
+    global _workers_lock, _abandoned_threads_lock
+    # A fork copies the registry but the worker processes and threads belong to the parent
+    _workers_lock = threading.Lock()
+    _workers.clear()
+    _abandoned_threads_lock = threading.Lock()
+    _abandoned_threads.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_ocr_workers)
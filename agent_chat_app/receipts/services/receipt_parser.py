@@ -10,8 +10,11 @@ from dataclasses import dataclass, asdict
 from datetime import datetime
 from decimal import Decimal
 from typing import List, Optional, Dict, Any
+import httpx
 import requests
 
+from agent_chat_app.core.ollama_client import OllamaClient, get_ollama_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -47,10 +50,12 @@ class ExtractedReceipt:
 class ReceiptParser:
     """LLM-based receipt parser for structured data extraction."""
     
-    def __init__(self, model_name: str = "llama3.2", base_url: str = "http://localhost:11434"):
+    def __init__(self, model_name: str = "llama3.2", base_url: str = None):
         self.model_name = model_name
-        self.base_url = base_url
-        self.api_url = f"{base_url}/api/generate"
+        # Shared pooled Ollama client unless a specific server is requested
+        self.client = OllamaClient(base_url=base_url) if base_url else get_ollama_client()
+        self.base_url = self.client.base_url
+        self.api_url = f"{self.base_url}/api/generate"
     
     def parse(self, receipt_text: str) -> Dict[str, Any]:
         """
@@ -142,17 +147,16 @@ JSON:"""
                 }
             }
             
-            response = requests.post(
-                self.api_url,
+            response = self.client.post(
+                "/api/generate",
                 json=payload,
                 timeout=60
             )
-            response.raise_for_status()
             
             result = response.json()
             return result.get('response', '')
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"LLM API call failed: {e}")
             raise RuntimeError(f"Failed to connect to LLM API: {e}")
     
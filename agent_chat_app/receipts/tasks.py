@@ -8,12 +8,34 @@ import logging
 import time
 from decimal import Decimal
 from celery import shared_task
+from celery.signals import worker_process_init, worker_process_shutdown
 from django.utils import timezone
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
 
+@worker_process_init.connect
+def prewarm_ocr_workers(**kwargs):
+    """Start the OCR worker processes with each Celery worker so models load before the first receipt."""
+    if not getattr(settings, 'OCR_PREWARM_WORKERS', True):
+        return
+    try:
+        from .services.ocr_service import get_hybrid_ocr_service
+        get_hybrid_ocr_service().start_workers()
+    except Exception as e:
+        logger.error(f"Could not pre-warm OCR workers: {e}")
+
+
+@worker_process_shutdown.connect
+def stop_ocr_worker_processes(**kwargs):
+    try:
+        from .services.ocr_workers import stop_ocr_workers
+        stop_ocr_workers()
+    except Exception as e:
+        logger.warning(f"Could not stop OCR workers: {e}")
+
+
 @shared_task(bind=True, max_retries=3)
 def process_receipt_task(self, receipt_id):
     """
@@ -295,7 +317,7 @@ def process_receipt_task(self, receipt_id):
 
 @shared_task(bind=True, max_retries=2)
 def retry_ocr_task(self, receipt_id):
-    """Retry OCR processing with different backend."""
+    """Retry OCR processing for a receipt."""
     try:
         from .models import Receipt
         from .services.ocr_service import get_hybrid_ocr_service
@@ -306,12 +328,11 @@ def retry_ocr_task(self, receipt_id):
         
         logger.info(f"Retrying OCR for receipt {receipt_id} (attempt {self.request.retries + 1})")
         
-        # Force use of different OCR backend
+        # An identical file that was read before comes from the OCR cache
         raw_text = asyncio.run(
             ocr_service.extract_text_from_file_with_receipt(
                 receipt.receipt_file.path, 
-                receipt,
-                force_backend='fallback'
+                receipt
             )
         )
         
@@ -338,7 +359,7 @@ def retry_ocr_task(self, receipt_id):
 
 @shared_task
 def cleanup_old_processed_images():
-    """Clean up old processed images from OCR preprocessing."""
+    """Clean up _processed images left by older OCR preprocessing, which wrote them to disk."""
     import os
     import glob
     from django.conf import settings
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import tempfile
+from unittest.mock import Mock
+
+import cv2
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+
+from .models import OCRResultCache
+from .services.ocr_service import AdaptiveHybridOCRService, OCRBackend, OCRResult
+
+
+class CountingBackend(OCRBackend):
+    runs_in_worker = False
+
+    def __init__(self, name, confidence):
+        super().__init__(name)
+        self.confidence = confidence
+        self.calls = 0
+
+    def is_available(self):
+        return True
+
+    async def extract_text(self, image):
+        self.calls += 1
+        return OCRResult(success=True, text=f"{self.name} text", confidence=self.confidence, backend_name=self.name)
+
+
+def receipt_photo(path, size=(600, 800), total='12,50'):
+    photo = np.full((800, 600), 230, dtype=np.uint8)
+    for row in range(7):
+        cv2.rectangle(photo, (40, 60 + row * 90), (200 + row * 40, 110 + row * 90), 20, -1)
+    cv2.putText(photo, f'SUMA PLN {total}', (40, 740), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 20, 3)
+    if size != (600, 800):
+        photo = cv2.resize(photo, size, interpolation=cv2.INTER_AREA)
+    cv2.imwrite(path, photo)
+    return path
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestOCRResultCache(TransactionTestCase):
+    """Test reuse of OCR results for identical receipt files"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.user = get_user_model().objects.create_user(username='ocr-cache-user', password='pass')
+        self.service = AdaptiveHybridOCRService(confidence_threshold=0.75, timeout=10)
+        self.service.use_worker_processes = False
+        self.local = CountingBackend("Tesseract", 0.9)
+        self.service.available_local_backends = [self.local]
+        self.service.available_paid_backends = []
+
+    def extract(self, path, attempts_mistral=0, user=None):
+        receipt = Mock(id=1, user_id=(user or self.user).id, attempts_mistral=attempts_mistral, store_name='')
+        return asyncio.run(self.service.extract_text_from_file_with_receipt(path, receipt))
+
+    def test_identical_file_skips_backends(self):
+        path = receipt_photo(os.path.join(self.directory, 'receipt.png'))
+
+        self.assertEqual(self.extract(path), "Tesseract text")
+        self.assertEqual(self.extract(path), "Tesseract text")
+
+        self.assertEqual(self.local.calls, 1)
+        entry = OCRResultCache.objects.get()
+        self.assertEqual((entry.backend_name, entry.confidence, entry.hits), ("Tesseract", 0.9, 1))
+
+    def test_resized_copy_is_read_again(self):
+        self.extract(receipt_photo(os.path.join(self.directory, 'receipt.png')))
+        copy = receipt_photo(os.path.join(self.directory, 'copy.jpg'), size=(450, 600))
+
+        self.assertEqual(self.extract(copy), "Tesseract text")
+
+        self.assertEqual(self.local.calls, 2)
+        self.assertEqual(OCRResultCache.objects.count(), 2)
+
+    def test_paid_backend_is_not_charged_twice(self):
+        self.local.confidence = 0.3
+        paid = CountingBackend("Mistral OCR", 0.95)
+        self.service.available_paid_backends = [paid]
+        path = receipt_photo(os.path.join(self.directory, 'receipt.png'))
+
+        self.assertEqual(self.extract(path), "Mistral OCR text")
+        # A new upload of the same receipt may use the paid backend again, but needs not
+        self.assertEqual(self.extract(path), "Mistral OCR text")
+
+        self.assertEqual((self.local.calls, paid.calls), (1, 1))
+
+    def test_low_confidence_result_gets_a_paid_attempt(self):
+        self.local.confidence = 0.3
+        path = receipt_photo(os.path.join(self.directory, 'receipt.png'))
+        self.extract(path)
+        paid = CountingBackend("Mistral OCR", 0.95)
+        self.service.available_paid_backends = [paid]
+
+        self.assertEqual(self.extract(path), "Mistral OCR text")
+
+        self.assertEqual(paid.calls, 1)
+        self.assertEqual(OCRResultCache.objects.get().backend_name, "Mistral OCR")
+
+    def test_same_layout_receipt_with_other_digits_is_read_again(self):
+        self.extract(receipt_photo(os.path.join(self.directory, 'receipt.png'), total='12,50'))
+        self.local.confidence = 0.8
+
+        self.extract(receipt_photo(os.path.join(self.directory, 'next.png'), total='42,90'))
+
+        self.assertEqual(self.local.calls, 2)
+        self.assertEqual(sorted(OCRResultCache.objects.values_list('confidence', flat=True)), [0.8, 0.9])
+
+    def test_other_users_results_are_not_shared(self):
+        path = receipt_photo(os.path.join(self.directory, 'receipt.png'))
+        other_user = get_user_model().objects.create_user(username='ocr-cache-other', password='pass')
+
+        self.extract(path)
+        self.extract(path, user=other_user)
+
+        self.assertEqual(self.local.calls, 2)
+        self.assertEqual(OCRResultCache.objects.filter(user=other_user).count(), 1)
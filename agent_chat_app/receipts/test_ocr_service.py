@@ -0,0 +1,114 @@
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import Mock
+
+import cv2
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from .services.ocr_service import AdaptiveHybridOCRService, ImageProcessor, OCRBackend, OCRResult
+from .services.ocr_workers import stop_ocr_workers
+
+
+class ConfidentBackend(OCRBackend):
+    runs_in_worker = True
+
+    def __init__(self):
+        super().__init__("Confident")
+
+    def is_available(self):
+        return True
+
+    async def extract_text(self, image):
+        # Arrays arrive in the worker as arrays
+        return OCRResult(success=True, text=f"SUMA PLN {image.shape[1]}", confidence=0.9, backend_name=self.name)
+
+
+class SlowBackend(OCRBackend):
+    runs_in_worker = True
+
+    def __init__(self):
+        super().__init__("Slow")
+
+    def is_available(self):
+        return True
+
+    async def extract_text(self, image):
+        time.sleep(30)
+        return OCRResult(success=True, text="late", confidence=1.0, backend_name=self.name)
+
+
+class TestImageProcessor(SimpleTestCase):
+    """Test in-memory receipt image preprocessing"""
+
+    def test_photo_is_downscaled_and_binarized_in_memory(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        image_path = os.path.join(directory.name, 'receipt.jpg')
+        photo = np.full((4000, 3000, 3), 210, dtype=np.uint8)
+        cv2.putText(photo, 'SUMA 12,50', (100, 500), cv2.FONT_HERSHEY_SIMPLEX, 5, (0, 0, 0), 10)
+        cv2.imwrite(image_path, photo)
+
+        with override_settings(OCR_TARGET_DPI=300, OCR_RECEIPT_WIDTH_MM=80):
+            result = ImageProcessor.preprocess_image(image_path)
+
+        self.assertTrue(result.success)
+        self.assertEqual(result.image.shape, (1260, 945))
+        self.assertEqual(set(np.unique(result.image)), {0, 255})
+        self.assertIs(result.ocr_input, result.image)
+        self.assertEqual(os.listdir(directory.name), ['receipt.jpg'])
+
+    def test_receipt_filling_part_of_the_photo_keeps_its_resolution(self):
+        photo = np.full((4000, 3000), 40, dtype=np.uint8)
+        photo[400:3600, 900:2100] = 230
+        cv2.putText(photo, 'SUMA 12,50', (950, 1000), cv2.FONT_HERSHEY_SIMPLEX, 3, 0, 8)
+
+        with override_settings(OCR_TARGET_DPI=300, OCR_RECEIPT_WIDTH_MM=80):
+            self.assertAlmostEqual(ImageProcessor.receipt_width_px(photo), 1200, delta=20)
+            processed = ImageProcessor.preprocess_array(photo)
+
+        # The 1200 px receipt, 40% of the frame, comes out about 945 px wide
+        self.assertAlmostEqual(processed.shape[1], 3000 * 945 / 1200, delta=60)
+
+    def test_unreadable_file_falls_back_to_original_path(self):
+        result = ImageProcessor.preprocess_image('/nonexistent/receipt.jpg')
+
+        self.assertFalse(result.success)
+        self.assertEqual(result.ocr_input, '/nonexistent/receipt.jpg')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestParallelLocalBackends(SimpleTestCase):
+    """Test local backends running concurrently in worker processes"""
+
+    def test_first_confident_result_returns_without_waiting(self):
+        self.addCleanup(stop_ocr_workers)
+        service = AdaptiveHybridOCRService(confidence_threshold=0.75, timeout=60)
+        service.use_worker_processes = True
+        service.available_local_backends = [SlowBackend(), ConfidentBackend()]
+        service.available_paid_backends = []
+
+        started = time.monotonic()
+        results = asyncio.run(service._run_local_backends(np.zeros((10, 20), dtype=np.uint8)))
+
+        self.assertLess(time.monotonic() - started, 20)
+        self.assertEqual([result.text for result in results], ["SUMA PLN 20"])
+
+    @override_settings(OCR_RESULT_CACHE=False)
+    def test_receipt_text_comes_from_best_local_backend(self):
+        self.addCleanup(stop_ocr_workers)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        image_path = os.path.join(directory.name, 'receipt.png')
+        cv2.imwrite(image_path, np.full((50, 40), 255, dtype=np.uint8))
+        service = AdaptiveHybridOCRService(confidence_threshold=0.75, timeout=60)
+        service.use_worker_processes = True
+        service.available_local_backends = [ConfidentBackend()]
+        service.available_paid_backends = []
+
+        text = asyncio.run(service.extract_text_from_file_with_receipt(image_path, Mock(id=1, attempts_mistral=0, store_name='')))
+
+        self.assertEqual(text, "SUMA PLN 40")
+
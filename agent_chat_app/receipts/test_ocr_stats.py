@@ -0,0 +1,228 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from .monitoring import PerformanceMonitor
+from .services.ocr_service import AdaptiveHybridOCRService, OCRBackend, OCRResult
+from .services.ocr_stats import BackendStats, OCRBackendStats, _stats_key
+
+
+def beta_mean(alpha, beta):
+    return alpha / (alpha + beta)
+
+
+class FakeRedis:
+    """The list and set commands the stats use, with a pipeline that runs them in order"""
+
+    def __init__(self):
+        self.lists = {}
+        self.sets = {}
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value.encode())
+
+    def ltrim(self, key, start, end):
+        values = self.lists.get(key, [])
+        self.lists[key] = values[start:len(values) + end + 1 if end < 0 else end + 1]
+
+    def lrange(self, key, start, end):
+        values = self.lists.get(key, [])
+        return values[max(start, -len(values)):len(values) + end + 1 if end < 0 else end + 1]
+
+    def sadd(self, key, value):
+        self.sets.setdefault(key, set()).add(value.encode())
+
+    def smembers(self, key):
+        return self.sets.get(key, set())
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.queued = []
+
+    def __getattr__(self, command):
+        def queue(*args):
+            self.redis.commands.append(command)
+            self.queued.append((getattr(self.redis, command), args))
+        return queue
+
+    def execute(self):
+        return [method(*args) for method, args in self.queued]
+
+
+class SlowBackend(OCRBackend):
+    runs_in_worker = False
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def is_available(self):
+        return True
+
+    async def extract_text(self, image):
+        await asyncio.sleep(1)
+        return OCRResult(success=True, text="late", confidence=0.99, backend_name=self.name)
+
+
+class CountingBackend(OCRBackend):
+    runs_in_worker = False
+
+    def __init__(self, name, confidence):
+        super().__init__(name)
+        self.confidence = confidence
+        self.calls = 0
+
+    def is_available(self):
+        return True
+
+    async def extract_text(self, image):
+        self.calls += 1
+        return OCRResult(success=True, text=f"{self.name} text", confidence=self.confidence, backend_name=self.name)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestOCRBackendStats(SimpleTestCase):
+    """Test rolling backend statistics and bandit ordering"""
+
+    def setUp(self):
+        cache.clear()
+        self.stats = OCRBackendStats(window=50, min_runs=10, skip_below=0.05)
+
+    def record_runs(self, backend, count, latency, accepted, store=None):
+        for _ in range(count):
+            self.stats.record(backend, latency, success=True, confidence=0.9 if accepted else 0.4,
+                              accepted=accepted, store=store)
+
+    def test_summary_of_runs(self):
+        runs = [[latency, 1, 0.8, 1] for latency in range(1, 20)] + [[30.0, 0, 0.0, 0]]
+
+        stats = BackendStats.from_runs("Tesseract", runs)
+
+        self.assertEqual(stats.runs, 20)
+        self.assertEqual(stats.success_rate, 0.95)
+        self.assertEqual(stats.acceptance_rate, 0.95)
+        self.assertEqual(stats.mean_confidence, 0.8)
+        self.assertEqual(stats.p50_latency, 10.0)
+        self.assertEqual(stats.p95_latency, 19.0)
+
+    def test_censored_runs_bound_latency_and_are_not_accepted(self):
+        # Half the runs finished in 1s; the others were cancelled after 2s
+        runs = [[1.0, 1, 0.9, 1, 0]] * 10 + [[2.0, 0, 0.0, 0, 1]] * 10
+
+        stats = BackendStats.from_runs("EasyOCR", runs)
+
+        self.assertEqual((stats.runs, stats.censored, stats.accepted), (20, 10, 10))
+        self.assertEqual((stats.success_rate, stats.acceptance_rate, stats.mean_confidence), (1.0, 0.5, 0.9))
+        self.assertEqual(stats.p50_latency, 1.0)
+        # Never observed finishing past 1s, so p95 is only known to exceed 2s
+        self.assertEqual(stats.p95_latency, 2.0)
+        # Runs recorded before censoring have four fields
+        self.assertEqual(BackendStats.from_runs("EasyOCR", [[1.0, 1, 0.9, 1]]).censored, 0)
+
+    def test_window_keeps_latest_runs(self):
+        self.record_runs("Tesseract", 60, 1.0, accepted=False)
+        self.record_runs("Tesseract", 50, 2.0, accepted=True)
+
+        stats = self.stats.get(["Tesseract"])["Tesseract"]
+
+        self.assertEqual((stats.runs, stats.acceptance_rate, stats.p50_latency), (50, 1.0, 2.0))
+
+    def test_fast_accepted_backend_first_and_failing_backend_skipped(self):
+        backends = [SimpleNamespace(name=name) for name in ("EasyOCR", "Tesseract", "PaddleOCR", "New")]
+        self.record_runs("EasyOCR", 20, 6.0, accepted=True)
+        self.record_runs("Tesseract", 20, 1.5, accepted=True)
+        self.record_runs("PaddleOCR", 40, 2.0, accepted=False)
+
+        with patch('agent_chat_app.receipts.services.ocr_stats.random.betavariate', side_effect=beta_mean):
+            ordered = self.stats.order(backends)
+
+        # The untried backend draws from the prior at the median latency instead of going first
+        self.assertEqual([b.name for b in ordered], ["Tesseract", "New", "EasyOCR"])
+
+    def test_untried_backends_go_first_before_any_backend_has_enough_runs(self):
+        backends = [SimpleNamespace(name="EasyOCR"), SimpleNamespace(name="New")]
+        self.record_runs("EasyOCR", 5, 1.0, accepted=True)
+
+        with patch('agent_chat_app.receipts.services.ocr_stats.random.betavariate', side_effect=beta_mean):
+            self.assertEqual([b.name for b in self.stats.order(backends)], ["New", "EasyOCR"])
+
+    def test_store_stats_override_global_once_sufficient(self):
+        backends = [SimpleNamespace(name="EasyOCR"), SimpleNamespace(name="Tesseract")]
+        self.record_runs("EasyOCR", 20, 1.0, accepted=True)
+        self.record_runs("Tesseract", 20, 4.0, accepted=True)
+        self.record_runs("EasyOCR", 10, 4.0, accepted=True, store="Lidl")
+        self.record_runs("Tesseract", 10, 1.0, accepted=True, store="Lidl")
+
+        with patch('agent_chat_app.receipts.services.ocr_stats.random.betavariate', side_effect=beta_mean):
+            self.assertEqual([b.name for b in self.stats.order(backends)], ["EasyOCR", "Tesseract"])
+            self.assertEqual([b.name for b in self.stats.order(backends, store="LIDL")], ["Tesseract", "EasyOCR"])
+
+    def test_never_skips_every_backend(self):
+        backends = [SimpleNamespace(name="EasyOCR"), SimpleNamespace(name="Tesseract")]
+        self.record_runs("EasyOCR", 40, 1.0, accepted=False)
+        self.record_runs("Tesseract", 40, 1.0, accepted=False)
+
+        with patch('agent_chat_app.receipts.services.ocr_stats.random.betavariate', side_effect=beta_mean):
+            self.assertEqual([b.name for b in self.stats.order(backends)], ["EasyOCR"])
+
+    def test_reliable_leader_holds_back_other_backends(self):
+        leader = CountingBackend("Tesseract", 0.9)
+        other = CountingBackend("EasyOCR", 0.95)
+        self.record_runs("Tesseract", 30, 0.5, accepted=True)
+        self.record_runs("EasyOCR", 30, 5.0, accepted=True)
+        service = AdaptiveHybridOCRService(confidence_threshold=0.75, timeout=10)
+        service.use_worker_processes = False
+        service.stats = self.stats
+        service.available_local_backends = [other, leader]
+
+        with patch('agent_chat_app.receipts.services.ocr_stats.random.betavariate', side_effect=beta_mean):
+            results = asyncio.run(service._run_local_backends(np.zeros((10, 10), dtype=np.uint8)))
+
+        self.assertEqual([r.backend_name for r in results], ["Tesseract"])
+        self.assertEqual((leader.calls, other.calls), (1, 0))
+        self.assertEqual(self.stats.get(["Tesseract"])["Tesseract"].runs, 31)
+
+    def test_cancelled_backend_is_recorded_as_censored(self):
+        fast = CountingBackend("Tesseract", 0.9)
+        slow = SlowBackend("EasyOCR")
+        service = AdaptiveHybridOCRService(confidence_threshold=0.75, timeout=10)
+        service.use_worker_processes = False
+        service.adaptive_ordering = False
+        service.stats = self.stats
+        service.available_local_backends = [fast, slow]
+
+        results = asyncio.run(service._run_local_backends(np.zeros((10, 10), dtype=np.uint8)))
+
+        self.assertEqual([r.backend_name for r in results], ["Tesseract"])
+        slow_stats = self.stats.get(["EasyOCR"])["EasyOCR"]
+        self.assertEqual((slow_stats.runs, slow_stats.censored, slow_stats.accepted), (1, 1, 0))
+
+    def test_runs_are_appended_to_redis_lists(self):
+        redis = FakeRedis()
+        with patch.object(OCRBackendStats, '_get_redis', return_value=redis):
+            self.record_runs("Tesseract", 60, 1.0, accepted=True, store="Lidl")
+            stats = self.stats.get(["Tesseract"])["Tesseract"]
+            summary = self.stats.summary()
+
+        self.assertEqual(stats.runs, 50)
+        self.assertEqual(len(redis.lists[_stats_key("Tesseract", "Lidl")]), 50)
+        self.assertEqual(list(summary), ["Tesseract"])
+        self.assertEqual(set(redis.commands), {'rpush', 'ltrim', 'sadd', 'lrange'})
+
+    def test_monitoring_summary_lists_backends(self):
+        self.record_runs("Tesseract", 3, 1.0, accepted=True)
+
+        with patch('agent_chat_app.receipts.services.ocr_stats.get_ocr_backend_stats', return_value=self.stats):
+            summary = PerformanceMonitor().get_performance_summary()
+
+        self.assertEqual(summary['ocr_backends']['Tesseract']['runs'], 3)
+        self.assertEqual(summary['ocr_backends']['Tesseract']['p95_latency'], 1.0)
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+import billiard
+from django.test import SimpleTestCase
+
+from .services.ocr_workers import OCRBackendBusy, OCRWorker, OCRWorkerError, run_in_thread
+
+
+@dataclass
+class FakeResult:
+    text: str
+    pid: int
+
+
+class EchoBackend:
+    """Reads the image file back as text, in whichever process runs it"""
+    name = "Echo"
+
+    async def extract_text(self, image_path):
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(image_path)
+        with open(image_path) as file:
+            return FakeResult(text=file.read(), pid=os.getpid())
+
+
+class WarmBackend:
+    """Loads its "model" once per process, before any image"""
+    name = "Warm"
+
+    def __init__(self):
+        self.model = None
+
+    def warm_up(self):
+        self.model = os.getpid()
+
+    async def extract_text(self, image_path):
+        return FakeResult(text=str(self.model), pid=os.getpid())
+
+
+class StuckBackend:
+    """Blocks the way a CPU-bound backend does"""
+    name = "Stuck"
+
+    async def extract_text(self, image_path):
+        time.sleep(60)
+
+
+class NapBackend:
+    """Sleeps for the number of seconds written in the image file"""
+    name = "Nap"
+
+    async def extract_text(self, image_path):
+        with open(image_path) as file:
+            time.sleep(float(file.read()))
+        return FakeResult(text='done', pid=os.getpid())
+
+
+class GatedBackend:
+    """Blocks in its thread until released"""
+    name = "Gated"
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    async def extract_text(self, image_path):
+        self.release.wait(10)
+        return FakeResult(text='done', pid=os.getpid())
+
+
+def run_in_daemonic_child(image_path, results):
+    """Stands in for a Celery prefork child: start a worker and OCR one image"""
+    worker = OCRWorker(EchoBackend.name, f"{__name__}.{EchoBackend.__name__}")
+    try:
+        result = worker.run(image_path, 30, threading.Event())
+        results.put((result.text, result.pid != os.getpid()))
+    except Exception as e:
+        results.put((f"{type(e).__name__}: {e}", False))
+    finally:
+        worker.stop(kill=True)
+
+
+class TestOCRWorker(SimpleTestCase):
+    """Test OCR backends running in worker processes"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.image_path = os.path.join(directory.name, 'receipt.txt')
+        with open(self.image_path, 'w') as file:
+            file.write('PARAGON FISKALNY')
+
+    def image(self, name, content):
+        path = os.path.join(os.path.dirname(self.image_path), name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def ready_worker(self, backend):
+        worker = self.worker(backend)
+        worker.start()
+        deadline = time.monotonic() + 30
+        while not worker.is_ready() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return worker
+
+    def abandon(self, worker, image_path, timeout):
+        async def cancel_after_start():
+            task = asyncio.create_task(worker.extract_text(image_path, timeout))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_after_start())
+
+    def worker(self, backend, **limits):
+        worker = OCRWorker(backend.name, f"{__name__}.{backend.__name__}", **limits)
+        self.addCleanup(worker.stop, kill=True)
+        return worker
+
+    def test_worker_process_is_reused(self):
+        worker = self.worker(EchoBackend)
+
+        first = worker.run(self.image_path, 30, threading.Event())
+        second = worker.run(self.image_path, 30, threading.Event())
+
+        self.assertEqual(first.text, 'PARAGON FISKALNY')
+        self.assertNotEqual(first.pid, os.getpid())
+        self.assertEqual(first.pid, second.pid)
+
+    def test_backend_error_is_reported(self):
+        worker = self.worker(EchoBackend)
+
+        with self.assertRaisesRegex(OCRWorkerError, 'FileNotFoundError'):
+            worker.run(self.image_path + '.missing', 30, threading.Event())
+        self.assertTrue(worker.is_alive)
+
+    def test_overrunning_worker_is_killed(self):
+        worker = self.worker(StuckBackend)
+
+        with self.assertRaises(TimeoutError):
+            worker.run(self.image_path, 1, threading.Event())
+        self.assertFalse(worker.is_alive)
+
+    def test_cancelled_wait_returns_promptly(self):
+        worker = self.worker(StuckBackend)
+
+        async def cancel_after_start():
+            task = asyncio.create_task(worker.extract_text(self.image_path, 60))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        started = time.monotonic()
+        asyncio.run(cancel_after_start())
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_worker_reports_ready_after_warm_up(self):
+        worker = self.worker(WarmBackend)
+        worker.start()
+
+        deadline = time.monotonic() + 30
+        while not worker.is_ready() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertTrue(worker.status()['ready'])
+        result = worker.run(self.image_path, 30, threading.Event())
+        self.assertEqual(result.text, str(result.pid))
+
+    def test_worker_is_recycled_over_memory_cap(self):
+        worker = self.worker(WarmBackend, max_memory_mb=1)
+
+        first = worker.run(self.image_path, 30, threading.Event())
+        second = worker.run(self.image_path, 30, threading.Event())
+
+        self.assertNotEqual(first.pid, second.pid)
+        self.assertEqual(worker.started_count, 2)
+
+    def test_abandoned_image_does_not_count_against_the_next(self):
+        worker = self.ready_worker(NapBackend)
+        self.abandon(worker, self.image('slow.txt', '2'), 30)
+        pid = worker.pid
+
+        # The abandoned image still needs ~1.7s, longer than this image's timeout
+        result = worker.run(self.image('fast.txt', '0'), 1, threading.Event())
+
+        self.assertEqual(result.pid, pid)
+
+    def test_worker_stuck_on_abandoned_image_is_restarted(self):
+        worker = self.ready_worker(NapBackend)
+        self.abandon(worker, self.image('stuck.txt', '60'), 1)
+        pid = worker.pid
+
+        result = worker.run(self.image('fast.txt', '0'), 30, threading.Event())
+
+        self.assertNotEqual(result.pid, pid)
+        self.assertEqual(worker.started_count, 2)
+
+    def test_worker_starts_from_daemonic_process(self):
+        context = billiard.get_context('fork')
+        results = context.Queue()
+        child = context.Process(target=run_in_daemonic_child, args=(self.image_path, results), daemon=True)
+        child.start()
+        self.addCleanup(child.join, 5)
+
+        self.assertEqual(results.get(timeout=60), ('PARAGON FISKALNY', True))
+
+
+class TestInProcessFallback(SimpleTestCase):
+    """Test backends run in threads when no worker process is available"""
+
+    def test_abandoned_threads_are_bounded(self):
+        backend = GatedBackend()
+        self.addCleanup(backend.release.set)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(run_in_thread(backend, 'receipt.jpg', 0.2))
+        # The timed-out thread still runs, so the backend is not started again
+        with self.assertRaises(OCRBackendBusy):
+            asyncio.run(run_in_thread(backend, 'receipt.jpg', 0.2))
+
+        backend.release.set()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                result = asyncio.run(run_in_thread(backend, 'receipt.jpg', 5))
+                break
+            except OCRBackendBusy:
+                time.sleep(0.05)
+        self.assertEqual(result.pid, os.getpid())
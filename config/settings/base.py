@@ -1,6 +1,7 @@
 # ruff: noqa: ERA001, E501
 """Base settings to build other settings files upon."""
 
+import os
 import ssl
 from pathlib import Path
 
@@ -370,6 +371,117 @@ RAG_CACHE_TTL = 60 * 60  # 1 hour
 CONVERSATION_CACHE_TTL = 60 * 15  # 15 minutes
 USER_SETTINGS_CACHE_TTL = 60 * 30  # 30 minutes
 
+# Ollama
+# ------------------------------------------------------------------------------
+OLLAMA_BASE_URL = env("OLLAMA_BASE_URL", default="http://localhost:11434")
+# Pooled keep-alive connections shared by all Ollama callers in a process
+OLLAMA_MAX_CONNECTIONS = env.int("OLLAMA_MAX_CONNECTIONS", default=20)
+# Requests in flight to Ollama at once per process (sync and async each)
+OLLAMA_MAX_CONCURRENCY = env.int("OLLAMA_MAX_CONCURRENCY", default=8)
+# Retries for connection errors and 429/502/503/504, with jittered exponential backoff
+OLLAMA_MAX_RETRIES = env.int("OLLAMA_MAX_RETRIES", default=2)
+OLLAMA_RETRY_BACKOFF = 0.5  # seconds, doubled per attempt
+# Chat generations running at once per model (per ASGI process); the rest queue fairly per user
+LLM_MAX_IN_FLIGHT_PER_MODEL = env.int("LLM_MAX_IN_FLIGHT_PER_MODEL", default=2)
+# Per-model overrides, e.g. {"gemma3:4b": 4}
+LLM_MODEL_MAX_IN_FLIGHT = {}
+
+# Prompt assembly
+# ------------------------------------------------------------------------------
+# Local HuggingFace tokenizer.json per model name or family, e.g. {"gemma3": "/models/gemma3/tokenizer.json"};
+# models without one use a conservative ~3 characters per token estimate
+LLM_TOKENIZER_FILES = {}
+LLM_DEFAULT_TOKENIZER_FILE = env("LLM_DEFAULT_TOKENIZER_FILE", default="")
+# Context window (num_ctx) per model name or family; keep in line with the Ollama model config
+LLM_CONTEXT_WINDOWS = {}
+LLM_DEFAULT_CONTEXT_WINDOW = env.int("LLM_DEFAULT_CONTEXT_WINDOW", default=4096)
+# Tokens reserved for the response when the user has no max_tokens setting (capped at half the window)
+LLM_DEFAULT_RESPONSE_TOKENS = 1024
+# Share of the remaining prompt budget retrieved chunks may take before history is packed
+LLM_RAG_BUDGET_SHARE = 0.6
+# Most recent messages loaded as history candidates per turn
+LLM_MAX_HISTORY_MESSAGES = 20
+
+# Response cache
+# ------------------------------------------------------------------------------
+# Semantic cache: answers reused for near-identical questions of the same user,
+# model, system instruction and document set
+RESPONSE_CACHE_ENABLED = env.bool("RESPONSE_CACHE_ENABLED", default=True)
+# Minimum cosine similarity between question embeddings for a hit
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = 0.95
+# Answers kept per bucket (least recently used evicted) and their lifetime
+RESPONSE_CACHE_MAX_ENTRIES = 50
+RESPONSE_CACHE_TTL = 60 * 60 * 24  # 1 day
+# Shorter questions are usually follow-ups that depend on the conversation
+RESPONSE_CACHE_MIN_QUERY_WORDS = 4
+
+# Conversation summaries
+# ------------------------------------------------------------------------------
+# Most recent messages always sent verbatim; older turns are folded into Conversation.summary
+CONVERSATION_SUMMARY_KEEP_RECENT = 10
+# Queue summarization once this many messages piled up beyond the verbatim ones
+CONVERSATION_SUMMARY_EVERY = 10
+# Messages folded into the summary per task run
+CONVERSATION_SUMMARY_BATCH_SIZE = 40
+CONVERSATION_SUMMARY_MAX_WORDS = 250
+CONVERSATION_SUMMARY_MODEL = env("CONVERSATION_SUMMARY_MODEL", default="gemma3:4b")
+
+# Embeddings
+# ------------------------------------------------------------------------------
+# PDFs with at least this many pages are extracted in parallel, in page ranges,
+# on a process pool of PDF_EXTRACTION_WORKERS processes (1 = always serial).
+# Celery prefork children are daemonic and cannot start the pool; they extract serially
+PDF_PARALLEL_MIN_PAGES = 50
+PDF_PAGE_RANGE_SIZE = 20
+PDF_EXTRACTION_WORKERS = env.int("PDF_EXTRACTION_WORKERS", default=min(4, os.cpu_count() or 1))
+# Chunks embedded, bulk-inserted and upserted to ChromaDB per batch during ingest
+RAG_CHUNK_BATCH_SIZE = env.int("RAG_CHUNK_BATCH_SIZE", default=100)
+# Texts sent per /api/embed call when generating embeddings in bulk
+EMBEDDING_BATCH_SIZE = env.int("EMBEDDING_BATCH_SIZE", default=64)
+# Concurrent /api/embeddings requests when the multi-input endpoint is unavailable
+EMBEDDING_MAX_WORKERS = env.int("EMBEDDING_MAX_WORKERS", default=4)
+# Content-addressed embedding cache (in-process LRU + Redis float32 tier)
+EMBEDDING_CACHE_ENABLED = env.bool("EMBEDDING_CACHE_ENABLED", default=True)
+EMBEDDING_CACHE_MAX_ENTRIES = env.int("EMBEDDING_CACHE_MAX_ENTRIES", default=4096)
+EMBEDDING_CACHE_TTL = 60 * 60 * 24 * 7  # 7 days
+# Storage precision of DocumentChunk embeddings: "float32" or "float16" (half the size)
+EMBEDDING_STORAGE_DTYPE = env("EMBEDDING_STORAGE_DTYPE", default="float32")
+# On-disk location of the ChromaDB persistent store (opened once per process)
+CHROMADB_PATH = env("CHROMADB_PATH", default=str(BASE_DIR / "chromadb"))
+# Cached per-user "has processed documents" flag; Document save/delete invalidates it
+RAG_HAS_DOCUMENTS_CACHE_TTL = 60 * 10  # 10 minutes
+# Give every user their own ChromaDB collection instead of filtering a shared one
+# by user_id (move existing chunks with `manage.py backfill_chunk_user_ids --shard`)
+RAG_PER_USER_COLLECTIONS = env.bool("RAG_PER_USER_COLLECTIONS", default=False)
+# Per-user BM25 keyword index (SQLite FTS5) fused with vector hits by reciprocal
+# rank fusion; when off, ingest skips the index too. Index existing chunks with
+# `manage.py rebuild_lexical_index`
+RAG_LEXICAL_SEARCH = env.bool("RAG_LEXICAL_SEARCH", default=True)
+LEXICAL_INDEX_PATH = env("LEXICAL_INDEX_PATH", default=str(BASE_DIR / "lexical_index"))
+# Hits taken from each retriever before fusion, and the RRF rank constant
+RAG_FUSION_CANDIDATES = 20
+RAG_RRF_K = 60
+# Reranking after retrieval: fetch RAG_RERANK_OVERFETCH times the chunks a prompt
+# uses, merge overlapping neighbours (at least RAG_DEDUPE_MIN_OVERLAP shared
+# characters) and pick by Maximal Marginal Relevance (1.0 = relevance only).
+# RAG_RERANKER_MODEL names an optional CPU cross-encoder (sentence-transformers),
+# e.g. "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"; empty = skip that stage
+RAG_RERANK = env.bool("RAG_RERANK", default=True)
+RAG_RERANK_OVERFETCH = 4
+RAG_MMR_LAMBDA = 0.7
+RAG_DEDUPE_MIN_OVERLAP = 50
+RAG_RERANKER_MODEL = env("RAG_RERANKER_MODEL", default="")
+# Response confidence from the cosine similarity distribution of the retrieved
+# chunks; a top-1 margin of RAG_CONFIDENCE_MARGIN over the runner-up counts as clear
+RAG_CONFIDENCE_MARGIN = 0.15
+
+# Chat streaming
+# ------------------------------------------------------------------------------
+# Seconds of generated tokens coalesced into one chat_token WebSocket event
+CHAT_STREAM_FLUSH_INTERVAL = 0.05
+# Max seconds to wait for the next chunk of a streamed Ollama response
+OLLAMA_STREAM_READ_TIMEOUT = 90
+
 # Celery
 # ------------------------------------------------------------------------------
 if USE_TZ:
@@ -448,6 +560,38 @@ RECEIPT_PROCESSING_TIMEOUT = env.int("RECEIPT_PROCESSING_TIMEOUT", default=300)
 SLOW_PROCESSING_THRESHOLD = env.int("SLOW_PROCESSING_THRESHOLD", default=120)  # 2 minutes
 HIGH_FAILURE_RATE_THRESHOLD = env.float("HIGH_FAILURE_RATE_THRESHOLD", default=0.2)  # 20%
 ALERT_COOLDOWN_MINUTES = env.int("ALERT_COOLDOWN_MINUTES", default=30)
+# Run the local OCR backends (EasyOCR, Tesseract, PaddleOCR) in parallel, each in
+# a long-lived worker process that is killed when it overruns the OCR timeout
+OCR_WORKER_PROCESSES = env.bool("OCR_WORKER_PROCESSES", default=True)
+# Start the OCR workers (and load their models) in every Celery worker process;
+# turn off for workers that do not consume the receipt_processing queue
+OCR_PREWARM_WORKERS = env.bool("OCR_PREWARM_WORKERS", default=True)
+# Seconds a fresh OCR worker may spend loading models before its first image
+OCR_WORKER_STARTUP_TIMEOUT = 180
+# OCR workers are replaced after this many images or above this resident size.
+# Every Celery worker process has its own OCR workers, so the memory cap applies
+# concurrency x local backends times per host; keep the receipt queue's concurrency low
+OCR_WORKER_MAX_JOBS = env.int("OCR_WORKER_MAX_JOBS", default=500)
+OCR_WORKER_MAX_MEMORY_MB = env.int("OCR_WORKER_MAX_MEMORY_MB", default=768)
+# Without worker processes a backend runs in a thread that a timeout cannot stop;
+# a backend with this many such threads still running is skipped until one ends
+OCR_MAX_ABANDONED_THREADS = 1
+# Preprocessing downscales photos so the receipt in them is a roll of this width
+# at this DPI; without a detected receipt the photo counts as this many receipts wide
+OCR_TARGET_DPI = 300
+OCR_RECEIPT_WIDTH_MM = 80
+OCR_DOWNSCALE_FALLBACK_FACTOR = 2.5
+# Reuse a user's OCR result when they upload the identical receipt file again
+OCR_RESULT_CACHE = env.bool("OCR_RESULT_CACHE", default=True)
+# Order, skip and stagger local OCR backends by their recent latency and acceptance rate
+OCR_ADAPTIVE_ORDERING = env.bool("OCR_ADAPTIVE_ORDERING", default=True)
+# Runs kept per backend (and store), and runs needed before a backend is skipped or waited for
+OCR_STATS_WINDOW = 200
+OCR_STATS_MIN_RUNS = 20
+# Skip a backend whose sampled acceptance rate falls below this
+OCR_SKIP_BELOW_ACCEPTANCE = 0.05
+# The other backends wait up to the leader's p95 latency when it is accepted this often
+OCR_HEDGE_ABOVE_ACCEPTANCE = 0.8
 # django-allauth
 # ------------------------------------------------------------------------------
 ACCOUNT_ALLOW_REGISTRATION = env.bool("DJANGO_ACCOUNT_ALLOW_REGISTRATION", True)
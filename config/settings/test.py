@@ -44,5 +44,10 @@ DATABASES = {
     }
 }
 
+# RAG
+# ------------------------------------------------------------------------------
+# Tests that need the keyword index enable it with their own LEXICAL_INDEX_PATH
+RAG_LEXICAL_SEARCH = False
+
 # Your stuff...
 # ------------------------------------------------------------------------------